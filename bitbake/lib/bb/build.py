@@ -34,6 +34,7 @@ import time
 import stat
 import bb
 import bb.msg
+import bb.persist_data
 import bb.process
 from bb import data, event, utils
 
@@ -578,6 +579,13 @@ def exec_task(fn, task, d, profile = False):
             failedevent = TaskFailed(task, None, d, True)
             event.fire(failedevent, d)
         return 1
+    finally:
+        # Batched persistent data writes must land before the task exits,
+        # but failing to write them mustn't replace the task's result
+        try:
+            bb.persist_data.sync_all()
+        except Exception as exc:
+            logger.warning("Unable to write persistent data after %s: %s" % (task, exc))
 
 def stamp_internal(taskname, d, file_name, baseonly=False):
     """
@@ -30,8 +30,13 @@
 
 import os
 import sys
+import stat
+import concurrent.futures
 import logging
 import pickle
+import hashlib
+import tempfile
+import time
 from collections import defaultdict
 import bb.utils
 
@@ -260,6 +265,7 @@ class Cache(object):
         self.clean = set()
         self.checked = set()
         self.depends_cache = {}
+        self.mtimes = {}
         self.data = None
         self.data_fn = None
         self.cacheclean = True
@@ -454,6 +460,125 @@ class Cache(object):
 
         return cached, skipped, virtuals
 
+    @staticmethod
+    def checksum_files(file_checksums):
+        """
+        Yield (filename, existed) for the non-wildcard entries of a
+        recipe's file_checksums lists.
+        """
+        for _, fl in file_checksums.items():
+            fl = fl.strip()
+            while fl:
+                # A .split() would be simpler but means spaces or colons in filenames would break
+                a = fl.find(":True")
+                b = fl.find(":False")
+                if ((a < 0) and b) or ((b > 0) and (b < a)):
+                   f = fl[:b+6]
+                   fl = fl[b+7:]
+                elif ((b < 0) and a) or ((a > 0) and (a < b)):
+                   f = fl[:a+5]
+                   fl = fl[a+6:]
+                else:
+                   break
+                fl = fl.strip()
+                if "*" in f:
+                    continue
+                f, exist = f.split(":")
+                yield f, exist == "True"
+
+    def dep_mtime(self, f):
+        if f in self.mtimes:
+            return self.mtimes[f] or 0
+        return bb.parse.cached_mtime_noerror(f)
+
+    def exists(self, f):
+        if f in self.mtimes:
+            return self.mtimes[f] is not None
+        return os.path.exists(f)
+
+    def prefetch_mtimes(self, fns, threads):
+        """
+        Stat every file the cache entries for fns depend on, each one
+        only once however many recipes share it, using a pool of threads
+        so the latency of slow (e.g. network) filesystems overlaps.
+        """
+        paths = set()
+        for fn in fns:
+            if fn not in self.depends_cache:
+                continue
+            paths.add(fn)
+            info = self.depends_cache[fn][0]
+            if info.file_depends:
+                paths.update(f for f, _ in info.file_depends)
+            if hasattr(info, 'file_checksums'):
+                paths.update(f for f, _ in self.checksum_files(info.file_checksums))
+        paths = list(paths)
+
+        def stat_chunk(chunk):
+            mtimes = []
+            for f in chunk:
+                try:
+                    mtimes.append(os.stat(f)[stat.ST_MTIME])
+                except OSError:
+                    mtimes.append(None)
+            return mtimes
+
+        chunksize = 256
+        chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+        if len(chunks) > 1 and threads > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                results = list(executor.map(stat_chunk, chunks))
+        else:
+            results = [stat_chunk(chunk) for chunk in chunks]
+        for chunk, mtimes in zip(chunks, results):
+            self.mtimes.update(zip(chunk, mtimes))
+
+    def cacheValidAll(self, fileappends, threads=1):
+        """
+        Check the cache validity of each (fn, appends) pair, statting
+        the files they share only once. Returns the set of valid fns.
+        """
+        valid = set()
+        if not self.has_cache:
+            return valid
+        for fn, appends in fileappends:
+            if fn in self.checked and fn in self.depends_cache and \
+                    appends != self.depends_cache[fn][0].appends:
+                self.invalidate_recipe(fn)
+        self.prefetch_mtimes([fn for fn, _ in fileappends if fn not in self.checked], threads)
+        try:
+            for fn, appends in fileappends:
+                if self.cacheValid(fn, appends):
+                    valid.add(fn)
+        finally:
+            self.mtimes = {}
+        return valid
+
+    def invalidate(self, paths):
+        """
+        Forget the validity of the recipes which depend on any of paths,
+        or which weren't found valid last time, so that the next
+        cacheValidAll() checks them again. This lets a resident server
+        reuse the cache and only reparse what changed.
+        """
+        paths = set(paths)
+        for fn in list(self.checked):
+            if fn in self.clean and fn in self.depends_cache:
+                info = self.depends_cache[fn][0]
+                if fn not in paths and \
+                        not any(f in paths for f, _ in info.file_depends or []) and \
+                        not (hasattr(info, 'file_checksums') and
+                             any(f in paths for f, _ in self.checksum_files(info.file_checksums))):
+                    continue
+            self.invalidate_recipe(fn)
+
+    def invalidate_recipe(self, fn):
+        self.checked.discard(fn)
+        self.clean.discard(fn)
+        if fn in self.depends_cache:
+            for cls in self.depends_cache[fn][0].variants:
+                self.clean.discard(self.realfn2virtual(fn, cls))
+
     def cacheValid(self, fn, appends):
         """
         Is the cache valid for fn?
@@ -485,7 +610,7 @@ class Cache(object):
             logger.debug(2, "Cache: %s is not cached", fn)
             return False
 
-        mtime = bb.parse.cached_mtime_noerror(fn)
+        mtime = self.dep_mtime(fn)
 
         # Check file still exists
         if mtime == 0:
@@ -504,7 +629,7 @@ class Cache(object):
         depends = info_array[0].file_depends
         if depends:
             for f, old_mtime in depends:
-                fmtime = bb.parse.cached_mtime_noerror(f)
+                fmtime = self.dep_mtime(f)
                 # Check if file still exists
                 if old_mtime != 0 and fmtime == 0:
                     logger.debug(2, "Cache: %s's dependency %s was removed",
@@ -519,29 +644,12 @@ class Cache(object):
                     return False
 
         if hasattr(info_array[0], 'file_checksums'):
-            for _, fl in info_array[0].file_checksums.items():
-                fl = fl.strip()
-                while fl:
-                    # A .split() would be simpler but means spaces or colons in filenames would break
-                    a = fl.find(":True")
-                    b = fl.find(":False")
-                    if ((a < 0) and b) or ((b > 0) and (b < a)):
-                       f = fl[:b+6]
-                       fl = fl[b+7:]
-                    elif ((b < 0) and a) or ((a > 0) and (a < b)):
-                       f = fl[:a+5]
-                       fl = fl[a+6:]
-                    else:
-                       break
-                    fl = fl.strip()
-                    if "*" in f:
-                        continue
-                    f, exist = f.split(":")
-                    if (exist == "True" and not os.path.exists(f)) or (exist == "False" and os.path.exists(f)):
-                        logger.debug(2, "Cache: %s's file checksum list file %s changed",
-                                        fn, f)
-                        self.remove(fn)
-                        return False
+            for f, exist in self.checksum_files(info_array[0].file_checksums):
+                if exist != self.exists(f):
+                    logger.debug(2, "Cache: %s's file checksum list file %s changed",
+                                    fn, f)
+                    self.remove(fn)
+                    return False
 
         if appends != info_array[0].appends:
             logger.debug(2, "Cache: appends for %s changed", fn)
@@ -584,10 +692,11 @@ class Cache(object):
             logger.debug(1, "Marking %s as unclean", fn)
             self.clean.remove(fn)
 
-    def sync(self):
+    def sync(self, keep=False):
         """
         Save the cache
         Called from the parser when complete (or exiting)
+        If keep is set, the cache stays usable for another parse.
         """
 
         if not self.has_cache:
@@ -622,7 +731,10 @@ class Cache(object):
                     cache_class_name = cache_class.__name__
                     file_dict[cache_class_name].close()
 
-        del self.depends_cache
+        if keep:
+            self.cacheclean = True
+        else:
+            del self.depends_cache
 
     @staticmethod
     def mtime(cachefile):
@@ -634,6 +746,10 @@ class Cache(object):
 
             if watcher:
                 watcher(info_array[0].file_depends)
+                # Whether these exist is part of the cache validity too, a
+                # resident server must hear about them to reuse the cache
+                if hasattr(info_array[0], 'file_checksums'):
+                    watcher(list(self.checksum_files(info_array[0].file_checksums)))
 
         if not self.has_cache:
             return
@@ -742,8 +858,18 @@ class MultiProcessCache(object):
     BitBake multi-process cache implementation
 
     Used by the codeparser & file checksum caches
+
+    Each process writes the entries it added as an immutable shard into
+    <cachefile>.d/, named after the checksum of its contents, so saving
+    needs no locks. Shards are folded into the master cache file by
+    save_merge(); if another process is already merging, the shards are
+    simply left for a later run to pick up.
     """
 
+    # Age in seconds after which a shard's temporary file is assumed to
+    # have been left behind by a writer which died
+    stale_tmp_age = 600
+
     def __init__(self):
         self.cachefile = None
         self.cachedata = self.create_cachedata()
@@ -759,50 +885,56 @@ class MultiProcessCache(object):
                                       cache_file_name or self.__class__.cache_file_name)
         logger.debug(1, "Using cache in '%s'", self.cachefile)
 
-        glf = bb.utils.lockfile(self.cachefile + ".lock")
+        # The master cache is only ever replaced atomically so no lock
+        # is needed to read it
+        data = self.load_cachefile(self.cachefile)
+        if data is None:
+            return
 
+        self.cachedata = data
+
+    def load_cachefile(self, f):
         try:
-            with open(self.cachefile, "rb") as f:
-                p = pickle.Unpickler(f)
+            with open(f, "rb") as fd:
+                p = pickle.Unpickler(fd)
                 data, version = p.load()
         except:
-            bb.utils.unlockfile(glf)
-            return
-
-        bb.utils.unlockfile(glf)
+            return None
 
         if version != self.__class__.CACHE_VERSION:
-            return
+            return None
 
-        self.cachedata = data
+        return data
 
     def create_cachedata(self):
         data = [{}]
         return data
 
+    def shard_dir(self):
+        return self.cachefile + ".d"
+
     def save_extras(self):
         if not self.cachefile:
             return
 
-        glf = bb.utils.lockfile(self.cachefile + ".lock", shared=True)
-
-        i = os.getpid()
-        lf = None
-        while not lf:
-            lf = bb.utils.lockfile(self.cachefile + ".lock." + str(i), retry=False)
-            if not lf or os.path.exists(self.cachefile + "-" + str(i)):
-                if lf:
-                    bb.utils.unlockfile(lf)
-                    lf = None
-                i = i + 1
-                continue
+        if not any(self.cachedata_extras):
+            return
 
-            with open(self.cachefile + "-" + str(i), "wb") as f:
-                p = pickle.Pickler(f, -1)
-                p.dump([self.cachedata_extras, self.__class__.CACHE_VERSION])
+        content = pickle.dumps([self.cachedata_extras, self.__class__.CACHE_VERSION], -1)
+        sharddir = self.shard_dir()
+        bb.utils.mkdirhier(sharddir)
+        shard = os.path.join(sharddir, hashlib.sha256(content).hexdigest())
+        if os.path.exists(shard):
+            return
 
-        bb.utils.unlockfile(lf)
-        bb.utils.unlockfile(glf)
+        fd, tmpfile = tempfile.mkstemp(dir=sharddir, prefix=".tmp.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.rename(tmpfile, shard)
+        except (OSError, IOError):
+            bb.utils.remove(tmpfile)
+            raise
 
     def merge_data(self, source, dest):
         for j in range(0,len(dest)):
@@ -814,30 +946,62 @@ class MultiProcessCache(object):
         if not self.cachefile:
             return
 
-        glf = bb.utils.lockfile(self.cachefile + ".lock")
+        sharddir = self.shard_dir()
+        try:
+            names = os.listdir(sharddir)
+        except OSError:
+            return
+        shards = [os.path.join(sharddir, f) for f in names if not f.startswith(".")]
+        # Temporary files left behind by a writer which died
+        stale = [os.path.join(sharddir, f) for f in names if f.startswith(".tmp.")]
+        if not shards and not stale:
+            return
 
-        data = self.cachedata
+        # Our in-memory copy is used for lookups for as long as we run
+        # (e.g. in a memory resident server), so it needs the shards too
+        for f in shards:
+            extradata = self.load_cachefile(f)
+            if extradata is not None:
+                self.merge_data(extradata, self.cachedata)
+
+        # Don't wait on another process which is already merging, whatever
+        # we leave behind is merged on a later run
+        glf = bb.utils.lockfile(self.cachefile + ".lock", retry=False)
+        if not glf:
+            return
 
-        for f in [y for y in os.listdir(os.path.dirname(self.cachefile)) if y.startswith(os.path.basename(self.cachefile) + '-')]:
-            f = os.path.join(os.path.dirname(self.cachefile), f)
+        try:
+            now = time.time()
+            for f in stale:
+                try:
+                    if now - os.stat(f).st_mtime > self.stale_tmp_age:
+                        bb.utils.remove(f)
+                except OSError:
+                    pass
+
+            # Merge into what is currently on disk rather than into our
+            # in-memory copy, which may be stale and may be in use
+            data = self.load_cachefile(self.cachefile)
+            if data is None:
+                data = self.create_cachedata()
+
+            for f in shards:
+                extradata = self.load_cachefile(f)
+                if extradata is not None:
+                    self.merge_data(extradata, data)
+
+            fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(self.cachefile),
+                                           prefix=os.path.basename(self.cachefile) + ".")
             try:
-                with open(f, "rb") as fd:
-                    p = pickle.Unpickler(fd)
-                    extradata, version = p.load()
-            except (IOError, EOFError):
-                os.unlink(f)
-                continue
-
-            if version != self.__class__.CACHE_VERSION:
-                os.unlink(f)
-                continue
-
-            self.merge_data(extradata, data)
-            os.unlink(f)
-
-        with open(self.cachefile, "wb") as f:
-            p = pickle.Pickler(f, -1)
-            p.dump([data, self.__class__.CACHE_VERSION])
-
-        bb.utils.unlockfile(glf)
-
+                with os.fdopen(fd, "wb") as f:
+                    p = pickle.Pickler(f, -1)
+                    p.dump([data, self.__class__.CACHE_VERSION])
+                os.rename(tmpfile, self.cachefile)
+            except (OSError, IOError):
+                bb.utils.remove(tmpfile)
+                raise
+
+            for f in shards:
+                bb.utils.remove(f)
+        finally:
+            bb.utils.unlockfile(glf)
@@ -173,6 +173,45 @@ class CommandsSync:
         return command.cooker.data.getVar(varname, expand)
     getVariable.readonly = True
 
+    def getVariables(self, command, params):
+        """
+        Read the values of several variables from data in one call,
+        returned as a dict
+        """
+        varnames = params[0]
+        expand = True
+        if len(params) > 1:
+            expand = params[1] in (True, "True")
+
+        return dict((varname, command.cooker.data.getVar(varname, expand)) for varname in varnames)
+    getVariables.readonly = True
+    getVariables.needconfig = True
+
+    def getRecipeVariables(self, command, params):
+        """
+        Read the values of several variables from the datastore of one
+        recipe, given as a file name or (once parsed) a recipe name,
+        returned as a dict
+        """
+        target = params[0]
+        varnames = params[1]
+        expand = True
+        if len(params) > 2:
+            expand = params[2] in (True, "True")
+
+        # Being readonly this mustn't parse the configuration or collect
+        # the recipe files itself, a command which does has to run first
+        if command.cooker.recipecache is None or not getattr(command.cooker, "collection", None):
+            raise CommandError("Recipe data is not available until the recipes have been parsed")
+
+        try:
+            envdata = command.cooker.getRecipeData(target)
+        except bb.providers.NoProvider:
+            raise CommandError("Unable to find a recipe for %s" % target)
+        return dict((varname, envdata.getVar(varname, expand)) for varname in varnames)
+    getRecipeVariables.readonly = True
+    getRecipeVariables.needconfig = True
+
     def setVariable(self, command, params):
         """
         Set the value of variable in data
@@ -180,6 +219,7 @@ class CommandsSync:
         varname = params[0]
         value = str(params[1])
         command.cooker.data.setVar(varname, value)
+        command.cooker.recipedata_cache.clear()
 
     def getSetVariable(self, command, params):
         """
@@ -189,6 +229,7 @@ class CommandsSync:
         varname = params[0]
         result = self.getVariable(command, params)
         command.cooker.data.setVar(varname, result)
+        command.cooker.recipedata_cache.clear()
         return result
 
     def setConfig(self, command, params):
@@ -24,22 +24,25 @@
 
 
 import sys, os, glob, os.path, re, time
+import concurrent.futures
 import atexit
 import itertools
 import logging
 import multiprocessing
+import pickle
 import sre_constants
 import threading
 from io import StringIO
 from contextlib import closing
 from functools import wraps
-from collections import defaultdict
-import bb, bb.exceptions, bb.command
+from collections import defaultdict, OrderedDict
+import bb, bb.exceptions, bb.command, bb.persist_data
 from bb import utils, data, parse, event, cache, providers, taskdata, runqueue, build
 import queue
 import signal
 import subprocess
 import errno
+import tempfile
 import prserv.serv
 import pyinotify
 
@@ -133,16 +136,22 @@ class BBCooker:
         self.configuration = configuration
 
         self.configwatcher = pyinotify.WatchManager()
-        self.configwatcher.bbseen = []
-        self.configwatcher.bbwatchedfiles = []
+        self.configwatcher.bbseen = set()
+        self.configwatcher.bbwatchedfiles = set()
         self.confignotifier = pyinotify.Notifier(self.configwatcher, self.config_notifications)
+        self.confignotifier.coalesce_events()
         self.watchmask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE | \
                          pyinotify.IN_DELETE_SELF | pyinotify.IN_MODIFY | pyinotify.IN_MOVE_SELF | \
                          pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO 
         self.watcher = pyinotify.WatchManager()
-        self.watcher.bbseen = []
-        self.watcher.bbwatchedfiles = []
+        self.watcher.bbseen = set()
+        self.watcher.bbwatchedfiles = set()
         self.notifier = pyinotify.Notifier(self.watcher, self.notifications)
+        self.notifier.coalesce_events()
+
+        # Recently used recipe datastores, see getRecipeData()
+        self.recipedata_cache = OrderedDict()
+        self.recipedata_cache_size = 16
 
         # If being called by something like tinfoil, we need to clean cached data 
         # which may now be invalid
@@ -151,15 +160,22 @@ class BBCooker:
 
         self.initConfigurationData()
 
-        self.inotify_modified_files = []
+        self.inotify_modified_files = set()
+        self.recipe_modified_files = set()
 
         def _process_inotify_updates(server, notifier_list, abort):
             for n in notifier_list:
                 if n.check_events(timeout=0):
-                    # read notified events and enqeue them
+                    # read notified events and enqeue them, waiting for
+                    # bursts (e.g. from a git checkout) to settle so the
+                    # duplicates are coalesced and handled in one pass
+                    settle = time.time() + 1.0
                     n.read_events()
+                    while time.time() < settle and n.check_events(timeout=50):
+                        n.read_events()
                     n.process_events()
-            return 1.0
+            # Have the server wake us when there are new events
+            return [self.configwatcher.get_fd(), self.watcher.get_fd()]
 
         self.configuration.server_register_idlecallback(_process_inotify_updates, [self.confignotifier, self.notifier])
 
@@ -201,24 +217,27 @@ class BBCooker:
     def config_notifications(self, event):
         if not event.pathname in self.configwatcher.bbwatchedfiles:
             return
-        if not event.pathname in self.inotify_modified_files:
-            self.inotify_modified_files.append(event.pathname)
+        self.inotify_modified_files.add(event.pathname)
+        self.recipedata_cache.clear()
         self.baseconfig_valid = False
 
     def notifications(self, event):
-        if not event.pathname in self.inotify_modified_files:
-            self.inotify_modified_files.append(event.pathname)
+        self.inotify_modified_files.add(event.pathname)
+        self.recipe_modified_files.add(event.pathname)
+        self.recipedata_cache.clear()
         self.parsecache_valid = False
 
     def add_filewatch(self, deps, watcher=None):
         if not watcher:
             watcher = self.watcher
-        for i in deps:
-            watcher.bbwatchedfiles.append(i[0])
-            f = os.path.dirname(i[0])
+        files = set(i[0] for i in deps)
+        watcher.bbwatchedfiles.update(files)
+        # Watches are per directory, so only the directories not already
+        # seen need any work
+        for f in sorted(set(os.path.dirname(i) for i in files) - watcher.bbseen):
             if f in watcher.bbseen:
                 continue
-            watcher.bbseen.append(f)
+            watcher.bbseen.add(f)
             watchtarget = None
             while True:
                 # We try and add watches for files that don't exist but if they did, would influence
@@ -227,7 +246,7 @@ class BBCooker:
                 try:
                     watcher.add_watch(f, self.watchmask, quiet=False)
                     if watchtarget:
-                        watcher.bbwatchedfiles.append(watchtarget)
+                        watcher.bbwatchedfiles.add(watchtarget)
                     break
                 except pyinotify.WatchManagerError as e:
                     if 'ENOENT' in str(e):
@@ -235,7 +254,7 @@ class BBCooker:
                         f = os.path.dirname(f)
                         if f in watcher.bbseen:
                             break
-                        watcher.bbseen.append(f)
+                        watcher.bbseen.add(f)
                         continue
                     if 'ENOSPC' in str(e):
                         providerlog.error("No space left on device or exceeds fs.inotify.max_user_watches?")
@@ -266,6 +285,7 @@ class BBCooker:
 
         self.state = state.initial
         self.caches_array = []
+        self.recipedata_cache.clear()
 
         # Need to preserve BB_CONSOLELOG over resets
         consolelog = None
@@ -1218,6 +1238,48 @@ class BBCooker:
         self.data.setVar("DATE", time.strftime('%Y%m%d', t))
         self.data.setVar("TIME", time.strftime('%H%M%S', t))
 
+    def getRecipeData(self, target):
+        """
+        Return the full datastore for target, an absolute recipe file name
+        or, once the recipes have been parsed, a recipe name. The most
+        recently used datastores are kept until recipe or configuration
+        files change.
+        """
+        if self.recipecache is None:
+            self.parseConfiguration()
+
+        # Relative file names would be resolved against the server's cwd
+        # rather than the client's, so clients have to pass absolute ones.
+        # Recipe names can be looked up whenever a parse has completed,
+        # the state is back to initial once the command which parsed ends
+        fn, cls = bb.cache.Cache.virtualfn2realfn(target)
+        if not (os.path.isabs(fn) and os.path.isfile(fn)):
+            if not self.parsecache_valid or self.state == state.parsing or \
+                    target not in self.recipecache.pkg_pn:
+                raise bb.providers.NoProvider(target)
+            _, _, _, preferred = bb.providers.findBestProvider(target, self.data, self.recipecache,
+                                                               self.recipecache.pkg_pn)
+            if not preferred:
+                raise bb.providers.NoProvider(target)
+            fn, cls = bb.cache.Cache.virtualfn2realfn(preferred)
+
+        if not getattr(self, "collection", None):
+            self.collection = CookerCollectFiles(self.recipecache.bbfile_config_priorities)
+            self.collection.collect_bbfiles(self.data, self.expanded_data)
+        appends = self.collection.get_file_appends(fn)
+        virtualfn = bb.cache.Cache.realfn2virtual(fn, cls)
+
+        key = (virtualfn, tuple(appends))
+        if key in self.recipedata_cache:
+            self.recipedata_cache.move_to_end(key)
+            return self.recipedata_cache[key]
+
+        envdata = bb.cache.Cache.loadDataFull(virtualfn, appends, self.data)
+        self.recipedata_cache[key] = envdata
+        while len(self.recipedata_cache) > self.recipedata_cache_size:
+            self.recipedata_cache.popitem(last=False)
+        return envdata
+
     def matchFiles(self, bf):
         """
         Find the .bb files which match the expression in 'buildfile'.
@@ -1350,6 +1412,7 @@ class BBCooker:
                 return False
 
             if not retval:
+                bb.persist_data.sync_all()
                 bb.event.fire(bb.event.BuildCompleted(len(rq.rqdata.runq_fnid), buildname, item, failures, interrupted), self.expanded_data)
                 self.command.finishAsyncCommand(msg)
                 return False
@@ -1386,6 +1449,7 @@ class BBCooker:
                 return False
 
             if not retval:
+                bb.persist_data.sync_all()
                 bb.event.fire(bb.event.BuildCompleted(len(rq.rqdata.runq_fnid), buildname, targets, failures, interrupted), self.data)
                 self.command.finishAsyncCommand(msg)
                 return False
@@ -1508,7 +1572,7 @@ class BBCooker:
             bb.parse.update_cache(p)
             if p in bb.parse.BBHandler.cached_statements:
                 del bb.parse.BBHandler.cached_statements[p]
-        self.inotify_modified_files = []
+        self.inotify_modified_files = set()
 
         if not self.baseconfig_valid:
             logger.debug(1, "Reloading base configuration data")
@@ -1543,7 +1607,17 @@ class BBCooker:
             self.collection = CookerCollectFiles(self.recipecache.bbfile_config_priorities)
             (filelist, masked) = self.collection.collect_bbfiles(self.data, self.expanded_data)
 
-            self.parser = CookerParser(self, filelist, masked)
+            # A resident server keeps the recipe cache from the last
+            # parse so only the recipes affected by the files changed
+            # since then are checked and reparsed
+            bb_cache = None
+            if self.parser and self.configuration.server_only:
+                bb_cache = self.parser.reusable_cache()
+                if bb_cache:
+                    bb_cache.invalidate(self.recipe_modified_files)
+            self.recipe_modified_files = set()
+
+            self.parser = CookerParser(self, filelist, masked, bb_cache)
             self.parsecache_valid = True
 
         self.state = state.parsing
@@ -1700,8 +1774,13 @@ class CookerExit(bb.event.Event):
 
 
 class CookerCollectFiles(object):
+    filelist_cache_version = "1"
+
     def __init__(self, priorities):
         self.bbappends = []
+        # Lookup structures for get_file_appends(), built on first use
+        self.bbappends_index = None
+        self.appendlist_cache = {}
         self.bbfile_config_priorities = priorities
 
     def calc_bbfile_priority( self, filename, matched = None ):
@@ -1723,17 +1802,115 @@ class CookerCollectFiles(object):
                 bbfiles.append(os.path.abspath(os.path.join(path, f)))
         return bbfiles
 
-    def find_bbfiles(self, path):
-        """Find all the .bb and .bbappend files in a directory"""
+    def find_bbfiles(self, path, seendirs=None):
+        """
+        Find all the .bb and .bbappend files in a directory. If seendirs
+        is given, the mtimes of the directories walked are recorded in it.
+        """
         found = []
-        for dir, dirs, files in os.walk(path):
-            for ignored in ('SCCS', 'CVS', '.svn'):
-                if ignored in dirs:
-                    dirs.remove(ignored)
-            found += [os.path.join(dir, f) for f in files if (f.endswith(['.bb', '.bbappend']))]
+        pending = [path]
+        while pending:
+            dir = pending.pop()
+            # Take the mtime before listing the directory, so that a change
+            # made while it is being listed shows up as a different mtime
+            if seendirs is not None:
+                seendirs[dir] = self.dir_mtime(dir)
+            try:
+                entries = sorted(os.scandir(dir), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk(), don't follow symlinks to directories
+                    if not entry.is_symlink() and entry.name not in ('SCCS', 'CVS', '.svn'):
+                        subdirs.append(entry.path)
+                elif entry.name.endswith(('.bb', '.bbappend')):
+                    found.append(entry.path)
+            pending.extend(reversed(subdirs))
 
         return found
 
+    @staticmethod
+    def dir_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def expand_bbfiles_entry(self, f, cached):
+        """
+        Expand one BBFILES entry, a directory or a glob, to the list of
+        files it refers to. Returns the list and the cache entry for it,
+        which records the mtimes of every directory the result depends
+        on. A cached entry is reused if none of those have changed. The
+        cache entry is None if a directory changed so recently that a
+        further change might not alter its mtime.
+        """
+        if cached:
+            seendirs, found = cached
+            if all(self.dir_mtime(d) == mtime for d, mtime in seendirs.items()):
+                return found, cached
+
+        seendirs = {}
+        if os.path.isdir(f):
+            found = self.find_bbfiles(f, seendirs)
+        else:
+            # The result can change whenever any directory glob has to
+            # list changes, i.e. those matching the pattern up to every
+            # component from the first one containing a wildcard onwards
+            # (a literal component after a wildcard still has to be
+            # looked up in each match). Their mtimes are taken before
+            # globbing, so changes made meanwhile aren't missed
+            parts = f.split(os.sep)
+            magic = [i for i in range(1, len(parts)) if glob.has_magic(parts[i])]
+            for i in range(magic[0] if magic else len(parts), len(parts)):
+                for d in glob.glob(os.sep.join(parts[:i]) or os.sep):
+                    if os.path.isdir(d):
+                        seendirs[d] = self.dir_mtime(d)
+            if not seendirs:
+                seendirs[os.path.dirname(f)] = self.dir_mtime(os.path.dirname(f))
+
+            globbed = glob.glob(f)
+            if not globbed and os.path.exists(f):
+                globbed = [f]
+            # glob gives files in order on disk. Sort to be deterministic.
+            found = sorted(globbed)
+
+        # Something changing a directory again within its mtime granularity
+        # wouldn't be noticed, so only cache results which have settled
+        now = time.time()
+        if any(mtime is not None and now - mtime / 1e9 < 2 for mtime in seendirs.values()):
+            return found, None
+
+        return found, (seendirs, found)
+
+    def load_filelist_cache(self, config):
+        cachedir = config.getVar("PERSISTENT_DIR", True) or config.getVar("CACHE", True)
+        if not cachedir:
+            return None, {}
+        cachefile = os.path.join(cachedir, "bb_filelist_cache.dat")
+        try:
+            with open(cachefile, "rb") as f:
+                version, cache = pickle.load(f)
+            if version == self.filelist_cache_version:
+                return cachefile, cache
+        except Exception:
+            pass
+        return cachefile, {}
+
+    def save_filelist_cache(self, cachefile, cache):
+        if not cachefile:
+            return
+        try:
+            bb.utils.mkdirhier(os.path.dirname(cachefile))
+            fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cachefile), prefix=os.path.basename(cachefile) + ".")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((self.filelist_cache_version, cache), f, -1)
+            os.rename(tmpfile, cachefile)
+        except (OSError, IOError) as e:
+            collectlog.debug(1, "Unable to write file list cache %s: %s" % (cachefile, e))
+
     def collect_bbfiles(self, config, eventdata):
         """Collect all available .bb build files"""
         masked = 0
@@ -1753,22 +1930,29 @@ class CookerCollectFiles(object):
             collectlog.error("no recipe files to build, check your BBPATH and BBFILES?")
             bb.event.fire(CookerExit(), eventdata)
 
-        # Can't use set here as order is important
+        # Expand the entries concurrently, reusing previous results for
+        # those whose directories haven't changed
+        cachefile, cache = self.load_filelist_cache(config)
+        threads = min(len(files), int(config.getVar("BB_NUMBER_PARSE_THREADS", True) or
+                                      multiprocessing.cpu_count())) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            expanded = list(executor.map(lambda f: self.expand_bbfiles_entry(f, cache.get(f)), files))
+        newcache = {}
+        for f, (_, entry) in zip(files, expanded):
+            if entry:
+                newcache[f] = entry
+        if newcache != cache:
+            self.save_filelist_cache(cachefile, newcache)
+
+        # Can't use set here as order is important, the set is only used
+        # to check for duplicates
         newfiles = []
-        for f in files:
-            if os.path.isdir(f):
-                dirfiles = self.find_bbfiles(f)
-                for g in dirfiles:
-                    if g not in newfiles:
-                        newfiles.append(g)
-            else:
-                globbed = glob.glob(f)
-                if not globbed and os.path.exists(f):
-                    globbed = [f]
-                # glob gives files in order on disk. Sort to be deterministic.
-                for g in sorted(globbed):
-                    if g not in newfiles:
-                        newfiles.append(g)
+        seen = set()
+        for found, _ in expanded:
+            for g in found:
+                if g not in seen:
+                    seen.add(g)
+                    newfiles.append(g)
 
         bbmask = config.getVar('BBMASK', True)
 
@@ -1810,6 +1994,8 @@ class CookerCollectFiles(object):
         for f in bbappend:
             base = os.path.basename(f).replace('.bbappend', '.bb')
             self.bbappends.append((base, f))
+        self.bbappends_index = None
+        self.appendlist_cache = {}
 
         # Find overlayed recipes
         # bbfiles will be in priority order which makes this easy
@@ -1825,17 +2011,47 @@ class CookerCollectFiles(object):
 
         return (bbfiles, masked)
 
+    def index_bbappends(self):
+        """
+        Index self.bbappends by the recipe names they apply to. Exact
+        names go into a dict, wildcard ('%') appends into a character
+        trie of their prefixes. Entries carry their position in
+        self.bbappends so results keep that order.
+        """
+        exact = defaultdict(list)
+        trie = {}
+        for pos, (bbappend, filename) in enumerate(self.bbappends):
+            if '%' in bbappend:
+                node = trie
+                for c in bbappend[:bbappend.index('%')]:
+                    node = node.setdefault(c, {})
+                node.setdefault(None, []).append((pos, filename))
+            else:
+                exact[bbappend].append((pos, filename))
+        self.bbappends_index = (exact, trie)
+
     def get_file_appends(self, fn):
         """
         Returns a list of .bbappend files to apply to fn
         """
-        filelist = []
         f = os.path.basename(fn)
-        for b in self.bbappends:
-            (bbappend, filename) = b
-            if (bbappend == f) or ('%' in bbappend and bbappend.startswith(f[:bbappend.index('%')])):
-                filelist.append(filename)
-        return filelist
+        if f not in self.appendlist_cache:
+            if self.bbappends_index is None:
+                self.index_bbappends()
+            exact, trie = self.bbappends_index
+
+            matches = list(exact.get(f, []))
+            node = trie
+            for c in f:
+                matches.extend(node.get(None, []))
+                node = node.get(c)
+                if node is None:
+                    break
+            else:
+                matches.extend(node.get(None, []))
+
+            self.appendlist_cache[f] = [filename for _, filename in sorted(matches)]
+        return list(self.appendlist_cache[f])
 
     def collection_priorities(self, pkgfns, d):
 
@@ -1991,7 +2207,7 @@ class Parser(multiprocessing.Process):
             return True, ParsingFailure(exc, filename)
 
 class CookerParser(object):
-    def __init__(self, cooker, filelist, masked):
+    def __init__(self, cooker, filelist, masked, bb_cache=None):
         self.filelist = filelist
         self.cooker = cooker
         self.cfgdata = cooker.data
@@ -2010,20 +2226,28 @@ class CookerParser(object):
         self.current = 0
         self.process_names = []
 
-        self.bb_cache = bb.cache.Cache(self.cfgdata, self.cfghash, cooker.caches_array)
+        self.keepcache = cooker.configuration.server_only
+        self.complete = False
+        self.syncthread = None
+        if bb_cache is None:
+            bb_cache = bb.cache.Cache(self.cfgdata, self.cfghash, cooker.caches_array)
+        self.bb_cache = bb_cache
         self.fromcache = []
         self.willparse = []
-        for filename in self.filelist:
-            appends = self.cooker.collection.get_file_appends(filename)
-            if not self.bb_cache.cacheValid(filename, appends):
+        parse_threads = int(self.cfgdata.getVar("BB_NUMBER_PARSE_THREADS", True) or
+                            multiprocessing.cpu_count())
+        fileappends = [(filename, self.cooker.collection.get_file_appends(filename))
+                       for filename in self.filelist]
+        valid = self.bb_cache.cacheValidAll(fileappends, parse_threads)
+        for filename, appends in fileappends:
+            if filename not in valid:
                 self.willparse.append((filename, appends, cooker.caches_array))
             else:
                 self.fromcache.append((filename, appends))
         self.toparse = self.total - len(self.fromcache)
         self.progress_chunk = int(max(self.toparse / 100, 1))
 
-        self.num_processes = min(int(self.cfgdata.getVar("BB_NUMBER_PARSE_THREADS", True) or
-                                 multiprocessing.cpu_count()), len(self.willparse))
+        self.num_processes = min(parse_threads, len(self.willparse))
 
         self.start()
         self.haveshutdown = False
@@ -2044,6 +2268,9 @@ class CookerParser(object):
             self.jobs = multiprocessing.Queue(maxsize=self.num_processes)
             self.result_queue = multiprocessing.Queue()
             self.feeder = Feeder(self.willparse, self.jobs, self.feeder_quit)
+            # The forked processes send their events straight away, make
+            # sure the UI has seen ours first
+            bb.event.flush_ui_handlers()
             self.feeder.start()
             for i in range(0, self.num_processes):
                 parser = Parser(self.jobs, self.result_queue, self.parser_quit, init, self.cooker.configuration.profile)
@@ -2087,11 +2314,18 @@ class CookerParser(object):
                 process.join()
         self.feeder.join()
 
-        sync = threading.Thread(target=self.bb_cache.sync)
-        sync.start()
-        multiprocessing.util.Finalize(None, sync.join, exitpriority=-100)
-        bb.codeparser.parser_cache_savemerge()
-        bb.fetch.fetcher_parse_done()
+        self.syncthread = threading.Thread(target=self.bb_cache.sync, args=(self.keepcache,))
+        self.syncthread.start()
+        multiprocessing.util.Finalize(None, self.syncthread.join, exitpriority=-100)
+
+        # The parser processes left their additions as cache shards; fold
+        # them into the master caches without holding up the build
+        def savemerge():
+            bb.codeparser.parser_cache_savemerge()
+            bb.fetch.fetcher_parse_done()
+        merge = threading.Thread(target=savemerge)
+        merge.start()
+        multiprocessing.util.Finalize(None, merge.join, exitpriority=-100)
         if self.cooker.configuration.profile:
             profiles = []
             for i in self.process_names:
@@ -2103,6 +2337,19 @@ class CookerParser(object):
             bb.utils.process_profilelog(profiles, pout = pout)
             print("Processed parsing statistics saved to %s" % (pout))
 
+    def reusable_cache(self):
+        """
+        Return the recipe cache if it can seed the next parse, i.e. it
+        was kept, parsing completed and the configuration is unchanged.
+        """
+        if not self.keepcache or not self.complete or self.error:
+            return None
+        if self.cfghash != self.cooker.data_hash or not self.bb_cache.has_cache:
+            return None
+        if self.syncthread:
+            self.syncthread.join()
+        return self.bb_cache
+
     def load_cached(self):
         for filename, appends in self.fromcache:
             cached, infos = self.bb_cache.load(filename, appends, self.cfgdata)
@@ -2131,6 +2378,7 @@ class CookerParser(object):
             parsed, result = next(self.results)
         except StopIteration:
             self.shutdown()
+            self.complete = True
             return False
         except bb.BBHandledException as exc:
             self.error += 1
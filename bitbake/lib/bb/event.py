@@ -55,6 +55,7 @@ def get_class_handlers():
 def set_class_handlers(h):
     global _handlers
     _handlers = h
+    _handler_index.clear()
 
 def clean_class_handlers():
     return bb.compat.OrderedDict()
@@ -66,6 +67,9 @@ _ui_logfilters = {}
 _ui_handler_seq = 0
 _event_handler_map = {}
 _catchall_handlers = {}
+# Event class -> list of (name, handler) interested in it, in registration
+# order. Rebuilt lazily whenever the set of handlers changes.
+_handler_index = {}
 _eventfilter = None
 _uiready = False
 
@@ -102,14 +106,23 @@ def fire_class_handlers(event, d):
     if isinstance(event, logging.LogRecord):
         return
 
-    eid = str(event.__class__)[8:-2]
+    handlers = _handler_index.get(event.__class__)
+    if handlers is None:
+        handlers = _index_class_handlers(event.__class__)
+
+    for name, handler in handlers:
+        if _eventfilter:
+            if not _eventfilter(name, handler, event, d):
+                continue
+        execute_handler(name, handler, event, d)
+
+def _index_class_handlers(cls):
+    eid = str(cls)[8:-2]
     evt_hmap = _event_handler_map.get(eid, {})
-    for name, handler in list(_handlers.items()):
-        if name in _catchall_handlers or name in evt_hmap:
-            if _eventfilter:
-                if not _eventfilter(name, handler, event, d):
-                    continue
-            execute_handler(name, handler, event, d)
+    handlers = [(name, handler) for name, handler in _handlers.items()
+                if name in _catchall_handlers or name in evt_hmap]
+    _handler_index[cls] = handlers
+    return handlers
 
 ui_queue = []
 @atexit.register
@@ -145,6 +158,7 @@ def fire_ui_handlers(event, d):
         return
 
     errors = []
+    pickled = None
     for h in _ui_handlers:
         #print "Sending event %s" % event
         try:
@@ -152,9 +166,12 @@ def fire_ui_handlers(event, d):
                  continue
              # We use pickle here since it better handles object instances
              # which xmlrpc's marshaller does not. Events *must* be serializable
-             # by pickle.
+             # by pickle. The event is only pickled once however many UIs
+             # want it.
              if hasattr(_ui_handlers[h].event, "sendpickle"):
-                _ui_handlers[h].event.sendpickle((pickle.dumps(event)))
+                if pickled is None:
+                    pickled = pickle.dumps(event)
+                _ui_handlers[h].event.sendpickle(pickled)
              else:
                 _ui_handlers[h].event.send(event)
         except:
@@ -162,6 +179,20 @@ def fire_ui_handlers(event, d):
     for h in errors:
         del _ui_handlers[h]
 
+def flush_ui_handlers():
+    """Push out any events UI handlers are holding back to send in a batch"""
+    errors = []
+    for h in _ui_handlers:
+        flush = getattr(_ui_handlers[h].event, "flush", None)
+        if flush is None:
+            continue
+        try:
+            flush()
+        except:
+            errors.append(h)
+    for h in errors:
+        del _ui_handlers[h]
+
 def fire(event, d):
     """Fire off an Event"""
 
@@ -205,6 +236,7 @@ def register(name, handler, mask=None, filename=None, lineno=None):
                 logger.error("Unable to register event handler '%s':\n%s", name,
                              ''.join(traceback.format_exc(limit=0)))
                 _handlers[name] = noop
+                _handler_index.clear()
                 return
             env = {}
             bb.utils.better_exec(code, env)
@@ -221,11 +253,13 @@ def register(name, handler, mask=None, filename=None, lineno=None):
                     _event_handler_map[m] = {}
                 _event_handler_map[m][name] = True
 
+        _handler_index.clear()
         return Registered
 
 def remove(name, handler):
     """Remove an Event handler"""
     _handlers.pop(name)
+    _handler_index.clear()
 
 def set_eventfilter(func):
     global _eventfilter
@@ -23,8 +23,11 @@ currently, providing a key/value store accessed by 'domain'.
 
 import collections
 import logging
+import multiprocessing.util
 import os.path
 import sys
+import threading
+import time
 import warnings
 from bb.compat import total_ordering
 from collections import Mapping
@@ -53,11 +56,20 @@ class SQLTable(collections.MutableMapping):
     def __init__(self, cachefile, table):
         self.cachefile = cachefile
         self.table = table
-        self.cursor = connect(self.cachefile)
+        self.cursor = self._connect()
+
+        # Build the statements once so sqlite's statement cache can reuse
+        # the compiled form on every call
+        self._select_sql = "SELECT * from %s where key=?;" % table
+        self._update_sql = "UPDATE %s SET value=? WHERE key=?;" % table
+        self._insert_sql = "INSERT into %s(key, value) values (?, ?);" % table
 
         self._execute("CREATE TABLE IF NOT EXISTS %s(key TEXT, value TEXT);"
                       % table)
 
+    def _connect(self):
+        return connect(self.cachefile)
+
     def _execute(self, *query):
         """Execute a query, waiting to acquire a lock if necessary"""
         count = 0
@@ -68,7 +80,7 @@ class SQLTable(collections.MutableMapping):
                 if 'database is locked' in str(exc) and count < 500:
                     count = count + 1
                     self.cursor.close()
-                    self.cursor = connect(self.cachefile)
+                    self.cursor = self._connect()
                     continue
                 raise
 
@@ -80,8 +92,7 @@ class SQLTable(collections.MutableMapping):
         self.cursor.__exit__(*excinfo)
 
     def __getitem__(self, key):
-        data = self._execute("SELECT * from %s where key=?;" %
-                             self.table, [key])
+        data = self._execute(self._select_sql, [key])
         for row in data:
             return row[1]
         raise KeyError(key)
@@ -97,15 +108,12 @@ class SQLTable(collections.MutableMapping):
         elif not isinstance(value, str):
             raise TypeError('Only string values are supported')
 
-        data = self._execute("SELECT * from %s where key=?;" %
-                                   self.table, [key])
-        exists = len(list(data))
-        if exists:
-            self._execute("UPDATE %s SET value=? WHERE key=?;" % self.table,
-                          [value, key])
-        else:
-            self._execute("INSERT into %s(key, value) values (?, ?);" %
-                          self.table, [key, value])
+        self._store(key, value)
+
+    def _store(self, key, value):
+        data = self._execute(self._update_sql, [value, key])
+        if not data.rowcount:
+            self._execute(self._insert_sql, [key, value])
 
     def __contains__(self, key):
         return key in set(self)
@@ -150,6 +158,173 @@ class SQLTable(collections.MutableMapping):
         return key in self
 
 
+class BatchedSQLTable(SQLTable):
+    """
+    SQLTable which caches reads and coalesces writes
+
+    Writes are held in memory and committed together in a single
+    transaction by sync(), which happens once enough of them have been
+    queued, when the table is used as a context manager, and at task and
+    build boundaries through sync_all(). Values read or written are
+    remembered, so hot domains only hit the database once per key, until
+    the cache expires after cache_timeout seconds so that long-lived
+    processes see what other processes have written.
+
+    A table is shared by the threads of a process (sync_all() runs from
+    whichever thread exits last), so its connection may be used from any
+    thread and all access is serialised by a lock.
+    """
+    batch_size = 100
+    cache_timeout = 60
+
+    def __init__(self, cachefile, table):
+        self.lock = threading.RLock()
+        SQLTable.__init__(self, cachefile, table)
+        self.pid = os.getpid()
+        self.cache = {}
+        self.cache_time = time.monotonic()
+        self.pending = {}
+
+    def _connect(self):
+        return connect(self.cachefile, check_same_thread=False)
+
+    def _expire_cache(self):
+        now = time.monotonic()
+        if now - self.cache_time > self.cache_timeout:
+            # Queued writes still have to be visible to reads
+            self.cache = dict(self.pending)
+            self.cache_time = now
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            return SQLTable.__enter__(self)
+        except:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *excinfo):
+        try:
+            self.sync()
+            SQLTable.__exit__(self, *excinfo)
+        finally:
+            self.lock.release()
+
+    def __getitem__(self, key):
+        with self.lock:
+            self._expire_cache()
+            if key in self.cache:
+                return self.cache[key]
+            value = SQLTable.__getitem__(self, key)
+            self.cache[key] = value
+            return value
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.sync()
+            self.cache.pop(key, None)
+            SQLTable.__delitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise TypeError('Only string keys are supported')
+        elif not isinstance(value, str):
+            raise TypeError('Only string values are supported')
+
+        with self.lock:
+            self.cache[key] = value
+            self.pending[key] = value
+            if len(self.pending) >= self.batch_size:
+                self.sync()
+
+    def __contains__(self, key):
+        with self.lock:
+            self._expire_cache()
+            if key in self.cache:
+                return True
+            return SQLTable.__contains__(self, key)
+
+    def __len__(self):
+        with self.lock:
+            self.sync()
+            return SQLTable.__len__(self)
+
+    # The rows are read while holding the lock rather than as the caller
+    # iterates, another thread may be using the connection by then
+
+    def __iter__(self):
+        with self.lock:
+            self.sync()
+            return iter(list(SQLTable.__iter__(self)))
+
+    def get_by_pattern(self, pattern):
+        with self.lock:
+            self.sync()
+            return SQLTable.get_by_pattern(self, pattern)
+
+    def itervalues(self):
+        with self.lock:
+            self.sync()
+            return iter(list(SQLTable.itervalues(self)))
+
+    def iteritems(self):
+        with self.lock:
+            self.sync()
+            return iter(list(SQLTable.iteritems(self)))
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+            self.cache.clear()
+            SQLTable.clear(self)
+
+    def sync(self):
+        """Commit any queued writes to the database in one transaction"""
+        with self.lock:
+            if not self.pending or self.pid != os.getpid():
+                return
+
+            count = 0
+            while True:
+                try:
+                    self.cursor.execute("BEGIN IMMEDIATE;")
+                    try:
+                        for key, value in self.pending.items():
+                            data = self.cursor.execute(self._update_sql, [value, key])
+                            if not data.rowcount:
+                                self.cursor.execute(self._insert_sql, [key, value])
+                    except:
+                        self.cursor.execute("ROLLBACK;")
+                        raise
+                    self.cursor.execute("COMMIT;")
+                    break
+                except sqlite3.OperationalError as exc:
+                    if 'database is locked' in str(exc) and count < 500:
+                        count = count + 1
+                        self.cursor.close()
+                        self.cursor = self._connect()
+                        continue
+                    raise
+            self.pending.clear()
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+def sync_all():
+    """
+    Commit the queued writes of every batched table opened by this process.
+    A table failing to sync doesn't stop the others from being synced, the
+    first error is raised once they have all been tried.
+    """
+    error = None
+    for table in list(_tables.values()):
+        try:
+            table.sync()
+        except Exception as exc:
+            error = error or exc
+    if error:
+        raise error
+
 class PersistData(object):
     """Deprecated representation of the bitbake persistent data store"""
     def __init__(self, d):
@@ -198,9 +373,15 @@ class PersistData(object):
         """
         del self.data[domain][key]
 
-def connect(database):
-    connection = sqlite3.connect(database, timeout=5, isolation_level=None)
+def connect(database, check_same_thread=True):
+    connection = sqlite3.connect(database, timeout=5, isolation_level=None,
+                                 check_same_thread=check_same_thread)
     connection.execute("pragma synchronous = off;")
+    # Write-ahead logging lets readers proceed while another process writes
+    try:
+        connection.execute("pragma journal_mode = WAL;")
+    except sqlite3.OperationalError:
+        pass
     connection.text_factory = str
     return connection
 
@@ -215,4 +396,20 @@ def persist(domain, d):
 
     bb.utils.mkdirhier(cachedir)
     cachefile = os.path.join(cachedir, "bb_persist_data.sqlite3")
-    return SQLTable(cachefile, domain)
+
+    batched = d.getVar("BB_PERSIST_BATCHED_DOMAINS", True)
+    if batched is None:
+        batched = "BB_URI_HEADREVS"
+    if domain not in batched.split():
+        return SQLTable(cachefile, domain)
+
+    # Batched tables are shared by the threads of a process so their
+    # caches are useful, connections must not be shared across a fork
+    # though
+    key = (os.getpid(), cachefile, domain)
+    with _tables_lock:
+        if key not in _tables:
+            if not any(k[0] == key[0] for k in _tables):
+                multiprocessing.util.Finalize(None, sync_all, exitpriority=1)
+            _tables[key] = BatchedSQLTable(cachefile, domain)
+        return _tables[key]
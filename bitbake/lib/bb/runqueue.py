@@ -42,6 +42,79 @@ logger = logging.getLogger("BitBake.RunQueue")
 
 __find_md5__ = re.compile( r'(?i)(?<![a-z0-9])[a-f0-9]{32}(?![a-z0-9])' )
 
+def reachable_fnids(roots, edges, tasks_fnid):
+    """
+    Return a dict mapping each task reachable from roots to the fnids
+    reachable from it (its own included) as an integer bitset.
+
+    edges(task) returns the tasks to follow from a task and may contain
+    cycles. The strongly connected components are found (Tarjan) and each
+    is resolved once from the already resolved components it leads to, so
+    tasks within a component share one bitset, as do components with
+    identical results.
+    """
+    index = {}
+    lowlink = {}
+    succs = {}
+    stack = []
+    onstack = set()
+    closure = {}
+    interned = {}
+
+    def visit(task):
+        index[task] = lowlink[task] = len(index)
+        succs[task] = list(edges(task))
+        stack.append(task)
+        onstack.add(task)
+        return (task, iter(succs[task]))
+
+    for root in roots:
+        if root in index:
+            continue
+        work = [visit(root)]
+        while work:
+            task, it = work[-1]
+            for succ in it:
+                if succ not in index:
+                    work.append(visit(succ))
+                    break
+                elif succ in onstack:
+                    lowlink[task] = min(lowlink[task], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[task])
+                if lowlink[task] != index[task]:
+                    continue
+                component = set()
+                while True:
+                    t = stack.pop()
+                    onstack.remove(t)
+                    component.add(t)
+                    if t == task:
+                        break
+                bits = 0
+                for t in component:
+                    bits |= 1 << tasks_fnid[t]
+                    for succ in succs.pop(t):
+                        if succ not in component:
+                            bits |= closure[succ]
+                bits = interned.setdefault(bits, bits)
+                for t in component:
+                    closure[t] = bits
+    return closure
+
+def bitset_members(bits):
+    """Return the positions of the set bits in an integer bitset"""
+    members = []
+    bitstr = bin(bits)[:1:-1]
+    pos = bitstr.find('1')
+    while pos != -1:
+        members.append(pos)
+        pos = bitstr.find('1', pos + 1)
+    return members
+
 class RunQueueStats:
     """
     Holds statistics on the tasks handled by the associated runQueue
@@ -233,6 +306,7 @@ class RunQueueData:
         self.runq_depends = []
         self.runq_revdeps = []
         self.runq_hash = []
+        self.runq_lookup = {}
 
     def runq_depends_names(self, ids):
         import re
@@ -265,10 +339,7 @@ class RunQueueData:
 
 
     def get_task_id(self, fnid, taskname):
-        for listid in range(len(self.runq_fnid)):
-            if self.runq_fnid[listid] == fnid and self.runq_task[listid] == taskname:
-                return listid
-        return None
+        return self.runq_lookup.get((fnid, taskname))
 
     def circular_depchains_handler(self, tasks):
         """
@@ -566,28 +637,45 @@ class RunQueueData:
         # e.g. do_sometask[recrdeptask] = "do_someothertask"
         # (makes sure sometask runs after someothertask of all DEPENDS, RDEPENDS and intertask dependencies, recursively)
         # We need to do this separately since we need all of self.runq_depends to be complete before this is processed
+        #
+        # From each task visited we follow its own dependencies and those of
+        # the named tasks of its recipe, and the task gains the named tasks of
+        # every recipe reached. Rather than walking the graph again for every
+        # recursive task, the recipes reachable from each task are computed
+        # once per set of task names and shared between tasks.
         extradeps = {}
+        recursivegroups = {}
         for task in recursivetasks:
-            extradeps[task] = set(self.runq_depends[task])
-            tasknames = recursivetasks[task]
-            seendeps = set()
-            seenfnid = []
-
-            def generate_recdeps(t):
-                newdeps = set()
-                add_resolved_dependencies([taskData.tasks_fnid[t]], tasknames, newdeps)
-                extradeps[task].update(newdeps)
-                seendeps.add(t)
-                newdeps.add(t)
-                for i in newdeps:
-                    for n in self.runq_depends[i]:
-                        if n not in seendeps:
-                            generate_recdeps(n)
-            generate_recdeps(task)
-
-            if task in recursiveitasks:
-                for dep in recursiveitasks[task]:
-                    generate_recdeps(dep)
+            recursivegroups.setdefault(tuple(recursivetasks[task]), []).append(task)
+
+        for tasknames, tasks in recursivegroups.items():
+            namedtasks = {}
+
+            def get_namedtasks(fnid):
+                if fnid not in namedtasks:
+                    newdeps = set()
+                    add_resolved_dependencies([fnid], tasknames, newdeps)
+                    namedtasks[fnid] = newdeps
+                return namedtasks[fnid]
+
+            def recdeps_edges(t):
+                edges = set(self.runq_depends[t])
+                for i in get_namedtasks(taskData.tasks_fnid[t]):
+                    edges.update(self.runq_depends[i])
+                return edges
+
+            roots = list(tasks)
+            for task in tasks:
+                roots.extend(recursiveitasks.get(task, []))
+            closure = reachable_fnids(roots, recdeps_edges, taskData.tasks_fnid)
+
+            for task in tasks:
+                fnids = closure[task]
+                for dep in recursiveitasks.get(task, []):
+                    fnids |= closure[dep]
+                extradeps[task] = set(self.runq_depends[task])
+                for fnid in bitset_members(fnids):
+                    extradeps[task].update(get_namedtasks(fnid))
 
         # Remove circular references so that do_a[recrdeptask] = "do_a do_b" can work
         for task in recursivetasks:
@@ -684,6 +772,9 @@ class RunQueueData:
                 delcount = delcount + 1
                 maps.append(-1)
 
+        for listid in range(len(self.runq_fnid)):
+            self.runq_lookup[(self.runq_fnid[listid], self.runq_task[listid])] = listid
+
         #
         # Step D - Sanity checks and computation
         #
@@ -1764,12 +1855,17 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
             self.runq_complete.append(0)
             self.runq_buildable.append(0)
 
+        # Map runqueue task ids to their index in runq_setscene
+        sq_index = {}
+        for idx, task in enumerate(self.rqdata.runq_setscene):
+            sq_index[task] = idx
+
         # First process the chains up to the first setscene task.
         endpoints = {}
         for task in range(len(self.rqdata.runq_fnid)):
             sq_revdeps.append(copy.copy(self.rqdata.runq_revdeps[task]))
             sq_revdeps_new.append(set())
-            if (len(self.rqdata.runq_revdeps[task]) == 0) and task not in self.rqdata.runq_setscene:
+            if (len(self.rqdata.runq_revdeps[task]) == 0) and task not in sq_index:
                 endpoints[task] = set()
 
         # Secondly process the chains between setscene tasks.
@@ -1788,7 +1884,7 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                 if sq_revdeps_new[point]:
                     tasks |= sq_revdeps_new[point]
                 sq_revdeps_new[point] = set()
-                if point in self.rqdata.runq_setscene:
+                if point in sq_index:
                     sq_revdeps_new[point] = tasks
                     tasks = set()
                 for dep in self.rqdata.runq_depends[point]:
@@ -1796,7 +1892,7 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                         sq_revdeps[dep].remove(point)
                     if tasks:
                         sq_revdeps_new[dep] |= tasks
-                    if (len(sq_revdeps[dep]) == 0 or len(sq_revdeps_new[dep]) != 0) and dep not in self.rqdata.runq_setscene:
+                    if (len(sq_revdeps[dep]) == 0 or len(sq_revdeps_new[dep]) != 0) and dep not in sq_index:
                         newendpoints[dep] = task
             if len(newendpoints) != 0:
                 process_endpoints(newendpoints)
@@ -1817,33 +1913,33 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                 if sq_revdeps_new2[point]:
                     tasks |= sq_revdeps_new2[point]
                 sq_revdeps_new2[point] = set()
-                if point in self.rqdata.runq_setscene:
+                if point in sq_index:
                     sq_revdeps_new2[point] = tasks
                 for dep in self.rqdata.runq_depends[point]:
                     if point in sq_revdeps2[dep]:
                         sq_revdeps2[dep].remove(point)
                     if tasks:
                         sq_revdeps_new2[dep] |= tasks
-                    if (len(sq_revdeps2[dep]) == 0 or len(sq_revdeps_new2[dep]) != 0) and dep not in self.rqdata.runq_setscene:
+                    if (len(sq_revdeps2[dep]) == 0 or len(sq_revdeps_new2[dep]) != 0) and dep not in sq_index:
                         newendpoints[dep] = tasks
             if len(newendpoints) != 0:
                 process_endpoints2(newendpoints)
         for task in range(len(self.rqdata.runq_fnid)):
             sq_revdeps2.append(copy.copy(self.rqdata.runq_revdeps[task]))
             sq_revdeps_new2.append(set())
-            if (len(self.rqdata.runq_revdeps[task]) == 0) and task not in self.rqdata.runq_setscene:
+            if (len(self.rqdata.runq_revdeps[task]) == 0) and task not in sq_index:
                 endpoints2[task] = set()
         process_endpoints2(endpoints2)
         self.unskippable = []
         for task in self.rqdata.runq_setscene:
             if sq_revdeps_new2[task]:
-                self.unskippable.append(self.rqdata.runq_setscene.index(task))
+                self.unskippable.append(sq_index[task])
 
         for task in range(len(self.rqdata.runq_fnid)):
-            if task in self.rqdata.runq_setscene:
+            if task in sq_index:
                 deps = set()
                 for dep in sq_revdeps_new[task]:
-                    deps.add(self.rqdata.runq_setscene.index(dep))
+                    deps.add(sq_index[dep])
                 sq_revdeps_squash.append(deps)
             elif len(sq_revdeps_new[task]) != 0:
                 bb.msg.fatal("RunQueue", "Something went badly wrong during scenequeue generation, aborting. Please report this problem.")
@@ -1866,13 +1962,13 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                     if taskid is None:
                         bb.msg.fatal("RunQueue", "Task %s_setscene depends upon non-existent task %s:%s" % (self.rqdata.get_user_idstring(task), dep, idependtask))
 
-                    if not self.rqdata.runq_setscene.index(taskid) in self.sq_harddeps:
-                        self.sq_harddeps[self.rqdata.runq_setscene.index(taskid)] = set()
-                    self.sq_harddeps[self.rqdata.runq_setscene.index(taskid)].add(self.rqdata.runq_setscene.index(task))
+                    if not sq_index[taskid] in self.sq_harddeps:
+                        self.sq_harddeps[sq_index[taskid]] = set()
+                    self.sq_harddeps[sq_index[taskid]].add(sq_index[task])
 
-                    sq_revdeps_squash[self.rqdata.runq_setscene.index(task)].add(self.rqdata.runq_setscene.index(taskid))
+                    sq_revdeps_squash[sq_index[task]].add(sq_index[taskid])
                     # Have to zero this to avoid circular dependencies
-                    sq_revdeps_squash[self.rqdata.runq_setscene.index(taskid)] = set()
+                    sq_revdeps_squash[sq_index[taskid]] = set()
 
         for task in self.sq_harddeps:
              for dep in self.sq_harddeps[task]:
@@ -25,6 +25,10 @@ approach to the interface, and minimize risks associated with code duplication.
 
 """
 
+import os
+import threading
+import time
+
 """  BaseImplServer() the base class for all XXServer() implementations.
 
     These classes contain the actual code that runs the server side, i.e.
@@ -48,6 +52,80 @@ class BaseImplServer():
 
 
 
+""" BatchedEventSender collects pickled events for one UI and hands them
+    on in batches, so that a busy build doesn't pay the transport overhead
+    for every single event.
+
+    A batch is sent once it holds batch_size events, once its oldest event
+    has waited batch_interval seconds, or when flush() is called. A timer
+    thread sends a batch which has waited batch_interval seconds even if no
+    further event arrives, e.g. while the server runs a long synchronous
+    step, and servers also flush from their main loop and before replying
+    to a command.
+
+    Code which forks from the server (e.g. to start the parser processes)
+    flushes the UI handlers first so that the UI sees events in order.
+    Nothing flushes the sender in the forked process, and a batch would be
+    lost when it exits, so events fired there are sent straight away. Any
+    batch it inherited belongs to the server, which sends it itself.
+
+"""
+
+class BatchedEventSender():
+    batch_size = 100
+    batch_interval = 0.05
+
+    def __init__(self):
+        self.batch = []
+        self.batch_start = 0
+        self.pid = os.getpid()
+        # The timer thread flushes too, and sending a batch must not
+        # overtake events sent directly
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def sendpickle(self, event):
+        if os.getpid() != self.pid:
+            # The lock may have been held by another thread at fork time
+            self.batch = []
+            self.sendbatch([event])
+            return
+        with self.lock:
+            if not self.batch:
+                self.batch_start = time.time()
+                self.timer = threading.Timer(self.batch_interval, self.timeout)
+                self.timer.daemon = True
+                self.timer.start()
+            self.batch.append(event)
+            if len(self.batch) >= self.batch_size or time.time() - self.batch_start >= self.batch_interval:
+                self.flush()
+
+    def timeout(self):
+        try:
+            self.flush()
+        except Exception:
+            # The handler is dropped when the next event fails to send
+            pass
+
+    def flush(self):
+        if os.getpid() != self.pid:
+            self.batch = []
+            return
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.batch:
+                return
+            batch = self.batch
+            self.batch = []
+            self.sendbatch(batch)
+
+    def sendbatch(self, batch):
+        raise NotImplementedError
+
+
+
 """ BitBakeBaseServerConnection class is the common ancestor to all
     BitBakeServerConnection classes.
 
@@ -22,10 +22,12 @@
 
 import bb
 import bb.event
+import collections
 import itertools
 import logging
 import multiprocessing
 import os
+import pickle
 import signal
 import sys
 import time
@@ -33,7 +35,7 @@ import select
 from queue import Empty
 from multiprocessing import Event, Process, util, Queue, Pipe, queues, Manager
 
-from . import BitBakeBaseServer, BitBakeBaseServerConnection, BaseImplServer
+from . import BitBakeBaseServer, BitBakeBaseServerConnection, BaseImplServer, BatchedEventSender
 
 logger = logging.getLogger('BitBake')
 
@@ -65,17 +67,29 @@ class ServerCommunicator():
     def getEventHandle(self):
         return self.event_handle.value
 
-class EventAdapter():
+class EventAdapter(BatchedEventSender):
     """
     Adapter to wrap our event queue since the caller (bb.event) expects to
     call a send() method, but our actual queue only has put()
+
+    Pickled events are put on the queue as lists, ProcessEventQueue
+    unpacks them again on the UI side.
     """
     def __init__(self, queue):
+        BatchedEventSender.__init__(self)
         self.queue = queue
 
     def send(self, event):
+        with self.lock:
+            self.flush()
+            try:
+                self.queue.put(event)
+            except Exception as err:
+                print("EventAdapter puked: %s" % str(err))
+
+    def sendbatch(self, batch):
         try:
-            self.queue.put(event)
+            self.queue.put(batch)
         except Exception as err:
             print("EventAdapter puked: %s" % str(err))
 
@@ -83,6 +97,11 @@ class EventAdapter():
 class ProcessServer(Process, BaseImplServer):
     profile_filename = "profile.log"
     profile_processed_filename = "profile.log.processed"
+    # Longest the main loop sleeps between idle function calls. Idle
+    # functions wait on fds, but some also have periodic work which must
+    # happen even when no fd becomes ready, e.g. the runqueue's disk
+    # space monitor during a long task which sends no events
+    idle_delay = 0.5
 
     def __init__(self, command_channel, event_queue, featurelist):
         BaseImplServer.__init__(self)
@@ -95,6 +114,8 @@ class ProcessServer(Process, BaseImplServer):
 
         self.quitin, self.quitout = Pipe()
         self.event_handle = multiprocessing.Value("i")
+        self.poller = None
+        self.pollfds = set()
 
     def run(self):
         for event in bb.event.ui_queue:
@@ -109,8 +130,21 @@ class ProcessServer(Process, BaseImplServer):
         self.quitin.close()
         signal.signal(signal.SIGINT, signal.SIG_IGN)
         bb.utils.set_process_name("Cooker")
+        self.poller = select.epoll()
+        # Python restarts an interrupted epoll.poll() by itself, so have
+        # signals (e.g. the SIGTERM/SIGHUP handlers of the cooker) write to
+        # a pipe we wait on to act on them without waiting for idle_delay
+        self.wakeupin, self.wakeupout = os.pipe()
+        os.set_blocking(self.wakeupin, False)
+        os.set_blocking(self.wakeupout, False)
+        signal.set_wakeup_fd(self.wakeupout)
         while not self.quit:
             try:
+                try:
+                    while os.read(self.wakeupin, 512):
+                        pass
+                except BlockingIOError:
+                    pass
                 if self.command_channel.poll():
                     command = self.command_channel.recv()
                     self.runCommand(command)
@@ -122,10 +156,15 @@ class ProcessServer(Process, BaseImplServer):
                     except:
                         pass
 
-                self.idle_commands(.1, [self.command_channel, self.quitout])
+                self.idle_commands(self.idle_delay, [self.command_channel, self.quitout, self.wakeupin])
             except Exception:
                 logger.exception('Running command %s', command)
 
+        self.event.flush()
+        signal.set_wakeup_fd(-1)
+        os.close(self.wakeupin)
+        os.close(self.wakeupout)
+        self.poller.close()
         self.event_queue.close()
         bb.event.unregister_UIHhandler(self.event_handle.value)
         self.command_channel.close()
@@ -133,7 +172,13 @@ class ProcessServer(Process, BaseImplServer):
         self.quitout.close()
 
     def idle_commands(self, delay, fds=None):
+        """
+        Run the idle functions, then sleep until one of fds or the fds
+        they returned is ready, for at most delay seconds (or the shortest
+        delay they asked for). A delay of None means no time limit.
+        """
         nextsleep = delay
+        runagain = False
         if not fds:
             fds = []
 
@@ -142,14 +187,12 @@ class ProcessServer(Process, BaseImplServer):
                 retval = function(self, data, False)
                 if retval is False:
                     del self._idlefuns[function]
-                    nextsleep = None
+                    runagain = True
                 elif retval is True:
-                    nextsleep = None
-                elif isinstance(retval, float) and nextsleep:
-                    if (retval < nextsleep):
+                    runagain = True
+                elif isinstance(retval, float):
+                    if nextsleep is None or retval < nextsleep:
                         nextsleep = retval
-                elif nextsleep is None:
-                    continue
                 else:
                     fds = fds + retval
             except SystemExit:
@@ -160,14 +203,42 @@ class ProcessServer(Process, BaseImplServer):
                 del self._idlefuns[function]
                 self.quit = True
 
-        if nextsleep is not None:
-            select.select(fds,[],[],nextsleep)
+        # Don't hold events back while we sleep
+        self.event.flush()
+        if not runagain and not self.quit:
+            self.wait(fds, nextsleep)
+
+    def wait(self, fds, timeout):
+        """
+        Block until one of fds is readable or timeout seconds (None for no
+        limit) have passed. The fds are kept registered with epoll across
+        calls, only the changes to the set are passed to the kernel.
+        """
+        wanted = set(fd if isinstance(fd, int) else fd.fileno() for fd in fds)
+        for fd in self.pollfds - wanted:
+            try:
+                self.poller.unregister(fd)
+            except (OSError, ValueError):
+                pass
+        for fd in wanted:
+            # A closed fd drops out of epoll by itself and its number may
+            # since have been reused, so refresh existing registrations too
+            try:
+                self.poller.modify(fd, select.EPOLLIN)
+            except OSError:
+                self.poller.register(fd, select.EPOLLIN)
+        self.pollfds = wanted
+        if timeout is None:
+            timeout = -1
+        self.poller.poll(timeout)
 
     def runCommand(self, command):
         """
         Run a cooker command on the server
         """
-        self.command_channel.send(self.cooker.command.runCommand(command))
+        result = self.cooker.command.runCommand(command)
+        self.event.flush()
+        self.command_channel.send(result)
 
     def stop(self):
         self.quitin.send("quit")
@@ -215,8 +286,18 @@ class ProcessEventQueue(multiprocessing.queues.Queue):
     def __init__(self, maxsize):
         multiprocessing.queues.Queue.__init__(self, maxsize, ctx=multiprocessing.get_context())
         self.exit = False
+        self.pending = collections.deque()
         bb.utils.set_process_name("ProcessEQueue")
 
+    def get(self, block=True, timeout=None):
+        # The server sends batches of pickled events, hand them out one by one
+        if not self.pending:
+            item = multiprocessing.queues.Queue.get(self, block, timeout)
+            if not isinstance(item, list):
+                return item
+            self.pending.extend(item)
+        return pickle.loads(self.pending.popleft())
+
     def setexit(self):
         self.exit = True
 
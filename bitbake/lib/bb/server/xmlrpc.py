@@ -49,7 +49,7 @@ from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 import bb
 from bb import daemonize
 from bb.ui import uievent
-from . import BitBakeBaseServer, BitBakeBaseServerConnection, BaseImplServer
+from . import BitBakeBaseServer, BitBakeBaseServerConnection, BaseImplServer, BatchedEventSender
 
 DEBUG = False
 
@@ -85,6 +85,33 @@ def _create_server(host, port, timeout = 60):
     s = xmlrpc.client.ServerProxy("http://%s:%d/" % (host, port), transport=t, allow_none=True, use_builtin_types=True)
     return s, t
 
+class UIEventSender(BatchedEventSender):
+    """
+    Sends pickled events to a remote UI's BBUIEventQueue in batches
+    """
+    def __init__(self, proxy):
+        BatchedEventSender.__init__(self)
+        self.proxy = proxy
+        self.batched = True
+
+    def sendbatch(self, batch):
+        if self.batched:
+            try:
+                self.proxy.event.sendpickles(batch)
+                return
+            except xmlrpc.client.Fault:
+                # UI doesn't know about batches
+                self.batched = False
+        for event in batch:
+            self.proxy.event.sendpickle(event)
+
+class UIEventHandler():
+    """
+    UI event handler registered with bb.event for a remote UI
+    """
+    def __init__(self, proxy):
+        self.event = UIEventSender(proxy)
+
 class BitBakeServerCommands():
 
     def __init__(self, server):
@@ -101,7 +128,7 @@ class BitBakeServerCommands():
         if (self.cooker.state in [bb.cooker.state.parsing, bb.cooker.state.running]):
             return None, "Cooker is busy: %s" % bb.cooker.state.get_name(self.cooker.state)
 
-        self.event_handle = bb.event.register_UIHhandler(s, True)
+        self.event_handle = bb.event.register_UIHhandler(UIEventHandler(s), True)
         return self.event_handle, 'OK'
 
     def unregisterEventHandler(self, handlerNum):
@@ -114,7 +141,9 @@ class BitBakeServerCommands():
         """
         Run a cooker command on the server
         """
-        return self.cooker.command.runCommand(command, self.server.readonly)
+        result = self.cooker.command.runCommand(command, self.server.readonly)
+        bb.event.flush_ui_handlers()
+        return result
 
     def getEventHandle(self):
         return self.event_handle
@@ -257,6 +286,8 @@ class XMLRPCServer(SimpleXMLRPCServer, BaseImplServer):
                         del self._idlefuns[function]
                     pass
 
+            bb.event.flush_ui_handlers()
+
             socktimeout = self.socket.gettimeout() or nextsleep
             socktimeout = min(socktimeout, nextsleep)
             # Mirror what BaseServer handle_request would do
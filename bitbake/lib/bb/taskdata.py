@@ -42,9 +42,14 @@ class TaskData:
     BitBake Task Data implementation
     """
     def __init__(self, abort = True, tryaltconfigs = False, skiplist = None, allowincomplete = False):
+        # Names are interned to dense integer ids: the lists map id -> name
+        # and the dicts map name -> id
         self.build_names_index = []
         self.run_names_index = []
         self.fn_index = []
+        self.build_names_lookup = {}
+        self.run_names_lookup = {}
+        self.fn_lookup = {}
 
         self.build_targets = {}
         self.run_targets = {}
@@ -79,33 +84,36 @@ class TaskData:
         Return an ID number for the build target name.
         If it doesn't exist, create one.
         """
-        if not name in self.build_names_index:
+        nameid = self.build_names_lookup.get(name)
+        if nameid is None:
+            nameid = len(self.build_names_index)
             self.build_names_index.append(name)
-            return len(self.build_names_index) - 1
-
-        return self.build_names_index.index(name)
+            self.build_names_lookup[name] = nameid
+        return nameid
 
     def getrun_id(self, name):
         """
         Return an ID number for the run target name.
         If it doesn't exist, create one.
         """
-        if not name in self.run_names_index:
+        nameid = self.run_names_lookup.get(name)
+        if nameid is None:
+            nameid = len(self.run_names_index)
             self.run_names_index.append(name)
-            return len(self.run_names_index) - 1
-
-        return self.run_names_index.index(name)
+            self.run_names_lookup[name] = nameid
+        return nameid
 
     def getfn_id(self, name):
         """
         Return an ID number for the filename.
         If it doesn't exist, create one.
         """
-        if not name in self.fn_index:
+        nameid = self.fn_lookup.get(name)
+        if nameid is None:
+            nameid = len(self.fn_index)
             self.fn_index.append(name)
-            return len(self.fn_index) - 1
-
-        return self.fn_index.index(name)
+            self.fn_lookup[name] = nameid
+        return nameid
 
     def gettask_ids(self, fnid):
         """
@@ -324,10 +332,10 @@ class TaskData:
         are unknown.
         """
         unresolved = []
-        for target in self.build_names_index:
+        for targetid, target in enumerate(self.build_names_index):
             if re_match_strings(target, dataCache.ignored_dependencies):
                 continue
-            if self.build_names_index.index(target) in self.failed_deps:
+            if targetid in self.failed_deps:
                 continue
             if not self.have_build_target(target):
                 unresolved.append(target)
@@ -339,10 +347,10 @@ class TaskData:
         are unknown.
         """
         unresolved = []
-        for target in self.run_names_index:
+        for targetid, target in enumerate(self.run_names_index):
             if re_match_strings(target, dataCache.ignored_dependencies):
                 continue
-            if self.run_names_index.index(target) in self.failed_rdeps:
+            if targetid in self.failed_rdeps:
                 continue
             if not self.have_runtime_target(target):
                 unresolved.append(target)
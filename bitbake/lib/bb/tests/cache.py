@@ -0,0 +1,83 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for cache.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import tempfile
+import shutil
+import os
+
+import bb
+import bb.cache
+import bb.data
+
+class TestCache(bb.cache.MultiProcessCache):
+    cache_file_name = "bb_test_cache.dat"
+    CACHE_VERSION = 1
+
+class MultiProcessCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="bitbake-test-cache")
+        self.d = bb.data.init()
+        self.d.setVar("PERSISTENT_DIR", self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def new_cache(self):
+        cache = TestCache()
+        cache.init_cache(self.d)
+        return cache
+
+    def test_merge(self):
+        # A long-lived process, e.g. a memory resident server
+        server = self.new_cache()
+
+        # Worker processes each write their additions as a shard
+        for key in ("a", "b"):
+            worker = self.new_cache()
+            worker.cachedata_extras[0][key] = key.upper()
+            worker.save_extras()
+        shards = os.listdir(server.shard_dir())
+        self.assertEqual(len(shards), 2)
+
+        # Writing the same additions again doesn't add a shard
+        worker.save_extras()
+        self.assertEqual(sorted(os.listdir(server.shard_dir())), sorted(shards))
+
+        server.save_merge()
+        self.assertEqual(os.listdir(server.shard_dir()), [])
+        # The shards end up in the master file and in the merging
+        # process's in-memory copy
+        self.assertEqual(server.cachedata[0], {"a": "A", "b": "B"})
+        self.assertEqual(self.new_cache().cachedata[0], {"a": "A", "b": "B"})
+
+    def test_stale_tmp(self):
+        cache = self.new_cache()
+        cache.cachedata_extras[0]["a"] = "A"
+        cache.save_extras()
+
+        stale = os.path.join(cache.shard_dir(), ".tmp.stale")
+        fresh = os.path.join(cache.shard_dir(), ".tmp.fresh")
+        for f in (stale, fresh):
+            open(f, "w").close()
+        os.utime(stale, (0, 0))
+
+        cache.save_merge()
+        self.assertEqual(os.listdir(cache.shard_dir()), [".tmp.fresh"])
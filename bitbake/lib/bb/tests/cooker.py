@@ -0,0 +1,233 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for cooker.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import tempfile
+import shutil
+import os
+from collections import OrderedDict
+
+import bb
+import bb.cache
+import bb.command
+import bb.cooker
+import bb.data
+import bb.providers
+import bb.siggen
+import bb.utils
+import pyinotify
+
+class RecipeDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="bitbake-test-cooker")
+        self.recipe = os.path.join(self.tempdir, "foo_1.0.bb")
+        with open(self.recipe, "w") as f:
+            f.write('PV = "1.0"\nDESCRIPTION = "foo ${PV}"\n')
+
+        data = bb.data.init()
+        data.setVar("BBPATH", self.tempdir)
+        bb.parse.siggen = bb.siggen.init(data)
+
+        # A cooker with the state a resident server has after parsing: the
+        # recipe cache is populated but the command which parsed is done
+        self.cooker = bb.cooker.BBCooker.__new__(bb.cooker.BBCooker)
+        self.cooker.data = data
+        self.cooker.state = bb.cooker.state.initial
+        self.cooker.parsecache_valid = True
+        self.cooker.recipedata_cache = OrderedDict()
+        self.cooker.recipedata_cache_size = 16
+        self.cooker.recipecache = bb.cache.CacheData([bb.cache.CoreRecipeInfo])
+        self.cooker.recipecache.pkg_pn["foo"] = [self.recipe]
+        self.cooker.recipecache.pkg_fn[self.recipe] = "foo"
+        self.cooker.recipecache.pkg_pepvpr[self.recipe] = ("", "1.0", "r0")
+        self.cooker.recipecache.bbfile_priority[self.recipe] = 1
+        self.cooker.recipecache.pkg_dp[self.recipe] = 0
+        self.cooker.collection = bb.cooker.CookerCollectFiles([])
+
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def test_file_name(self):
+        envdata = self.cooker.getRecipeData(self.recipe)
+        self.assertEqual(envdata.getVar("DESCRIPTION", True), "foo 1.0")
+        self.assertIs(self.cooker.getRecipeData(self.recipe), envdata)
+
+    def test_relative_file_name(self):
+        # Relative names would be resolved against the server's cwd
+        os.chdir(self.tempdir)
+        with self.assertRaises(bb.providers.NoProvider):
+            self.cooker.getRecipeData("foo_1.0.bb")
+
+    def test_recipe_name(self):
+        envdata = self.cooker.getRecipeData("foo")
+        self.assertEqual(envdata.getVar("FILE", True), self.recipe)
+
+        with self.assertRaises(bb.providers.NoProvider):
+            self.cooker.getRecipeData("bar")
+
+    def test_recipe_name_unparsed(self):
+        self.cooker.parsecache_valid = False
+        with self.assertRaises(bb.providers.NoProvider):
+            self.cooker.getRecipeData("foo")
+
+        self.cooker.parsecache_valid = True
+        self.cooker.state = bb.cooker.state.parsing
+        with self.assertRaises(bb.providers.NoProvider):
+            self.cooker.getRecipeData("foo")
+
+    def test_command(self):
+        command = bb.command.Command(self.cooker)
+        self.cooker.baseconfig_valid = True
+        self.cooker.inotify_modified_files = set()
+        result, error = command.runCommand(["getRecipeVariables", "foo", ["DESCRIPTION"]], ro_only=True)
+        self.assertIsNone(error)
+        self.assertEqual(result, {"DESCRIPTION": "foo 1.0"})
+
+        # An observer mustn't make the cooker parse
+        self.cooker.collection = None
+        result, error = command.runCommand(["getRecipeVariables", self.recipe, ["DESCRIPTION"]], ro_only=True)
+        self.assertIsNone(result)
+        self.assertIn("not available", error)
+
+class CollectFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="bitbake-test-cooker")
+        for name in ("a/foo.bb", "a/sub/bar.bbappend", "a/CVS/baz.bb", "a/README"):
+            path = os.path.join(self.tempdir, name)
+            bb.utils.mkdirhier(os.path.dirname(path))
+            open(path, "w").close()
+        self.collection = bb.cooker.CookerCollectFiles([])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def age(self):
+        # Make the directories old enough for their listings to be cached
+        for dir, _, _ in os.walk(self.tempdir):
+            os.utime(dir, (0, 0))
+
+    def test_find_bbfiles(self):
+        seendirs = {}
+        found = self.collection.find_bbfiles(os.path.join(self.tempdir, "a"), seendirs)
+        self.assertEqual(sorted(os.path.relpath(f, self.tempdir) for f in found),
+                         ["a/foo.bb", "a/sub/bar.bbappend"])
+        self.assertEqual(sorted(os.path.relpath(d, self.tempdir) for d in seendirs),
+                         ["a", "a/sub"])
+
+    def test_expand_recent(self):
+        # Directories changed within their mtime granularity aren't cached
+        found, entry = self.collection.expand_bbfiles_entry(os.path.join(self.tempdir, "a"), None)
+        self.assertEqual(len(found), 2)
+        self.assertIsNone(entry)
+
+    def test_expand_cached(self):
+        self.age()
+        pattern = os.path.join(self.tempdir, "*", "*.bb")
+        found, entry = self.collection.expand_bbfiles_entry(pattern, None)
+        self.assertEqual(found, [os.path.join(self.tempdir, "a", "foo.bb")])
+        self.assertIsNotNone(entry)
+
+        # An unchanged cache entry is reused as it is
+        self.assertIs(self.collection.expand_bbfiles_entry(pattern, entry)[1], entry)
+
+        open(os.path.join(self.tempdir, "a", "new.bb"), "w").close()
+        found, _ = self.collection.expand_bbfiles_entry(pattern, entry)
+        self.assertEqual(len(found), 2)
+
+    def test_expand_literal_after_wildcard(self):
+        # Creating x/recipes in an existing x only changes the mtime of x
+        os.mkdir(os.path.join(self.tempdir, "x"))
+        self.age()
+        pattern = os.path.join(self.tempdir, "*", "recipes", "*.bb")
+        found, entry = self.collection.expand_bbfiles_entry(pattern, None)
+        self.assertEqual(found, [])
+        self.assertIsNotNone(entry)
+
+        os.mkdir(os.path.join(self.tempdir, "x", "recipes"))
+        open(os.path.join(self.tempdir, "x", "recipes", "foo.bb"), "w").close()
+        os.utime(os.path.join(self.tempdir, "x", "recipes"), (0, 0))
+        found, _ = self.collection.expand_bbfiles_entry(pattern, entry)
+        self.assertEqual(found, [os.path.join(self.tempdir, "x", "recipes", "foo.bb")])
+
+class ReusableCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="bitbake-test-cooker")
+        self.recipe = os.path.join(self.tempdir, "recipes", "foo_1.0.bb")
+        self.patch = os.path.join(self.tempdir, "files", "fix.patch")
+        os.mkdir(os.path.dirname(self.recipe))
+        os.mkdir(os.path.dirname(self.patch))
+        with open(self.recipe, "w") as f:
+            f.write('PV = "1.0"\n'
+                    'do_fetch() {\n:\n}\n'
+                    'addtask fetch\n'
+                    'do_fetch[file-checksums] = "%s:False"\n' % self.patch)
+
+        self.data = bb.data.init()
+        self.data.setVar("BBPATH", self.tempdir)
+        self.data.setVar("CACHE", os.path.join(self.tempdir, "cache"))
+        bb.parse.siggen = bb.siggen.init(self.data)
+
+        # Just the file watching of a cooker
+        self.cooker = bb.cooker.BBCooker.__new__(bb.cooker.BBCooker)
+        self.cooker.watchmask = pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_CLOSE_WRITE
+        self.cooker.watcher = pyinotify.WatchManager()
+        self.cooker.watcher.bbseen = set()
+        self.cooker.watcher.bbwatchedfiles = set()
+        self.cooker.notifier = pyinotify.Notifier(self.cooker.watcher, self.cooker.notifications)
+        self.cooker.inotify_modified_files = set()
+        self.cooker.recipe_modified_files = set()
+        self.cooker.recipedata_cache = OrderedDict()
+
+        caches_array = [bb.cache.CoreRecipeInfo]
+        self.cache = bb.cache.Cache(self.data, "hash", caches_array)
+        recipecache = bb.cache.CacheData(caches_array)
+        for vfn, info_array in bb.cache.Cache.parse(self.recipe, [], self.data, caches_array):
+            self.cache.add_info(vfn, info_array, recipecache, parsed=True,
+                                watcher=self.cooker.add_filewatch)
+
+    def tearDown(self):
+        self.cooker.watcher.close()
+        shutil.rmtree(self.tempdir)
+
+    def reusable(self):
+        # What updateCache() does with a kept cache before reparsing
+        if self.cooker.notifier.check_events(timeout=100):
+            self.cooker.notifier.read_events()
+            self.cooker.notifier.process_events()
+        self.cache.invalidate(self.cooker.recipe_modified_files)
+        self.cooker.recipe_modified_files = set()
+        return self.recipe in self.cache.cacheValidAll([(self.recipe, [])])
+
+    def test_reuse(self):
+        self.assertTrue(self.reusable())
+        # Unrelated changes leave the recipe alone
+        open(os.path.join(self.tempdir, "files", "other.patch"), "w").close()
+        self.assertTrue(self.reusable())
+
+    def test_file_checksums(self):
+        self.assertTrue(self.reusable())
+        # A file:// SRC_URI entry appearing needs the recipe reparsed
+        open(self.patch, "w").close()
+        self.assertFalse(self.reusable())
@@ -0,0 +1,127 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for the Event implementation (event.py)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import multiprocessing
+import os
+import pickle
+import unittest
+import bb
+import bb.event
+import bb.server
+
+class EventHandlingTest(unittest.TestCase):
+
+    def setUp(self):
+        self._handlers = bb.event.get_class_handlers()
+        bb.event.set_class_handlers(bb.event.clean_class_handlers())
+        self.d = bb.data.init()
+        self.seen = []
+
+    def tearDown(self):
+        bb.event.set_class_handlers(self._handlers)
+
+    def _handler(self, name):
+        def handler(e):
+            self.seen.append((name, e.__class__.__name__))
+        return handler
+
+    def test_mask(self):
+        bb.event.register("h_started", self._handler("h_started"), ["bb.event.BuildStarted"])
+        bb.event.register("h_all", self._handler("h_all"))
+        bb.event.fire_class_handlers(bb.event.BuildStarted("test", []), self.d)
+        bb.event.fire_class_handlers(bb.event.ConfigParsed(), self.d)
+        self.assertEqual(self.seen, [("h_started", "BuildStarted"),
+                                     ("h_all", "BuildStarted"),
+                                     ("h_all", "ConfigParsed")])
+
+    def test_register_remove(self):
+        bb.event.register("h_one", self._handler("h_one"), ["bb.event.ConfigParsed"])
+        bb.event.fire_class_handlers(bb.event.ConfigParsed(), self.d)
+        bb.event.register("h_two", self._handler("h_two"), ["bb.event.ConfigParsed"])
+        bb.event.fire_class_handlers(bb.event.ConfigParsed(), self.d)
+        bb.event.remove("h_one", None)
+        bb.event.fire_class_handlers(bb.event.ConfigParsed(), self.d)
+        self.assertEqual([name for name, _ in self.seen], ["h_one", "h_one", "h_two", "h_two"])
+
+    def test_set_class_handlers(self):
+        saved = bb.event.get_class_handlers().copy()
+        bb.event.register("h_one", self._handler("h_one"), ["bb.event.ConfigParsed"])
+        bb.event.fire_class_handlers(bb.event.ConfigParsed(), self.d)
+        bb.event.set_class_handlers(saved)
+        bb.event.fire_class_handlers(bb.event.ConfigParsed(), self.d)
+        self.assertEqual([name for name, _ in self.seen], ["h_one"])
+
+class PipeEventSender(bb.server.BatchedEventSender):
+    def __init__(self, conn):
+        bb.server.BatchedEventSender.__init__(self)
+        self.conn = conn
+
+    def sendbatch(self, batch):
+        self.conn.send([pickle.loads(e).__class__.__name__ for e in batch])
+
+class UIHandler(object):
+    def __init__(self, event):
+        self.event = event
+
+class BatchedEventTest(unittest.TestCase):
+    def setUp(self):
+        self.reader, writer = multiprocessing.Pipe(duplex=False)
+        self.sender = PipeEventSender(writer)
+        self._uiready = bb.event._uiready
+        self.handler = bb.event.register_UIHhandler(UIHandler(self.sender), mainui=True)
+        self.d = bb.data.init()
+
+    def tearDown(self):
+        bb.event.unregister_UIHhandler(self.handler)
+        bb.event._uiready = self._uiready
+
+    def recv(self):
+        self.assertTrue(self.reader.poll(5))
+        return self.reader.recv()
+
+    def test_batching(self):
+        bb.event.fire_ui_handlers(bb.event.ConfigParsed(), self.d)
+        self.assertFalse(self.reader.poll())
+        bb.event.flush_ui_handlers()
+        self.assertEqual(self.recv(), ["ConfigParsed"])
+
+    def test_timer(self):
+        # A batch is sent after batch_interval even if nothing else happens
+        # in the sending thread, here blocked in recv()
+        bb.event.fire_ui_handlers(bb.event.ConfigParsed(), self.d)
+        self.assertEqual(self.recv(), ["ConfigParsed"])
+
+    def test_forked_child(self):
+        # An event still batched in the parent, which flushes before forking
+        bb.event.fire_ui_handlers(bb.event.ConfigParsed(), self.d)
+        bb.event.flush_ui_handlers()
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                bb.event.fire_ui_handlers(bb.event.ParseStarted(1), self.d)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        # The child's event arrives without a flush, after the parent's
+        self.assertEqual(self.recv(), ["ConfigParsed"])
+        self.assertEqual(self.recv(), ["ParseStarted"])
+        bb.event.flush_ui_handlers()
+        self.assertFalse(self.reader.poll())
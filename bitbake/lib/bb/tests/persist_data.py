@@ -0,0 +1,67 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for persist_data.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import tempfile
+import shutil
+import threading
+
+import bb
+import bb.data
+import bb.persist_data
+
+class BatchedTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="bitbake-test-persist")
+        self.d = bb.data.init()
+        self.d.setVar("PERSISTENT_DIR", self.tempdir)
+        self.d.setVar("BB_PERSIST_BATCHED_DOMAINS", "BB_TEST")
+
+    def tearDown(self):
+        bb.persist_data.sync_all()
+        bb.persist_data._tables.clear()
+        shutil.rmtree(self.tempdir)
+
+    def test_threads(self):
+        table = bb.persist_data.persist("BB_TEST", self.d)
+        table["main"] = "1"
+        table.sync()
+
+        errors = []
+        def worker(n):
+            try:
+                self.assertIs(bb.persist_data.persist("BB_TEST", self.d), table)
+                self.assertEqual(table["main"], "1")
+                for i in range(table.batch_size + 1):
+                    table["thread%d-%d" % (n, i)] = str(i)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+        # Writes queued by other threads are synced from this one
+        bb.persist_data.sync_all()
+        self.assertEqual(len(bb.persist_data.SQLTable(table.cachefile, "BB_TEST")),
+                         1 + 4 * (table.batch_size + 1))
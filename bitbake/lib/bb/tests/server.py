@@ -0,0 +1,66 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for the process server
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import os
+import select
+import time
+
+import bb.server.process
+
+class IdleLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = bb.server.process.ProcessServer(None, None, [])
+        self.server.poller = select.epoll()
+        self.readfd, self.writefd = os.pipe()
+
+    def tearDown(self):
+        self.server.poller.close()
+        os.close(self.readfd)
+        os.close(self.writefd)
+
+    def test_idle_delay(self):
+        # An idle function waiting on an fd which never becomes ready is
+        # still called again within idle_delay
+        self.assertIsNotNone(bb.server.process.ProcessServer.idle_delay)
+        self.assertLessEqual(bb.server.process.ProcessServer.idle_delay, 1.0)
+
+        calls = []
+        def idle(server, data, abort):
+            calls.append(time.time())
+            return [self.readfd]
+        self.server.register_idle_function(idle, None)
+
+        start = time.time()
+        for i in range(3):
+            self.server.idle_commands(self.server.idle_delay, [])
+        self.assertEqual(len(calls), 3)
+        self.assertLess(calls[-1] - start, 2 * self.server.idle_delay + 0.5)
+
+    def test_fd_ready(self):
+        # A ready fd ends the sleep straight away
+        def idle(server, data, abort):
+            return [self.readfd]
+        self.server.register_idle_function(idle, None)
+        os.write(self.writefd, b"x")
+
+        start = time.time()
+        self.server.idle_commands(None, [])
+        self.assertLess(time.time() - start, 0.5)
@@ -0,0 +1,60 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for tinfoil.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import tempfile
+import shutil
+import os
+from unittest import mock
+
+import bb.server.xmlrpc
+import bb.tinfoil
+
+class ServerTinfoilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="bitbake-test-tinfoil")
+        self.builddir = os.path.join(self.tempdir, "build")
+        os.mkdir(self.builddir)
+        with open(os.path.join(self.builddir, "bitbake.lock"), "w") as f:
+            f.write("localhost:1234\n")
+        self.cwd = os.getcwd()
+        os.chdir(self.tempdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def connect(self, env):
+        with mock.patch.dict(os.environ, env), \
+             mock.patch.object(bb.server.xmlrpc, "_create_server",
+                               return_value=(mock.Mock(), mock.Mock())) as create:
+            bb.tinfoil.ServerTinfoil("localhost:-1")
+            return create.call_args[0]
+
+    def test_builddir(self):
+        # The lock file is found in the build directory wherever we run
+        self.assertEqual(self.connect({"BUILDDIR": self.builddir}), ("localhost", 1234))
+
+    def test_no_lockfile(self):
+        env = dict(os.environ)
+        env.pop("BUILDDIR", None)
+        with mock.patch.dict(os.environ, env, clear=True):
+            with self.assertRaises(bb.tinfoil.TinfoilServerError):
+                bb.tinfoil.ServerTinfoil("localhost:-1")
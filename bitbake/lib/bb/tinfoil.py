@@ -90,6 +90,60 @@ class Tinfoil:
         self.cooker.unlockBitbake()
         self.logger.removeHandler(self._log_hdlr)
 
+class TinfoilServerError(Exception):
+    """Exception raised when a query to a bitbake server fails"""
+
+class ServerTinfoil:
+    """
+    Query a memory resident bitbake server (as started by
+    oe-init-build-env-memres) instead of starting a cooker of our own,
+    which saves parsing the configuration (and recipes) for every
+    script. Only read-only queries are made, as an observer, so this
+    works alongside a UI connected to the same server.
+    """
+    def __init__(self, remote=None):
+        import bb.server.xmlrpc
+
+        remote = remote or os.environ.get("BBSERVER")
+        if not remote:
+            raise TinfoilServerError("No bitbake server given and BBSERVER is not set")
+        host, port = remote.split(":", 1)
+        if int(port) == -1:
+            # The server records its address in the lock file in the
+            # build directory, which needn't be our cwd
+            lockfile = os.path.join(os.environ.get("BUILDDIR") or os.getcwd(), "bitbake.lock")
+            try:
+                with open(lockfile, "r") as lf:
+                    host, port = lf.readline().strip().split(":")
+            except (OSError, ValueError) as exc:
+                raise TinfoilServerError("Unable to read the server address from %s: %s" % (lockfile, exc))
+        self.connection, self.transport = bb.server.xmlrpc._create_server(host, int(port))
+        self.transport.set_connection_token("observer")
+
+    def runCommand(self, *command):
+        result, error = self.connection.runCommand(list(command))
+        if error:
+            raise TinfoilServerError(error)
+        return result
+
+    def getVariable(self, varname, expand=True):
+        return self.runCommand("getVariable", varname, str(expand))
+
+    def getVariables(self, varnames, expand=True):
+        return self.runCommand("getVariables", list(varnames), expand)
+
+    def getRecipeVariables(self, target, varnames, expand=True):
+        """
+        Return a dict of the values of varnames for target, a recipe
+        file name or, if the server has parsed the recipes, a recipe name.
+        The server must have parsed the recipes at least once.
+        """
+        # The server resolves file names against its own cwd
+        fn, cls = bb.cache.Cache.virtualfn2realfn(target)
+        if os.path.isfile(fn):
+            target = bb.cache.Cache.realfn2virtual(os.path.abspath(fn), cls)
+        return self.runCommand("getRecipeVariables", target, list(varnames), expand)
+
 class TinfoilConfigParameters(ConfigParameters):
 
     def __init__(self, **options):
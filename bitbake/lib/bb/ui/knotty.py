@@ -106,9 +106,13 @@ class InteractConsoleLogFilter(logging.Filter):
 class TerminalFilter(object):
     rows = 25
     columns = 80
+    # Minimum time between footer redraws, in seconds
+    footer_interval = 0.2
 
     def sigwinch_handle(self, signum, frame):
         self.rows, self.columns = self.getTerminalColumns()
+        # Lines may have wrapped, don't try to reuse them
+        self.footer_lines = []
         if self._sigwinch_default:
             self._sigwinch_default(signum, frame)
 
@@ -141,7 +145,10 @@ class TerminalFilter(object):
         self.stdinbackup = None
         self.interactive = sys.stdout.isatty()
         self.footer_present = False
+        self.footer_lines = []
         self.lastpids = []
+        self.lastcount = None
+        self.lastfooter = 0
 
         if not self.interactive:
             return
@@ -166,6 +173,7 @@ class TerminalFilter(object):
             self.ed = curses.tigetstr("ed")
             if self.ed:
                 self.cuu = curses.tigetstr("cuu")
+            self.el = curses.tigetstr("el")
             try:
                 self._sigwinch_default = signal.getsignal(signal.SIGWINCH)
                 signal.signal(signal.SIGWINCH, self.sigwinch_handle)
@@ -184,10 +192,41 @@ class TerminalFilter(object):
     def clearFooter(self):
         if self.footer_present:
             lines = self.footer_present
+            sys.stdout.flush()
             sys.stdout.buffer.write(self.curses.tparm(self.cuu, lines))
             sys.stdout.buffer.write(self.curses.tparm(self.ed))
             sys.stdout.flush()
         self.footer_present = False
+        self.footer_lines = []
+
+    def drawFooter(self, lines):
+        """
+        Draw the footer, one terminal row per line. If the previous
+        footer is still on screen only the lines which changed are
+        rewritten.
+        """
+        sys.stdout.flush()
+        out = sys.stdout.buffer
+        encoding = sys.stdout.encoding or "utf-8"
+        old = self.footer_lines
+        if self.footer_present and old and self.el and self.footer_present == len(old):
+            out.write(self.curses.tparm(self.cuu, len(old)))
+            for i, line in enumerate(lines):
+                if i < len(old) and old[i] == line:
+                    out.write(b"\n")
+                elif i < len(old):
+                    out.write(b"\r" + self.el + line.encode(encoding, "replace") + b"\n")
+                else:
+                    out.write(line.encode(encoding, "replace") + b"\n")
+            if len(lines) < len(old):
+                out.write(self.curses.tparm(self.ed))
+        else:
+            self.clearFooter()
+            for line in lines:
+                out.write(line.encode(encoding, "replace") + b"\n")
+        sys.stdout.flush()
+        self.footer_present = len(lines)
+        self.footer_lines = lines
 
     def updateFooter(self):
         if not self.cuu:
@@ -197,9 +236,13 @@ class TerminalFilter(object):
         runningpids = self.helper.running_pids
         if self.footer_present and (self.lastcount == self.helper.tasknumber_current) and (self.lastpids == runningpids):
             return
-        if self.footer_present:
-            self.clearFooter()
+        # Redraw at most once per footer_interval, a busy build changes
+        # the task list far more often than anyone can read it
+        now = time.time()
+        if now - self.lastfooter < self.footer_interval:
+            return
         if (not self.helper.tasknumber_total or self.helper.tasknumber_current == self.helper.tasknumber_total) and not len(activetasks):
+            self.clearFooter()
             return
         tasks = []
         for t in runningpids:
@@ -211,13 +254,21 @@ class TerminalFilter(object):
             content = "No currently running tasks (%s of %s)" % (self.helper.tasknumber_current, self.helper.tasknumber_total)
         else:
             content = "Currently %s running tasks (%s of %s):" % (len(activetasks), self.helper.tasknumber_current, self.helper.tasknumber_total)
-        print(content)
-        lines = 1 + int(len(content) / (self.columns + 1))
-        for tasknum, task in enumerate(tasks[:(self.rows - 2)]):
-            content = "%s: %s" % (tasknum, task)
-            print(content)
-            lines = lines + 1 + int(len(content) / (self.columns + 1))
-        self.footer_present = lines
+        lines = [content]
+        # Summarise the tasks which don't fit on the screen
+        maxtasks = max(self.rows - 2, 1)
+        if len(tasks) > maxtasks:
+            shown = maxtasks - 1
+            tasks = tasks[:shown] + ["... and %s more" % (len(tasks) - shown)]
+        for tasknum, task in enumerate(tasks):
+            if task.startswith("... "):
+                lines.append(task)
+            else:
+                lines.append("%s: %s" % (tasknum, task))
+        # Keep each line to one row so rows can be rewritten in place
+        lines = [line[:max(self.columns - 1, 1)] for line in lines]
+        self.drawFooter(lines)
+        self.lastfooter = now
         self.lastpids = runningpids[:]
         self.lastcount = self.helper.tasknumber_current
 
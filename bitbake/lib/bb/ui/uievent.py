@@ -42,6 +42,7 @@ class BBUIEventQueue:
 
         server.register_function( self.system_quit, "event.quit" )
         server.register_function( self.send_event, "event.sendpickle" )
+        server.register_function( self.send_events, "event.sendpickles" )
         server.socket.settimeout(1)
 
         self.EventHandle = None
@@ -107,6 +108,13 @@ class BBUIEventQueue:
     def send_event(self, event):
         self.queue_event(pickle.loads(event))
 
+    def send_events(self, events):
+        events = [pickle.loads(event) for event in events]
+        self.eventQueueLock.acquire()
+        self.eventQueue.extend(events)
+        self.eventQueueNotify.set()
+        self.eventQueueLock.release()
+
     def startCallbackHandler(self):
 
         self.server.timeout = 1
@@ -1,3 +1,4 @@
+import collections
 import logging
 import os.path
 import errno
@@ -26,10 +27,19 @@ if sqlversion[0] < 3 or (sqlversion[0] == 3 and sqlversion[1] < 3):
 #
 
 class PRTable(object):
+    # Number of (version, pkgarch, checksum) results kept in memory
+    cache_size = 10000
+
     def __init__(self, conn, table, nohist):
         self.conn = conn
         self.nohist = nohist
         self.dirty = False
+        # LRU of values handed out, plus the highest value seen for each
+        # (version, pkgarch). All writes go through this object, so in
+        # "No History" mode a cached value is only still valid while it
+        # is the highest for its (version, pkgarch).
+        self.cache = collections.OrderedDict()
+        self.maxvalues = {}
         if nohist:
             self.table = "%s_nohist" % table 
         else:
@@ -117,11 +127,35 @@ class PRTable(object):
             else:
                 raise prserv.NotFoundError
 
+    def _cacheValue(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        if len(self.maxvalues) > self.cache_size:
+            self.maxvalues.clear()
+        if value > self.maxvalues.get(key[:2], -1):
+            self.maxvalues[key[:2]] = value
+
+    def _invalidateCache(self):
+        self.cache.clear()
+        self.maxvalues.clear()
+
     def getValue(self, version, pkgarch, checksum):
+        key = (version, pkgarch, checksum)
+        value = self.cache.get(key)
+        if value is not None:
+            if not self.nohist or value == self.maxvalues.get(key[:2]):
+                self.cache.move_to_end(key)
+                return value
+
         if self.nohist:
-            return self._getValueNohist(version, pkgarch, checksum)
+            value = self._getValueNohist(version, pkgarch, checksum)
         else:
-            return self._getValueHist(version, pkgarch, checksum)
+            value = self._getValueHist(version, pkgarch, checksum)
+        self._cacheValue(key, value)
+        return value
 
     def _importHist(self, version, pkgarch, checksum, value):
         val = None 
@@ -172,6 +206,7 @@ class PRTable(object):
             return None
 
     def importone(self, version, pkgarch, checksum, value):
+        self._invalidateCache()
         if self.nohist:
             return self._importNohist(version, pkgarch, checksum, value)
         else:
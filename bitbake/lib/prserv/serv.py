@@ -2,9 +2,9 @@ import os,sys,logging
 import signal, time
 from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 import threading
-import queue
 import socket
 import io
+import xmlrpc.client
 
 try:
     import sqlite3
@@ -23,6 +23,12 @@ if sys.hexversion < 0x020600F0:
     sys.exit(1)
 
 class Handler(SimpleXMLRPCRequestHandler):
+    # Keep the connection open between calls so clients don't pay for a
+    # new HTTP connection on every request
+    protocol_version = "HTTP/1.1"
+    # Close connections which have been idle for this long
+    timeout = 60
+
     def _dispatch(self,method,params):
         try:
             value=self.server.funcs[method](*params)
@@ -40,7 +46,7 @@ class PRServer(SimpleXMLRPCServer):
     def __init__(self, dbfile, logfile, interface, daemon=True):
         ''' constructor '''
         try:
-            SimpleXMLRPCServer.__init__(self, interface,
+            SimpleXMLRPCServer.__init__(self, interface, requestHandler=Handler,
                                         logRequests=False, allow_none=True)
         except socket.error:
             ip=socket.gethostbyname(interface[0])
@@ -57,6 +63,7 @@ class PRServer(SimpleXMLRPCServer):
         self.pidfile=PIDPREFIX % (self.host, self.port)
 
         self.register_function(self.getPR, "getPR")
+        self.register_function(self.getPRs, "getPRs")
         self.register_function(self.quit, "quit")
         self.register_function(self.ping, "ping")
         self.register_function(self.export, "export")
@@ -64,39 +71,24 @@ class PRServer(SimpleXMLRPCServer):
         self.register_function(self.importone, "importone")
         self.register_introspection_functions()
 
-        self.requestqueue = queue.Queue()
-        self.handlerthread = threading.Thread(target = self.process_request_thread)
-        self.handlerthread.daemon = False
+        # Each client connection is served by its own thread, access to
+        # the database is serialised by this lock
+        self.tablelock = threading.RLock()
 
-    def process_request_thread(self):
+    def process_request_thread(self, request, client_address):
         """Same as in BaseServer but as a thread.
 
         In addition, exception handling is done here.
 
         """
-        iter_count = 1
-        # 60 iterations between syncs or sync if dirty every ~30 seconds
-        iterations_between_sync = 60
-
-        bb.utils.set_process_name("PRServ Handler")
-
-        while not self.quit:
-            try:
-                (request, client_address) = self.requestqueue.get(True, 30)
-            except queue.Empty:
-                self.table.sync_if_dirty()
-                continue
-            try:
-                self.finish_request(request, client_address)
-                self.shutdown_request(request)
-                iter_count = (iter_count + 1) % iterations_between_sync
-                if iter_count == 0:
-                    self.table.sync_if_dirty()
-            except:
-                self.handle_error(request, client_address)
-                self.shutdown_request(request)
+        try:
+            self.finish_request(request, client_address)
+        except:
+            self.handle_error(request, client_address)
+            with self.tablelock:
                 self.table.sync()
-            self.table.sync_if_dirty()
+        finally:
+            self.shutdown_request(request)
 
     def sigint_handler(self, signum, stack):
         if self.table:
@@ -108,11 +100,15 @@ class PRServer(SimpleXMLRPCServer):
         self.quit=True
 
     def process_request(self, request, client_address):
-        self.requestqueue.put((request, client_address))
+        t = threading.Thread(target = self.process_request_thread,
+                             args = (request, client_address))
+        t.daemon = True
+        t.start()
 
     def export(self, version=None, pkgarch=None, checksum=None, colinfo=True):
         try:
-            return self.table.export(version, pkgarch, checksum, colinfo)
+            with self.tablelock:
+                return self.table.export(version, pkgarch, checksum, colinfo)
         except sqlite3.Error as exc:
             logger.error(str(exc))
             return None
@@ -128,8 +124,9 @@ class PRServer(SimpleXMLRPCServer):
         """
         buff = io.StringIO()
         try:
-            self.table.sync()
-            self.table.dump_db(buff)
+            with self.tablelock:
+                self.table.sync()
+                self.table.dump_db(buff)
             return buff.getvalue()
         except Exception as exc:
             logger.error(str(exc))
@@ -138,7 +135,10 @@ class PRServer(SimpleXMLRPCServer):
             buff.close()
 
     def importone(self, version, pkgarch, checksum, value):
-        return self.table.importone(version, pkgarch, checksum, value)
+        with self.tablelock:
+            ret = self.table.importone(version, pkgarch, checksum, value)
+            self.table.sync_if_dirty()
+        return ret
 
     def ping(self):
         return not self.quit
@@ -146,7 +146,7 @@ class PRServer(SimpleXMLRPCServer):
     def getinfo(self):
         return (self.host, self.port)
 
-    def getPR(self, version, pkgarch, checksum):
+    def _getPR(self, version, pkgarch, checksum):
         try:
             return self.table.getValue(version, pkgarch, checksum)
         except prserv.NotFoundError:
@@ -156,6 +156,22 @@ class PRServer(SimpleXMLRPCServer):
             logger.error(str(exc))
             return None
 
+    def getPR(self, version, pkgarch, checksum):
+        with self.tablelock:
+            ret = self._getPR(version, pkgarch, checksum)
+            self.table.sync_if_dirty()
+        return ret
+
+    def getPRs(self, queries):
+        """
+        Return the PR values for a list of (version, pkgarch, checksum)
+        queries in a single call
+        """
+        with self.tablelock:
+            ret = [self._getPR(version, pkgarch, checksum) for (version, pkgarch, checksum) in queries]
+            self.table.sync_if_dirty()
+        return ret
+
     def quit(self):
         self.quit=True
         return
@@ -173,11 +189,11 @@ class PRServer(SimpleXMLRPCServer):
         logger.info("Started PRServer with DBfile: %s, IP: %s, PORT: %s, PID: %s" %
                      (self.dbfile, self.host, self.port, str(os.getpid())))
 
-        self.handlerthread.start()
         while not self.quit:
             self.handle_request()
-        self.handlerthread.join()
-        self.db.disconnect()
+        with self.tablelock:
+            self.table.sync_if_dirty()
+            self.db.disconnect()
         logger.info("PRServer: stopping...")
         self.server_close()
         return
@@ -304,6 +320,13 @@ class PRServerConnection(object):
     def getPR(self, version, pkgarch, checksum):
         return self.connection.getPR(version, pkgarch, checksum)
 
+    def getPRs(self, queries):
+        try:
+            return self.connection.getPRs(queries)
+        except xmlrpc.client.Fault:
+            # Older servers only know about single queries
+            return [self.getPR(*query) for query in queries]
+
     def ping(self):
         return self.connection.ping()
 
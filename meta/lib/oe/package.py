@@ -44,6 +44,120 @@ def runstrip(arg):
     return
 
 
+def splitdebuginfo(file, debugfile, debugsrcdir, sourcefile, objcopy, debugedit):
+    # Function to split a single file into two components, one is the stripped
+    # target system binary, the other contains any debugging information. The
+    # two files are linked to reference each other.
+    #
+    # sourcefile is also generated containing a list of debugsources
+
+    import stat
+    import oe.utils
+
+    # We ignore kernel modules, we don't generate debug info files.
+    if file.find("/lib/modules/") != -1 and file.endswith(".ko"):
+        return 1
+
+    newmode = None
+    if not os.access(file, os.W_OK) or os.access(file, os.R_OK):
+        origmode = os.stat(file)[stat.ST_MODE]
+        newmode = origmode | stat.S_IWRITE | stat.S_IREAD
+        os.chmod(file, newmode)
+
+    # We need to extract the debug src information here...
+    if debugsrcdir:
+        cmd = "'%s' -i -l '%s' '%s'" % (debugedit, sourcefile, file)
+        (retval, output) = oe.utils.getstatusoutput(cmd)
+        if retval:
+            bb.fatal("debugedit failed with exit code %s (cmd was %s)%s" % (retval, cmd, ":\n%s" % output if output else ""))
+
+    bb.utils.mkdirhier(os.path.dirname(debugfile))
+
+    cmd = "'%s' --only-keep-debug '%s' '%s'" % (objcopy, file, debugfile)
+    (retval, output) = oe.utils.getstatusoutput(cmd)
+    if retval:
+        bb.fatal("objcopy failed with exit code %s (cmd was %s)%s" % (retval, cmd, ":\n%s" % output if output else ""))
+
+    # Set the debuglink to have the view of the file path on the target
+    cmd = "'%s' --add-gnu-debuglink='%s' '%s'" % (objcopy, debugfile, file)
+    (retval, output) = oe.utils.getstatusoutput(cmd)
+    if retval:
+        bb.fatal("objcopy failed with exit code %s (cmd was %s)%s" % (retval, cmd, ":\n%s" % output if output else ""))
+
+    if newmode:
+        os.chmod(file, origmode)
+
+    return 0
+
+def splitstrip(arg):
+    # Function to split the debug info out of a single file and then strip
+    # it, called from split_and_strip_files below so that both steps run
+    # in the same pool worker. Either step is skipped if its argument is None.
+
+    (file, elftype, debugfile, debugsrcdir, sourcefile, objcopy, debugedit, strip) = arg
+
+    if debugfile:
+        splitdebuginfo(file, debugfile, debugsrcdir, sourcefile, objcopy, debugedit)
+    if strip:
+        runstrip((file, elftype, strip))
+
+def is_elf(path):
+    """
+    Classify path using the bit pattern split_and_strip_files works with:
+    1 - ELF
+    2 - stripped
+    4 - executable
+    8 - shared library
+    The ELF headers are read directly rather than running 'file'.
+    Returns a (path, type) tuple so it can be used with multiprocess_exec.
+    Raises OSError if path can't be read.
+    """
+    import struct
+    import oe.qa
+
+    elftype = 0
+    elf = oe.qa.ELFFile(path)
+    try:
+        elf.open()
+        elftype |= 1
+        if not elf.hasSymtab():
+            elftype |= 2
+        etype = elf.elfType()
+        if etype == oe.qa.ELFFile.ET_EXEC:
+            elftype |= 4
+        elif etype == oe.qa.ELFFile.ET_DYN:
+            elftype |= 8
+    except (oe.qa.NotELFFileError, struct.error):
+        pass
+    return (path, elftype)
+
+def is_elf_checked(path):
+    """
+    is_elf() for multiprocess_exec, returning (path, type, error) where
+    error is None or a message for a file which couldn't be read
+    """
+    try:
+        return is_elf(path) + (None,)
+    except OSError as e:
+        return (path, 0, "split_and_strip_files: unable to read %s: %s" % (path, e.strerror))
+
+def is_elf_files(paths):
+    """
+    Classify each of paths with is_elf(), using a pool of processes for
+    large trees. Returns a dict of path to type and a list of errors for
+    the files which couldn't be read, which are classified as not ELF.
+    """
+    import oe.utils
+
+    paths = list(set(paths))
+    if len(paths) < 100:
+        results = [is_elf_checked(path) for path in paths]
+    else:
+        results = oe.utils.multiprocess_exec(paths, is_elf_checked)
+    types = dict((path, elftype) for path, elftype, _ in results)
+    errors = [error for _, _, error in results if error]
+    return types, errors
+
 def file_translate(file):
     ft = file.replace("@", "@at@")
     ft = ft.replace(" ", "@space@")
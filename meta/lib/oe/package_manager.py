@@ -7,6 +7,7 @@ import multiprocessing
 import re
 import bb
 import tempfile
+import oe.path
 import oe.utils
 import string
 from oe.gpg_sign import get_signer
@@ -89,6 +90,357 @@ def opkg_query(cmd_output):
     return output
 
 
+def package_members(path):
+    """
+    Yield (name, file object) for each top level member of an ipk or deb
+    archive (debian-binary, control.tar.* and data.tar.*)
+    """
+    import tarfile
+
+    with open(path, "rb") as f:
+        if f.read(8) == b"!<arch>\n":
+            while True:
+                header = f.read(60)
+                if len(header) < 60:
+                    break
+                name = header[0:16].decode("utf-8").strip().rstrip("/")
+                size = int(header[48:58])
+                start = f.tell()
+                # Copy members out so that tarfile can't read past their
+                # end. Not a SpooledTemporaryFile, before Python 3.11 it
+                # lacks the seekable() which the xz and bz2 readers need.
+                with tempfile.TemporaryFile() as member:
+                    remaining = size
+                    while remaining:
+                        chunk = f.read(min(remaining, 1024 * 1024))
+                        if not chunk:
+                            raise ValueError("truncated archive member %s" % name)
+                        member.write(chunk)
+                        remaining -= len(chunk)
+                    member.seek(0)
+                    yield name, member
+                f.seek(start + size + (size & 1))
+        else:
+            # Old style ipks are a tar.gz rather than an ar archive
+            f.seek(0)
+            with tarfile.open(fileobj=f, mode="r:*") as tar:
+                for member in tar.getmembers():
+                    if member.isfile():
+                        yield os.path.basename(member.name), tar.extractfile(member)
+
+def read_package_control(path):
+    """
+    Return the control file of an ipk or deb package as a string
+    """
+    import tarfile
+
+    for name, member in package_members(path):
+        if name.startswith("control.tar"):
+            with tarfile.open(fileobj=member, mode="r:*") as tar:
+                for info in tar.getmembers():
+                    if info.name in ("control", "./control"):
+                        return tar.extractfile(info).read().decode("utf-8")
+            raise ValueError("no control file in control.tar")
+    raise ValueError("no control.tar member")
+
+def read_feed_package(path):
+    """
+    Read the control file and checksums of a package for FeedIndexCache.
+    Returns (path, info dict), or (path, error message) on failure.
+    """
+    import hashlib
+
+    try:
+        control = read_package_control(path)
+        md5 = hashlib.md5()
+        sha1 = hashlib.sha1()
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(chunk)
+                sha1.update(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+    except Exception as e:
+        return (path, "Unable to read package %s: %s" % (path, e))
+
+    fields = {}
+    for line in control.splitlines():
+        if line and not line[0].isspace() and ":" in line:
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+
+    return (path, {"control": control.rstrip("\n"), "fields": fields, "size": size,
+                   "md5": md5.hexdigest(), "sha1": sha1.hexdigest(), "sha256": sha256.hexdigest()})
+
+class FeedIndexCache(object):
+    """
+    Cache of the control data and checksums of the packages in a feed
+    directory, keyed on file name, size and mtime, so that reindexing a
+    feed only reads the packages which were added or changed. It also
+    remembers the directory contents at the last successful index so that
+    unchanged feeds needn't be reindexed at all.
+    """
+    def __init__(self, d, pkgs_dir, suffix):
+        import hashlib
+        import pickle
+
+        self.pkgs_dir = pkgs_dir
+        self.suffix = suffix
+        self.cachefile = os.path.join(d.getVar('TMPDIR', True), "cache", "feed-index",
+                                      hashlib.md5(os.path.abspath(pkgs_dir).encode("utf-8")).hexdigest())
+        try:
+            with open(self.cachefile, "rb") as f:
+                self.stamp, self.packages = pickle.load(f)
+        except Exception:
+            self.stamp, self.packages = None, {}
+
+        self.current = {}
+        for name in os.listdir(pkgs_dir):
+            if not name.endswith(suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(pkgs_dir, name))
+            except OSError:
+                continue
+            self.current[name] = (st.st_size, st.st_mtime_ns)
+
+    def unchanged(self, indexfile):
+        """
+        Return True if the feed has the same packages as when indexfile was
+        last written
+        """
+        return self.stamp == self.current and os.path.exists(indexfile)
+
+    def read(self):
+        """
+        Return a dict mapping the name of each package to its info (see
+        read_feed_package()) and a list of errors, reading only the
+        packages which aren't in the cache
+        """
+        packages = {}
+        todo = []
+        for name, key in self.current.items():
+            if name in self.packages and self.packages[name][0] == key:
+                packages[name] = self.packages[name][1]
+            else:
+                todo.append(os.path.join(self.pkgs_dir, name))
+
+        errors = []
+        if len(todo) > 1:
+            results = oe.utils.multiprocess_exec(todo, read_feed_package)
+        else:
+            results = [read_feed_package(path) for path in todo]
+        for path, info in results:
+            if isinstance(info, str):
+                errors.append(info)
+            else:
+                packages[os.path.basename(path)] = info
+
+        self.packages = dict((name, (self.current[name], packages[name])) for name in packages)
+        return packages, errors
+
+    def save(self):
+        """Record that the feed has been indexed in its current state"""
+        import pickle
+
+        self.stamp = self.current
+        bb.utils.mkdirhier(os.path.dirname(self.cachefile))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.cachefile))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((self.stamp, self.packages), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.cachefile)
+
+def write_feed_index(pkgs_file, stanzas):
+    """
+    Atomically write a Packages file (and Packages.gz) from a list of
+    stanzas
+    """
+    import gzip
+
+    data = "".join(stanza + "\n" for stanza in stanzas).encode("utf-8")
+    pkgs_dir = os.path.dirname(pkgs_file)
+
+    fd, tmp = tempfile.mkstemp(dir=pkgs_dir)
+    with os.fdopen(fd, "wb") as f:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) as gz:
+            gz.write(data)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, pkgs_file + ".gz")
+
+    fd, tmp = tempfile.mkstemp(dir=pkgs_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, pkgs_file)
+
+def unpack_package_to_cache(arg):
+    """
+    Unpack an ipk or deb into a PackageExtractCache entry. Returns None on
+    success or an error message.
+    """
+    import pickle
+    import tarfile
+
+    path, entry = arg
+    tmp = "%s.tmp.%d" % (entry, os.getpid())
+    try:
+        bb.utils.remove(tmp, True)
+        control_dir = os.path.join(tmp, "control")
+        data_dir = os.path.join(tmp, "data")
+        bb.utils.mkdirhier(control_dir)
+        bb.utils.mkdirhier(data_dir)
+
+        manifest = []
+        for name, member in package_members(path):
+            if name.startswith("control.tar"):
+                with tarfile.open(fileobj=member, mode="r|*") as tar:
+                    for info in tar:
+                        if info.isfile():
+                            script = os.path.join(control_dir, os.path.basename(info.name))
+                            with open(script, "wb") as f:
+                                f.write(tar.extractfile(info).read())
+                            os.chmod(script, info.mode & 0o7777)
+            elif name.startswith("data.tar"):
+                with tarfile.open(fileobj=member, mode="r|*") as tar:
+                    for info in tar:
+                        name = os.path.normpath("/" + info.name)
+                        if name == "/":
+                            continue
+                        linkname = info.linkname
+                        if info.islnk():
+                            linkname = os.path.normpath("/" + linkname)
+                        manifest.append((name, info.type, info.mode & 0o7777, info.uid, info.gid,
+                                         linkname, info.devmajor, info.devminor))
+                        # Device nodes and fifos are created in the rootfs
+                        # from the manifest, the cache only needs contents
+                        if info.isdev():
+                            continue
+                        if info.isdir():
+                            info.mode |= 0o700
+                        tar.extract(info, data_dir)
+
+        with open(os.path.join(tmp, "manifest"), "wb") as f:
+            pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another build unpacked the same package first
+            if not os.path.exists(os.path.join(entry, "manifest")):
+                raise
+            bb.utils.remove(tmp, True)
+    except Exception as e:
+        bb.utils.remove(tmp, True)
+        return "Unable to unpack %s into the package cache: %s" % (path, e)
+
+    return None
+
+class PackageExtractCache(object):
+    """
+    Unpacked ipk/deb packages under ${TMPDIR}/cache/rootfs-pkgs, keyed on
+    the md5sum of the package, from which a rootfs can be assembled without
+    unpacking every archive again.
+
+    Every file is copied into the rootfs, sharing extents with the cache
+    where the filesystem supports reflinks. Files are never hardlinked: the
+    rootfs is modified after assembly (chmod and chown from the archive,
+    postinsts, ROOTFS_POSTPROCESS_COMMAND) and with shared inodes those
+    changes would end up in the cache and in every later image. Ownership
+    and permissions always come from the archive, the pseudo database of
+    the image knows nothing about the cache.
+    """
+    def __init__(self, d):
+        self.cache_dir = d.expand("${TMPDIR}/cache/rootfs-pkgs")
+
+    def entry(self, md5):
+        return os.path.join(self.cache_dir, md5)
+
+    def populate(self, packages):
+        """
+        Unpack those of the (path, md5) packages which aren't in the cache
+        yet. Returns a list of error messages.
+        """
+        bb.utils.mkdirhier(self.cache_dir)
+
+        missing = []
+        for path, md5 in packages:
+            arg = (path, self.entry(md5))
+            if arg not in missing and not os.path.exists(os.path.join(arg[1], "manifest")):
+                missing.append(arg)
+
+        if len(missing) > 1:
+            return oe.utils.multiprocess_exec(missing, unpack_package_to_cache)
+        return [error for error in map(unpack_package_to_cache, missing) if error]
+
+    def control(self, md5):
+        """
+        Return a dict of control file name (control, postinst, ...) to its
+        path in the cache
+        """
+        control_dir = os.path.join(self.entry(md5), "control")
+        return dict((name, os.path.join(control_dir, name)) for name in os.listdir(control_dir))
+
+    def manifest(self, md5):
+        """
+        Return the (name, type, mode, uid, gid, linkname, devmajor, devminor)
+        tuples describing the contents of a cached package, names being
+        absolute paths and types tarfile types
+        """
+        import pickle
+
+        with open(os.path.join(self.entry(md5), "manifest"), "rb") as f:
+            return pickle.load(f)
+
+    def install(self, md5, rootfs):
+        """
+        Install a cached package into rootfs. Returns the paths of the
+        directories, files, links and nodes it installed.
+        """
+        import stat
+        import tarfile
+
+        data_dir = os.path.join(self.entry(md5), "data")
+        manifest = self.manifest(md5)
+
+        nodes = {tarfile.CHRTYPE: stat.S_IFCHR, tarfile.BLKTYPE: stat.S_IFBLK,
+                 tarfile.FIFOTYPE: stat.S_IFIFO}
+
+        installed = []
+        for name, kind, mode, uid, gid, linkname, major, minor in manifest:
+            dest = rootfs + name
+            if kind == tarfile.DIRTYPE:
+                if not os.path.isdir(dest):
+                    if os.path.lexists(dest):
+                        os.unlink(dest)
+                    os.makedirs(dest)
+            else:
+                if os.path.lexists(dest):
+                    if os.path.isdir(dest) and not os.path.islink(dest):
+                        bb.utils.remove(dest, True)
+                    else:
+                        os.unlink(dest)
+                bb.utils.mkdirhier(os.path.dirname(dest))
+
+                if kind == tarfile.SYMTYPE:
+                    os.symlink(linkname, dest)
+                elif kind == tarfile.LNKTYPE:
+                    os.link(rootfs + linkname, dest)
+                elif kind in nodes:
+                    os.mknod(dest, mode | nodes[kind], os.makedev(major, minor))
+                else:
+                    oe.path.clonefile(data_dir + name, dest)
+
+            installed.append(name)
+            if os.geteuid() == 0:
+                os.lchown(dest, uid, gid)
+            if kind != tarfile.SYMTYPE:
+                os.chmod(dest, mode)
+
+        return installed
+
+
 class Indexer(object, metaclass=ABCMeta):
     def __init__(self, d, deploy_dir):
         self.d = d
@@ -174,6 +526,7 @@ class RpmIndexer(Indexer):
             signer = None
         index_cmds = []
         repomd_files = []
+        caches = []
         rpm_dirs_found = False
         for arch in archs:
             dbpath = os.path.join(self.d.getVar('WORKDIR', True), 'rpmdb', arch)
@@ -183,11 +536,19 @@ class RpmIndexer(Indexer):
             if not os.path.isdir(arch_dir):
                 continue
 
+            rpm_dirs_found = True
+
+            repomd = os.path.join(arch_dir, 'repodata', 'repomd.xml')
+            repomd_files.append(repomd)
+
+            # Nothing to do if no packages were added, changed or removed
+            cache = FeedIndexCache(self.d, arch_dir, ".rpm")
+            if cache.unchanged(repomd):
+                continue
+
             index_cmds.append("%s --dbpath %s --update -q %s" % \
                              (rpm_createrepo, dbpath, arch_dir))
-            repomd_files.append(os.path.join(arch_dir, 'repodata', 'repomd.xml'))
-
-            rpm_dirs_found = True
+            caches.append(cache)
 
         if not rpm_dirs_found:
             bb.note("There are no packages in %s" % self.deploy_dir)
@@ -197,6 +558,8 @@ class RpmIndexer(Indexer):
         result = oe.utils.multiprocess_exec(index_cmds, create_index)
         if result:
             bb.fatal('%s' % ('\n'.join(result)))
+        for cache in caches:
+            cache.save()
         # Sign repomd
         if signer:
             for repomd in repomd_files:
@@ -214,7 +577,6 @@ class OpkgIndexer(Indexer):
                      "SDK_PACKAGE_ARCHS",
                      "MULTILIB_ARCHS"]
 
-        opkg_index_cmd = bb.utils.which(os.getenv('PATH'), "opkg-make-index")
         if self.d.getVar('PACKAGE_FEED_SIGN', True) == '1':
             signer = get_signer(self.d, self.d.getVar('PACKAGE_FEED_GPG_BACKEND', True))
         else:
@@ -223,7 +585,7 @@ class OpkgIndexer(Indexer):
         if not os.path.exists(os.path.join(self.deploy_dir, "Packages")):
             open(os.path.join(self.deploy_dir, "Packages"), "w").close()
 
-        index_cmds = set()
+        pkgs_dirs = set()
         index_sign_files = set()
         for arch_var in arch_vars:
             archs = self.d.getVar(arch_var, True)
@@ -237,21 +599,48 @@ class OpkgIndexer(Indexer):
                 if not os.path.isdir(pkgs_dir):
                     continue
 
-                if not os.path.exists(pkgs_file):
-                    open(pkgs_file, "w").close()
-
-                index_cmds.add('%s -r %s -p %s -m %s' %
-                                  (opkg_index_cmd, pkgs_file, pkgs_file, pkgs_dir))
-
+                pkgs_dirs.add(pkgs_dir)
                 index_sign_files.add(pkgs_file)
 
-        if len(index_cmds) == 0:
+        if len(pkgs_dirs) == 0:
             bb.note("There are no packages in %s!" % self.deploy_dir)
             return
 
-        result = oe.utils.multiprocess_exec(index_cmds, create_index)
-        if result:
-            bb.fatal('%s' % ('\n'.join(result)))
+        errors = []
+        for pkgs_dir in sorted(pkgs_dirs):
+            pkgs_file = os.path.join(pkgs_dir, "Packages")
+            cache = FeedIndexCache(self.d, pkgs_dir, ".ipk")
+            if cache.unchanged(pkgs_file):
+                continue
+
+            bb.note("Indexing %s" % pkgs_dir)
+            packages, read_errors = cache.read()
+            if read_errors:
+                errors.extend(read_errors)
+                continue
+
+            # As with opkg-make-index only the newest version of each
+            # package is listed
+            newest = {}
+            for name in sorted(packages):
+                fields = packages[name]["fields"]
+                key = (fields.get("Package"), fields.get("Architecture"))
+                if key in newest:
+                    other = packages[newest[key]]["fields"]
+                    if bb.utils.vercmp_string(fields.get("Version", ""), other.get("Version", "")) < 0:
+                        continue
+                newest[key] = name
+
+            stanzas = []
+            for name in sorted(newest.values()):
+                info = packages[name]
+                stanzas.append("%s\nMD5Sum: %s\nSize: %d\nFilename: %s\n" %
+                               (info["control"], info["md5"], info["size"], name))
+            write_feed_index(pkgs_file, stanzas)
+            cache.save()
+
+        if errors:
+            bb.fatal('%s' % ('\n'.join(errors)))
 
         if signer:
             feed_sig_type = self.d.getVar('PACKAGE_FEED_GPG_SIGNATURE_TYPE', True)
@@ -306,35 +695,54 @@ class DpkgIndexer(Indexer):
         arch_list.extend(arch for arch in all_mlb_pkg_arch_list if arch not in arch_list)
 
         apt_ftparchive = bb.utils.which(os.getenv('PATH'), "apt-ftparchive")
-        gzip = bb.utils.which(os.getenv('PATH'), "gzip")
 
         index_cmds = []
+        caches = []
+        errors = []
         deb_dirs_found = False
         for arch in arch_list:
             arch_dir = os.path.join(self.deploy_dir, arch)
             if not os.path.isdir(arch_dir):
                 continue
 
-            cmd = "cd %s; PSEUDO_UNLOAD=1 %s packages . > Packages;" % (arch_dir, apt_ftparchive)
+            deb_dirs_found = True
+
+            pkgs_file = os.path.join(arch_dir, "Packages")
+            cache = FeedIndexCache(self.d, arch_dir, ".deb")
+            if cache.unchanged(pkgs_file):
+                continue
+
+            bb.note("Indexing %s" % arch_dir)
+            packages, read_errors = cache.read()
+            if read_errors:
+                errors.extend(read_errors)
+                continue
 
-            cmd += "%s -fc Packages > Packages.gz;" % gzip
+            stanzas = []
+            for name in sorted(packages):
+                info = packages[name]
+                stanzas.append("%s\nFilename: ./%s\nSize: %d\nMD5sum: %s\nSHA1: %s\nSHA256: %s\n" %
+                               (info["control"], name, info["size"], info["md5"], info["sha1"], info["sha256"]))
+            write_feed_index(pkgs_file, stanzas)
 
             with open(os.path.join(arch_dir, "Release"), "w+") as release:
                 release.write("Label: %s\n" % arch)
 
-            cmd += "PSEUDO_UNLOAD=1 %s release . >> Release" % apt_ftparchive
-            
-            index_cmds.append(cmd)
-
-            deb_dirs_found = True
+            index_cmds.append("cd %s; PSEUDO_UNLOAD=1 %s release . >> Release" % (arch_dir, apt_ftparchive))
+            caches.append(cache)
 
         if not deb_dirs_found:
             bb.note("There are no packages in %s" % self.deploy_dir)
             return
 
+        if errors:
+            bb.fatal('%s' % ('\n'.join(errors)))
+
         result = oe.utils.multiprocess_exec(index_cmds, create_index)
         if result:
             bb.fatal('%s' % ('\n'.join(result)))
+        for cache in caches:
+            cache.save()
         if self.d.getVar('PACKAGE_FEED_SIGN', True) == '1':
             raise NotImplementedError('Package feed signing not implementd for dpkg')
 
@@ -1590,6 +1998,13 @@ class OpkgPM(OpkgDpkgPM):
 
         self.indexer = OpkgIndexer(self.d, self.deploy_dir)
 
+        # Only copies, sharing extents where possible, are supported:
+        # hardlinked files would let the rootfs modify the cache
+        self.pkg_cache_mode = self.d.getVar('ROOTFS_PKG_CACHE', True) or ""
+        if self.pkg_cache_mode not in ("", "reflink"):
+            bb.fatal("ROOTFS_PKG_CACHE must be empty or 'reflink', not '%s'"
+                     % self.pkg_cache_mode)
+
     """
     This function will change a package's status in /var/lib/opkg/status file.
     If 'packages' is None then the new_status will be applied to all
@@ -1748,6 +2163,12 @@ class OpkgPM(OpkgDpkgPM):
                                                    "intercept_scripts")
         os.environ['NATIVE_ROOT'] = self.d.getVar('STAGING_DIR_NATIVE', True)
 
+        # Attempt-only installs are left to opkg, which installs whatever
+        # it can rather than failing on the whole set
+        if self.pkg_cache_mode and not attempt_only and not self.from_feeds:
+            if self._install_from_cache(pkgs):
+                return
+
         try:
             bb.note("Installing the following packages: %s" % ' '.join(pkgs))
             bb.note(cmd)
@@ -1758,6 +2179,259 @@ class OpkgPM(OpkgDpkgPM):
                                               "Command '%s' returned %d:\n%s" %
                                               (cmd, e.returncode, e.output.decode("utf-8")))
 
+    """
+    Returns a dictionary of (package, version) to the path, md5sum and
+    provides of the package in the deploy directory feeds. Where a version
+    is available for several architectures the one with the highest
+    priority wins, as it does for opkg.
+    """
+    def _feed_packages(self):
+        feed = {}
+        for arch in self.pkg_archs.split():
+            pkgs_file = os.path.join(self.deploy_dir, arch, "Packages")
+            if not os.path.exists(pkgs_file):
+                continue
+
+            with open(pkgs_file, "r") as f:
+                for stanza in f.read().split("\n\n"):
+                    fields = dict(re.findall(r"^([\w-]+): (.*)$", stanza, re.M))
+                    if "Package" in fields and "Filename" in fields:
+                        feed[(fields["Package"], fields.get("Version"))] = \
+                            (os.path.join(self.deploy_dir, arch, fields["Filename"]),
+                             fields.get("MD5Sum"),
+                             self._provides(fields.get("Provides", "")))
+
+        return feed
+
+    """
+    Returns the stanzas of the opkg status file as an ordered dictionary
+    keyed on package name.
+    """
+    def _read_status(self):
+        from collections import OrderedDict
+
+        status = OrderedDict()
+        status_file = os.path.join(self.opkg_dir, "status")
+        if os.path.exists(status_file):
+            with open(status_file, "r") as f:
+                for stanza in f.read().split("\n\n"):
+                    m = re.match(r"^Package: (.*)$", stanza.strip("\n"), re.M)
+                    if m:
+                        status[m.group(1)] = stanza.strip("\n")
+
+        return status
+
+    """
+    Returns the package names listed in a Provides field, without versions
+    """
+    def _provides(self, field):
+        return [re.sub(r"\s*\(.*\)$", "", name.strip()) for name in field.split(",") if name.strip()]
+
+    def _write_status(self, status):
+        status_file = os.path.join(self.opkg_dir, "status")
+        with open(status_file + ".tmp", "w") as f:
+            for stanza in status.values():
+                f.write(stanza + "\n\n")
+        os.rename(status_file + ".tmp", status_file)
+
+    """
+    Returns a dictionary of the paths listed in the info/*.list files to
+    the package which installed them
+    """
+    def _file_owners(self):
+        owners = {}
+        info_dir = os.path.join(self.opkg_dir, "info")
+        if not os.path.isdir(info_dir):
+            return owners
+
+        for name in os.listdir(info_dir):
+            if name.endswith(".list"):
+                with open(os.path.join(info_dir, name), "r") as f:
+                    for line in f:
+                        path = line.rstrip("\n").split("\t")[0]
+                        if path:
+                            owners[path] = name[:-len(".list")]
+
+        return owners
+
+    """
+    Returns the fields of a control file as a dictionary
+    """
+    def _read_control(self, control_file):
+        fields = {}
+        with open(control_file, "r") as f:
+            for line in f:
+                if line and not line[0].isspace() and ":" in line:
+                    key, value = line.split(":", 1)
+                    fields[key] = value.strip()
+
+        return fields
+
+    """
+    Install packages from the package extraction cache (ROOTFS_PKG_CACHE).
+    opkg still resolves what to install, using --noaction, but the files are
+    copied from the cache and the opkg status and info files are written
+    here, after which the maintainer scripts are run as opkg would run them.
+    Packages whose postinst fails are left unpacked so that it is deferred
+    to first boot as usual. As with opkg, installing a file which another
+    package owns is an error unless the new package replaces that one.
+
+    Returns False if opkg has to install the packages itself, e.g. when
+    that would upgrade packages which are already installed.
+    """
+    def _install_from_cache(self, pkgs):
+        import hashlib
+        import tarfile
+        import time
+
+        cmd = "%s %s --noaction install %s" % (self.opkg_cmd, self.opkg_args, ' '.join(pkgs))
+        try:
+            bb.note(cmd)
+            output = subprocess.check_output(cmd.split(), stderr=subprocess.STDOUT).decode("utf-8")
+        except subprocess.CalledProcessError as e:
+            bb.fatal("Unable to install packages. Command '%s' "
+                     "returned %d:\n%s" % (cmd, e.returncode, e.output.decode("utf-8")))
+
+        if re.search(r"^(Upgrading|Downgrading) ", output, re.M):
+            bb.note("Upgrading installed packages, not using the package cache")
+            return False
+
+        feed = self._feed_packages()
+        to_install = []
+        provided = set()
+        for pkg, version in re.findall(r"^Installing (\S+) \((\S+)\) on \S+\.$", output, re.M):
+            path, md5, provides = feed.get((pkg, version), (None, None, []))
+            if not md5 or not os.path.exists(path):
+                bb.note("No indexed checksum for %s %s, not using the package cache" % (pkg, version))
+                return False
+            to_install.append((pkg, path, md5))
+            provided.add(pkg)
+            provided.update(provides)
+
+        # Anything requested which is neither about to be installed nor
+        # already installed means the output wasn't understood, leave it
+        # to opkg rather than silently installing nothing. Like opkg, count
+        # packages whose postinst is deferred (unpacked) as installed
+        for stanza in self._read_status().values():
+            fields = dict(re.findall(r"^([\w-]+): (.*)$", stanza, re.M))
+            if fields.get("Status", "").split()[-1:] in (["installed"], ["unpacked"]):
+                provided.add(fields["Package"])
+                provided.update(self._provides(fields.get("Provides", "")))
+
+        missing = [pkg for pkg in pkgs if pkg not in provided]
+        if missing:
+            bb.note("No package to install found for %s, not using the package cache"
+                    % ' '.join(missing))
+            return False
+
+        if not to_install:
+            bb.note(output)
+            return True
+
+        cache = PackageExtractCache(self.d)
+        errors = cache.populate([(path, md5) for _, path, md5 in to_install])
+        if errors:
+            bb.fatal("\n".join(errors))
+
+        controls = dict((pkg, self._read_control(cache.control(md5)["control"]))
+                        for pkg, _, md5 in to_install)
+
+        # Check for file clashes before touching the rootfs, opkg refuses
+        # them and OPKG_ARGS doesn't ask it to force overwrites
+        owners = self._file_owners()
+        clashes = []
+        for pkg, _, md5 in to_install:
+            replaces = self._provides(controls[pkg].get("Replaces", ""))
+            for name, kind, _, _, _, _, _, _ in cache.manifest(md5):
+                if kind == tarfile.DIRTYPE:
+                    continue
+                owner = owners.get(name)
+                if owner and owner != pkg and owner not in replaces and \
+                        not os.path.isdir(self.target_rootfs + name):
+                    clashes.append("Package %s wants to install file %s\n"
+                                   "\tBut that file is already provided by package  * %s"
+                                   % (pkg, self.target_rootfs + name, owner))
+                owners[name] = pkg
+        if clashes:
+            bb.fatal("Unable to install packages, file clashes:\n%s" % "\n".join(clashes))
+
+        bb.note("Installing the following packages from the package cache: %s"
+                % ' '.join(pkg for pkg, _, _ in to_install))
+
+        info_dir = os.path.join(self.opkg_dir, "info")
+        bb.utils.mkdirhier(info_dir)
+        status = self._read_status()
+        env = dict(os.environ, PKG_ROOT=self.target_rootfs)
+
+        def run_script(pkg, script, arg):
+            script = os.path.join(info_dir, "%s.%s" % (pkg, script))
+            if not os.path.exists(script):
+                return True
+            try:
+                bb.note("Executing %s %s for package: %s ..." % (os.path.basename(script), arg, pkg))
+                bb.note(subprocess.check_output([script, arg], stderr=subprocess.STDOUT,
+                                                env=env).decode("utf-8"))
+            except subprocess.CalledProcessError as e:
+                bb.note("%s for package %s failed with %d:\n%s" %
+                        (os.path.basename(script), pkg, e.returncode, e.output.decode("utf-8")))
+                return False
+            return True
+
+        stanzas = {}
+        def status_stanza(pkg, state):
+            stanza, index = stanzas[pkg]
+            return "\n".join(stanza[:index] + [stanza[index] + state] + stanza[index + 1:])
+
+        for pkg, path, md5 in to_install:
+            control = cache.control(md5)
+            for name in control:
+                shutil.copy2(control[name], os.path.join(info_dir, "%s.%s" % (pkg, name)))
+
+            conffiles = []
+            if "conffiles" in control:
+                with open(control["conffiles"], "r") as f:
+                    conffiles = [line.strip() for line in f if line.strip()]
+
+            if not run_script(pkg, "preinst", "install"):
+                bb.fatal("The preinst of %s failed, see the log for details" % pkg)
+
+            installed = cache.install(md5, self.target_rootfs)
+            with open(os.path.join(info_dir, "%s.list" % pkg), "w") as f:
+                f.write("".join(name + "\n" for name in installed))
+
+            fields = controls[pkg]
+            stanza = ["%s: %s" % (key, fields[key]) for key in
+                      ("Package", "Version", "Depends", "Recommends", "Suggests",
+                       "Provides", "Replaces", "Conflicts") if key in fields]
+            stanza.append("Status: install %s " % ("user" if pkg in pkgs else "ok"))
+            state = len(stanza) - 1
+            for key in ("Essential", "Architecture"):
+                if key in fields:
+                    stanza.append("%s: %s" % (key, fields[key]))
+            if conffiles:
+                stanza.append("Conffiles:")
+                for conffile in conffiles:
+                    if not os.path.isfile(self.target_rootfs + conffile):
+                        continue
+                    with open(self.target_rootfs + conffile, "rb") as f:
+                        stanza.append(" %s %s" % (conffile, hashlib.md5(f.read()).hexdigest()))
+            stanza.append("Installed-Time: %d" % time.time())
+            if pkg not in pkgs:
+                stanza.append("Auto-Installed: yes")
+            stanzas[pkg] = (stanza, state)
+
+            status[pkg] = status_stanza(pkg, "unpacked")
+
+        self._write_status(status)
+
+        for pkg, _, _ in to_install:
+            if run_script(pkg, "postinst", "configure"):
+                status[pkg] = status_stanza(pkg, "installed")
+
+        self._write_status(status)
+
+        return True
+
     def remove(self, pkgs, with_dependencies=True):
         if with_dependencies:
             cmd = "%s %s --force-depends --force-remove --force-removal-of-dependent-packages remove %s" % \
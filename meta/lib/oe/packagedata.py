@@ -1,5 +1,6 @@
 import codecs
 import os
+import time
 
 def packaged(pkg, d):
     return os.access(get_subpkgedata_fn(pkg, d) + '.packaged', os.R_OK)
@@ -59,24 +60,11 @@ def _pkgmap(d):
 
     pkgdatadir = d.getVar("PKGDATA_DIR", True)
 
-    pkgmap = {}
-    try:
-        files = os.listdir(pkgdatadir)
-    except OSError:
+    if not os.path.isdir(pkgdatadir):
         bb.warn("No files in %s?" % pkgdatadir)
-        files = []
+        return {}
 
-    for pn in [f for f in files if not os.path.isdir(os.path.join(pkgdatadir, f))]:
-        try:
-            pkgdata = read_pkgdatafile(os.path.join(pkgdatadir, pn))
-        except OSError:
-            continue
-
-        packages = pkgdata.get("PACKAGES") or ""
-        for pkg in packages.split():
-            pkgmap[pkg] = pn
-
-    return pkgmap
+    return PkgdataIndex(pkgdatadir).pkgmap()
 
 def pkgmap(d):
     """Return a dictionary mapping package to recipe name.
@@ -93,3 +81,190 @@ def recipename(pkg, d):
     """Return the recipe name for the given binary package name."""
 
     return pkgmap(d).get(pkg)
+
+class PkgdataIndex(object):
+    """
+    An sqlite index of a pkgdata directory mapping packages to their recipe,
+    runtime name and the paths they contain. It is kept in
+    ${PKGDATA_DIR}/.index and each time it is opened it is brought up to date
+    by re-reading only the pkgdata files that have been added, changed or
+    removed since it was last used.
+    """
+    version = "1"
+
+    def __init__(self, pkgdata_dir):
+        import sqlite3
+
+        self.pkgdata_dir = pkgdata_dir
+        try:
+            indexdir = os.path.join(pkgdata_dir, ".index")
+            os.makedirs(indexdir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(indexdir, "pkgdata.sqlite"), timeout=60)
+            self.db.isolation_level = None
+            self.update()
+        except (OSError, sqlite3.Error):
+            # Can't write to the pkgdata directory, index it in memory instead
+            self.db = sqlite3.connect(":memory:")
+            self.db.isolation_level = None
+            self.update()
+
+    def _create(self):
+        db = self.db
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row and row[0] == self.version:
+            return
+        for table in ("meta", "sources", "recipes", "packages", "packaged", "paths"):
+            db.execute("DROP TABLE IF EXISTS %s" % table)
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE sources (source TEXT PRIMARY KEY, mtime INTEGER, size INTEGER)")
+        db.execute("CREATE TABLE recipes (pn TEXT, pkg TEXT)")
+        db.execute("CREATE INDEX recipes_pn ON recipes (pn)")
+        db.execute("CREATE TABLE packages (pkg TEXT PRIMARY KEY, pn TEXT, rpkg TEXT)")
+        db.execute("CREATE INDEX packages_rpkg ON packages (rpkg)")
+        db.execute("CREATE TABLE packaged (pkg TEXT PRIMARY KEY)")
+        db.execute("CREATE TABLE paths (path TEXT, pkg TEXT)")
+        db.execute("CREATE INDEX paths_path ON paths (path)")
+        db.execute("CREATE INDEX paths_pkg ON paths (pkg)")
+        db.execute("INSERT INTO meta VALUES ('version', ?)", (self.version,))
+
+    def _index_recipe(self, pn, fn):
+        packages = read_pkgdatafile(fn).get("PACKAGES", "")
+        self.db.executemany("INSERT INTO recipes VALUES (?, ?)", [(pn, pkg) for pkg in packages.split()])
+
+    def _index_package(self, pkg, fn):
+        import json
+
+        values = read_pkgdatafile(fn)
+        def get(var):
+            return values.get("%s_%s" % (var, pkg), values.get(var))
+
+        self.db.execute("INSERT INTO packages VALUES (?, ?, ?)", (pkg, get("PN"), get("PKG") or pkg))
+        files_info = get("FILES_INFO")
+        if files_info:
+            self.db.executemany("INSERT INTO paths VALUES (?, ?)", [(path, pkg) for path in json.loads(files_info)])
+
+    def update(self):
+        """Re-read the pkgdata files which changed since the last update"""
+        db = self.db
+        runtimedir = os.path.join(self.pkgdata_dir, "runtime")
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            self._create()
+
+            # pkgdata is only ever replaced by sstate removing and installing
+            # files so the directory mtimes tell us if anything changed
+            stamp = []
+            newest = 0
+            for path in (self.pkgdata_dir, runtimedir):
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtime = 0
+                stamp.append(str(mtime))
+                newest = max(newest, mtime)
+            stamp = " ".join(stamp)
+            row = db.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+            if row and row[0] == stamp:
+                db.execute("COMMIT")
+                return
+
+            current = {}
+            packaged = set()
+            for name, path, isrecipe in self._sources():
+                if isrecipe is None:
+                    packaged.add(name)
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                current[(name, isrecipe)] = (path, st.st_mtime_ns, st.st_size)
+
+            stored = {}
+            for source, mtime, size in db.execute("SELECT source, mtime, size FROM sources"):
+                stored[source] = (mtime, size)
+
+            for (name, isrecipe), (path, mtime, size) in current.items():
+                source = name if isrecipe else "runtime/" + name
+                if stored.pop(source, None) == (mtime, size):
+                    continue
+                self._remove(source)
+                try:
+                    if isrecipe:
+                        self._index_recipe(name, path)
+                    else:
+                        self._index_package(name, path)
+                except (OSError, ValueError):
+                    continue
+                db.execute("INSERT INTO sources VALUES (?, ?, ?)", (source, mtime, size))
+
+            for source in stored:
+                self._remove(source)
+
+            db.execute("DELETE FROM packaged")
+            db.executemany("INSERT INTO packaged VALUES (?)", [(pkg,) for pkg in packaged])
+            # Something changing a directory again within its mtime
+            # granularity wouldn't be noticed, so only trust a stamp which
+            # has had time to settle
+            if time.time() - newest / 1e9 < 2:
+                stamp = ""
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (stamp,))
+            db.execute("COMMIT")
+        except:
+            db.execute("ROLLBACK")
+            raise
+
+    def _sources(self):
+        """
+        Yield (name, path, isrecipe) for the pkgdata files, isrecipe being
+        None for the .packaged markers
+        """
+        try:
+            entries = os.listdir(self.pkgdata_dir)
+        except OSError:
+            entries = []
+        for name in entries:
+            path = os.path.join(self.pkgdata_dir, name)
+            if not name.startswith(".") and os.path.isfile(path):
+                yield (name, path, True)
+
+        runtimedir = os.path.join(self.pkgdata_dir, "runtime")
+        try:
+            entries = os.listdir(runtimedir)
+        except OSError:
+            entries = []
+        for name in entries:
+            if name.endswith(".packaged"):
+                yield (name[:-len(".packaged")], None, None)
+            else:
+                yield (name, os.path.join(runtimedir, name), False)
+
+    def _remove(self, source):
+        db = self.db
+        db.execute("DELETE FROM sources WHERE source = ?", (source,))
+        if source.startswith("runtime/"):
+            pkg = source[len("runtime/"):]
+            db.execute("DELETE FROM packages WHERE pkg = ?", (pkg,))
+            db.execute("DELETE FROM paths WHERE pkg = ?", (pkg,))
+        else:
+            db.execute("DELETE FROM recipes WHERE pn = ?", (source,))
+
+    def pkgmap(self):
+        """Return a dictionary mapping package to recipe name."""
+        return dict((pkg, pn) for pn, pkg in self.db.execute("SELECT pn, pkg FROM recipes"))
+
+    def lookup_recipe(self, rpkg):
+        """Return the recipe which built the (packaged) runtime package rpkg, or None"""
+        row = self.db.execute("SELECT packages.pn FROM packages JOIN packaged ON packages.pkg = packaged.pkg "
+                              "WHERE packages.rpkg = ?", (rpkg,)).fetchone()
+        return row and row[0]
+
+    def find_path(self, pattern):
+        """
+        Return (pkg, path) for each path matching the shell wildcard pattern
+        (as in fnmatch.fnmatchcase) in the recipe-space packages
+        """
+        pattern = pattern.replace("[!", "[^")
+        return self.db.execute("SELECT pkg, path FROM paths WHERE path GLOB ? ORDER BY pkg, path", (pattern,)).fetchall()
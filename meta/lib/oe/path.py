@@ -68,21 +68,150 @@ def copytree(src, dst):
     cmd = 'tar -cf - -C %s -p . | tar -xf - -C %s' % (src, dst)
     check_output(cmd, shell=True, stderr=subprocess.STDOUT)
 
+def clonefile(src, dst):
+    """
+    Copy src to a new file dst along with its permissions and timestamps.
+    The data is shared with a reflink where the filesystem supports it
+    (btrfs, xfs) and is otherwise copied within the kernel by sendfile().
+    """
+    import fcntl
+
+    FICLONE = 0x40049409
+    with open(src, "rb") as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                size = os.fstat(fsrc.fileno()).st_size
+                offset = 0
+                try:
+                    while offset < size:
+                        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                        if not sent:
+                            break
+                        offset += sent
+                except OSError:
+                    fdst.seek(0)
+                    fdst.truncate()
+                    fsrc.seek(0)
+                    shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+
 def copyhardlinktree(src, dst):
-    """ Make the hard link when possible, otherwise copy. """
+    """
+    Replicate the tree at src into dst, hardlinking files where possible
+    and otherwise copying them with clonefile(). Existing files in dst are
+    replaced. Directories are all created first, then the files are linked
+    or copied by a pool of threads. Files hardlinked to each other in src
+    stay hardlinked in dst. Returns a (files, bytes) tuple for the tree.
+    """
+    import concurrent.futures
+    import stat
+
     bb.utils.mkdirhier(dst)
     if os.path.isdir(src) and not len(os.listdir(src)):
-        return	
-
-    if (os.stat(src).st_dev ==  os.stat(dst).st_dev):
-        # Need to copy directories only with tar first since cp will error if two 
-        # writers try and create a directory at the same time
-        cmd = 'cd %s; find . -type d -print | tar -cf - -C %s -p --files-from - --no-recursion | tar -xf - -C %s' % (src, src, dst)
-        check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-        cmd = 'cd %s; find . -print0 | cpio --null -pdlu %s' % (src, dst)
-        check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-    else:
-        copytree(src, dst)
+        return (0, 0)
+
+    isroot = os.geteuid() == 0
+    canlink = os.stat(src).st_dev == os.stat(dst).st_dev
+
+    def copymeta(path, st):
+        if isroot:
+            os.lchown(path, st.st_uid, st.st_gid)
+        if not stat.S_ISLNK(st.st_mode):
+            os.chmod(path, stat.S_IMODE(st.st_mode))
+
+    def replace(create, path):
+        # Other writers may be staging into the same tree, so retry if
+        # something reappears between the unlink and the create
+        while True:
+            try:
+                return create()
+            except FileExistsError:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def replicate(entries):
+        linked = 0
+        for s, d, st in entries:
+            if stat.S_ISLNK(st.st_mode):
+                target = os.readlink(s)
+                replace(lambda: os.symlink(target, d), d)
+                copymeta(d, st)
+            elif stat.S_ISREG(st.st_mode):
+                if canlink:
+                    try:
+                        replace(lambda: os.link(s, d), d)
+                        linked += 1
+                        continue
+                    except OSError as e:
+                        # Too many links, or protected_hardlinks
+                        if e.errno not in (errno.EMLINK, errno.EPERM, errno.EXDEV):
+                            raise
+                replace(lambda: clonefile(s, d), d)
+                if isroot:
+                    os.chown(d, st.st_uid, st.st_gid)
+            else:
+                replace(lambda: os.mknod(d, st.st_mode, st.st_rdev), d)
+                copymeta(d, st)
+        return linked
+
+    dirs = []
+    files = []
+    links = []
+    seen = {}
+    nbytes = 0
+    for walkroot, subdirs, names in os.walk(src):
+        dstdir = os.path.normpath(os.path.join(dst, os.path.relpath(walkroot, src)))
+        if not os.path.isdir(dstdir):
+            try:
+                os.mkdir(dstdir)
+            except FileExistsError:
+                if not os.path.isdir(dstdir):
+                    raise
+        if not os.path.islink(dstdir):
+            dirs.append((dstdir, os.lstat(walkroot)))
+
+        # os.walk() lists symlinks to directories in subdirs
+        for name in subdirs + names:
+            s = os.path.join(walkroot, name)
+            st = os.lstat(s)
+            if stat.S_ISDIR(st.st_mode):
+                continue
+            d = os.path.join(dstdir, name)
+            if stat.S_ISREG(st.st_mode):
+                if st.st_nlink > 1:
+                    key = (st.st_dev, st.st_ino)
+                    if key in seen:
+                        links.append((d, seen[key]))
+                        continue
+                    seen[key] = d
+                nbytes += st.st_size
+            files.append((s, d, st))
+
+    chunks = [files[i:i + 256] for i in range(0, len(files), 256)]
+    linked = 0
+    if chunks:
+        nproc = min(len(chunks), bb.utils.cpu_count())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+            linked = sum(executor.map(replicate, chunks))
+
+    for d, first in links:
+        replace(lambda: os.link(first, d), d)
+
+    # Permissions last, in case a directory isn't writable
+    for dstdir, st in reversed(dirs):
+        copymeta(dstdir, st)
+
+    nfiles = len(files) + len(links)
+    if canlink:
+        linked += len(links)
+    bb.debug(1, "Replicated %s to %s: %d files, %d bytes, %d hardlinked"
+             % (src, dst, nfiles, nbytes, linked))
+    return (nfiles, nbytes)
 
 def remove(path, recurse=True):
     """Equivalent to rm -f or rm -rf"""
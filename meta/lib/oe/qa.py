@@ -1,4 +1,4 @@
-import os, struct
+import mmap, os, stat, struct
 
 class NotELFFileError(Exception):
     pass
@@ -27,7 +27,42 @@ class ELFFile:
     ELFDATA2LSB  = 1
     ELFDATA2MSB  = 2
 
-    PT_INTERP = 3
+    PT_LOAD    = 1
+    PT_DYNAMIC = 2
+    PT_INTERP  = 3
+
+    # possible values for e_type
+    ET_REL  = 1
+    ET_EXEC = 2
+    ET_DYN  = 3
+
+    SHT_SYMTAB = 2
+
+    EM_MIPS = 8
+
+    # dynamic section tags
+    DT_NULL     = 0
+    DT_NEEDED   = 1
+    DT_STRTAB   = 5
+    DT_SYMTAB   = 6
+    DT_STRSZ    = 10
+    DT_SONAME   = 14
+    DT_RPATH    = 15
+    DT_TEXTREL  = 22
+    DT_RUNPATH  = 29
+    DT_GNU_HASH = 0x6ffffef5
+
+    # the tags returned by dynamic(), named as objdump -p prints them
+    dynamic_tags = {
+        DT_NEEDED   : "NEEDED",
+        DT_SYMTAB   : "SYMTAB",
+        DT_SONAME   : "SONAME",
+        DT_RPATH    : "RPATH",
+        DT_TEXTREL  : "TEXTREL",
+        DT_RUNPATH  : "RUNPATH",
+        DT_GNU_HASH : "GNU_HASH",
+    }
+    dynamic_string_tags = (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH)
 
     def my_assert(self, expectation, result):
         if not expectation == result:
@@ -38,6 +73,7 @@ class ELFFile:
         self.name = name
         self.bits = bits
         self.objdump_output = {}
+        self.dynamic_section = None
 
     def open(self):
         if not os.path.isfile(self.name):
@@ -116,6 +152,45 @@ class ELFFile:
                 return True
         return False
 
+    def elfType(self):
+        """
+        Return the object file type (e_type), e.g. ET_EXEC or ET_DYN
+        """
+        return self.getShort(0x10)
+
+    def hasSymtab(self):
+        """
+        Return True if there is a .symtab section, i.e. the file hasn't
+        been stripped. Only the section header table is read.
+        """
+        if self.bits == 32:
+            shoff = struct.unpack_from(self.sex+"I", self.data, 0x20)[0]
+            shentsize = self.getShort(0x2E)
+            shnum = self.getShort(0x30)
+        else:
+            shoff = struct.unpack_from(self.sex+"Q", self.data, 0x28)[0]
+            shentsize = self.getShort(0x3A)
+            shnum = self.getShort(0x3C)
+        if not shoff or not shentsize:
+            return False
+
+        with open(self.name, "rb") as f:
+            f.seek(shoff)
+            if not shnum:
+                # More sections than fit in e_shnum, the count is in the
+                # sh_size of the first section header
+                first = f.read(shentsize)
+                shnum = struct.unpack_from(self.sex + (self.bits == 32 and "I" or "Q"),
+                                           first, self.bits == 32 and 0x14 or 0x20)[0]
+                f.seek(shoff)
+            table = f.read(shnum * shentsize)
+
+        for i in range(0, min(shnum, len(table) // shentsize)):
+            sh_type = struct.unpack_from(self.sex+"I", table, i * shentsize + 4)[0]
+            if sh_type == ELFFile.SHT_SYMTAB:
+                return True
+        return False
+
     def machine(self):
         """
         We know the sex stored in self.sex and we
@@ -123,6 +198,87 @@ class ELFFile:
         """
         return self.getShort(ELFFile.E_MACHINE)
 
+    def programHeaders(self, f):
+        """
+        Return the program headers as (p_type, p_offset, p_vaddr, p_filesz)
+        tuples, reading the table from the open file f
+        """
+        if self.bits == 32:
+            phoff = struct.unpack_from(self.sex+"I", self.data, 0x1C)[0]
+            phentsize = self.getShort(0x2A)
+            phnum = self.getShort(0x2C)
+        else:
+            phoff = struct.unpack_from(self.sex+"Q", self.data, 0x20)[0]
+            phentsize = self.getShort(0x36)
+            phnum = self.getShort(0x38)
+        if not phoff or not phentsize:
+            return []
+
+        f.seek(phoff)
+        table = f.read(phnum * phentsize)
+
+        phdrs = []
+        for i in range(0, min(phnum, len(table) // phentsize)):
+            if self.bits == 32:
+                p_type, p_offset, p_vaddr, _, p_filesz = struct.unpack_from(self.sex+"5I", table, i * phentsize)
+            else:
+                p_type, _, p_offset, p_vaddr, _, p_filesz = struct.unpack_from(self.sex+"2I4Q", table, i * phentsize)
+            phdrs.append((p_type, p_offset, p_vaddr, p_filesz))
+        return phdrs
+
+    def dynamic(self):
+        """
+        Return the interesting entries of the dynamic section as a dict
+        mapping the tag name (as objdump -p prints it) to a list of values.
+        NEEDED, SONAME, RPATH and RUNPATH values are strings, the others are
+        the raw d_val. Statically linked files give an empty dict.
+        """
+        if self.dynamic_section is not None:
+            return self.dynamic_section
+
+        entries = []
+        strings = b""
+        with open(self.name, "rb") as f:
+            phdrs = self.programHeaders(f)
+            dynamic = [p for p in phdrs if p[0] == ELFFile.PT_DYNAMIC]
+            if dynamic:
+                f.seek(dynamic[0][1])
+                data = f.read(dynamic[0][3])
+
+                fmt = self.sex + (self.bits == 32 and "iI" or "qQ")
+                entsize = struct.calcsize(fmt)
+                strtab = strsz = None
+                for i in range(0, len(data) // entsize):
+                    tag, val = struct.unpack_from(fmt, data, i * entsize)
+                    if tag == ELFFile.DT_NULL:
+                        break
+                    elif tag == ELFFile.DT_STRTAB:
+                        strtab = val
+                    elif tag == ELFFile.DT_STRSZ:
+                        strsz = val
+                    elif tag in ELFFile.dynamic_tags:
+                        entries.append((tag, val))
+
+                # DT_STRTAB is an address, find the segment it was loaded from
+                if strtab is not None and strsz:
+                    for p_type, p_offset, p_vaddr, p_filesz in phdrs:
+                        if p_type == ELFFile.PT_LOAD and p_vaddr <= strtab < p_vaddr + p_filesz:
+                            f.seek(p_offset + strtab - p_vaddr)
+                            strings = f.read(strsz)
+                            break
+
+        self.dynamic_section = {}
+        for tag, val in entries:
+            if tag in ELFFile.dynamic_string_tags:
+                if val >= len(strings):
+                    continue
+                end = strings.find(b"\0", val)
+                if end < 0:
+                    end = len(strings)
+                val = strings[val:end].decode("utf-8", "replace")
+            self.dynamic_section.setdefault(ELFFile.dynamic_tags[tag], []).append(val)
+        return self.dynamic_section
+
     def run_objdump(self, cmd, d):
         import bb.process
         import sys
@@ -144,6 +300,140 @@ class ELFFile:
             bb.note("%s %s %s failed: %s" % (objdump, cmd, self.name, e))
             return ""
 
+class QAFile:
+    """
+    Information about a packaged file which is shared between the QA checks
+    and only read from disk when first asked for
+    """
+    def __init__(self, path, dynamic=None):
+        self.path = path
+        self.dynamic_section = dynamic
+        self._lstat = False
+        self._elf = False
+        self._data = None
+        self._found = {}
+
+    def lstat(self):
+        """Return the lstat() result, or None if the file has gone"""
+        if self._lstat is False:
+            try:
+                self._lstat = os.lstat(self.path)
+            except OSError:
+                self._lstat = None
+        return self._lstat
+
+    def islink(self):
+        st = self.lstat()
+        return st is not None and stat.S_ISLNK(st.st_mode)
+
+    def isreg(self):
+        st = self.lstat()
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def elf(self):
+        """Return an opened ELFFile, or None if this isn't an ELF file"""
+        if self._elf is False:
+            self._elf = ELFFile(self.path)
+            try:
+                self._elf.open()
+                if self.dynamic_section is not None:
+                    self._elf.dynamic_section = self.dynamic_section
+            except (IOError, NotELFFileError):
+                self._elf = None
+        return self._elf
+
+    def data(self):
+        """Return the contents of a regular file as a read-only mmap (or bytes)"""
+        if self._data is None:
+            self._data = b""
+            if self.isreg() and self.lstat().st_size:
+                with open(self.path, "rb") as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def contains(self, needle):
+        """Return True if the contents of the file include the string needle"""
+        if needle not in self._found:
+            self._found[needle] = self.data().find(needle.encode("utf-8")) != -1
+        return self._found[needle]
+
+    def close(self):
+        """Unmap the contents, everything else already looked up is kept"""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = None
+
+def elf_dynamic(path):
+    """
+    Return (path, dynamic section) for path, the second item being None if
+    path isn't an ELF file
+    """
+    elf = ELFFile(path)
+    try:
+        elf.open()
+        return (path, elf.dynamic())
+    except (IOError, NotELFFileError, struct.error):
+        return (path, None)
+
+def read_dynamic_sections(paths, d, prune=False):
+    """
+    Return a dict mapping each regular file in paths to its dynamic section
+    (see ELFFile.dynamic()), or None if it isn't an ELF file. The results are
+    kept in ${WORKDIR}/elf-dynamic.cache keyed on inode and mtime so that
+    do_package and do_package_qa only read each binary once. If prune is
+    set, paths covers every file of interest and the entries for any other
+    files are dropped from the cache.
+    """
+    import bb
+    import pickle
+    import tempfile
+
+    cachefile = d.expand("${WORKDIR}/elf-dynamic.cache")
+    try:
+        with open(cachefile, "rb") as f:
+            cache = pickle.load(f)
+    except Exception:
+        cache = {}
+
+    keys = {}
+    todo = []
+    for path in paths:
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        keys[path] = key
+        if key not in cache:
+            todo.append(path)
+
+    if todo:
+        if len(todo) >= 100:
+            import oe.utils
+            results = oe.utils.multiprocess_exec(todo, elf_dynamic)
+        else:
+            results = [elf_dynamic(path) for path in todo]
+        for path, dynamic in results:
+            cache[keys[path]] = dynamic
+
+    wanted = set(keys.values())
+    stale = prune and any(key not in wanted for key in cache)
+    if stale:
+        cache = dict((key, value) for key, value in cache.items() if key in wanted)
+
+    if todo or stale:
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cachefile))
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, cachefile)
+        except OSError as e:
+            bb.note("Unable to write %s: %s" % (cachefile, e))
+
+    return dict((path, cache[key]) for path, key in keys.items())
+
 if __name__ == "__main__":
     import sys
     elf = ELFFile(sys.argv[1])
@@ -0,0 +1,182 @@
+"""
+Creation and extraction of sstate archives.
+
+Archives are tar files compressed as a series of independent gzip members
+of up to BLOCK_SIZE bytes of input each, which are compressed (and on
+extraction decompressed) in parallel. Multi-member gzip files are still
+plain gzip, so the objects remain ordinary .tgz files which tar, gzip and
+sstate mirrors handle as before.
+
+Each member records the archive format version and its compressed size in
+a gzip extra field subfield (SI1 'S', SI2 'S'), similar to the BGZF format,
+so that the members can be located without decompressing the stream. Older
+archives lack the subfield and are decompressed serially.
+"""
+
+import collections
+import concurrent.futures
+import os
+import struct
+import tarfile
+import zlib
+
+FORMAT_VERSION = 1
+BLOCK_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# ID1 ID2 CM FLG(FEXTRA) MTIME XFL OS XLEN, then the SS subfield: SI1 SI2
+# LEN, format version and the total size of the member
+MEMBER_HEADER = struct.Struct("<BBBBIBBHBBHBI")
+MEMBER_TRAILER = struct.Struct("<II")
+
+def compress_block(data):
+    """Compress data into a complete gzip member carrying the SS subfield"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    size = MEMBER_HEADER.size + len(body) + MEMBER_TRAILER.size
+    header = MEMBER_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 255, 9,
+                                ord('S'), ord('S'), 5, FORMAT_VERSION, size)
+    return header + body + MEMBER_TRAILER.pack(zlib.crc32(data) & 0xffffffff,
+                                                 len(data) & 0xffffffff)
+
+def decompress_block(member):
+    """Decompress a gzip member created by compress_block()"""
+    data = zlib.decompress(member[MEMBER_HEADER.size:-MEMBER_TRAILER.size], -zlib.MAX_WBITS)
+    crc, size = MEMBER_TRAILER.unpack(member[-MEMBER_TRAILER.size:])
+    if crc != zlib.crc32(data) & 0xffffffff or size != len(data) & 0xffffffff:
+        raise tarfile.ReadError("sstate archive block failed its CRC check")
+    return data
+
+def member_size(header):
+    """
+    Return the size of the gzip member starting with header, or None if
+    it doesn't carry the SS subfield
+    """
+    if len(header) < MEMBER_HEADER.size:
+        return None
+    fields = MEMBER_HEADER.unpack(header[:MEMBER_HEADER.size])
+    if fields[:4] != (0x1f, 0x8b, 8, 4) or fields[7:11] != (9, ord('S'), ord('S'), 5):
+        return None
+    if fields[11] > FORMAT_VERSION:
+        raise tarfile.ReadError("sstate archive format %d is newer than the supported %d"
+                                % (fields[11], FORMAT_VERSION))
+    return fields[12]
+
+class BlockWriter(object):
+    """
+    File object which compresses what is written to it in BLOCK_SIZE blocks
+    on a thread pool, writing the members to fileobj in order. At most two
+    blocks per thread are in flight so memory use is bounded.
+    """
+    def __init__(self, fileobj, executor, threads):
+        self.fileobj = fileobj
+        self.executor = executor
+        self.pending = collections.deque()
+        self.limit = threads * 2
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        while len(self.buf) >= BLOCK_SIZE:
+            self._submit(bytes(self.buf[:BLOCK_SIZE]))
+            del self.buf[:BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        if len(self.pending) >= self.limit:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(compress_block, block))
+
+    def close(self):
+        if self.buf:
+            self._submit(bytes(self.buf))
+            self.buf = bytearray()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+class BlockReader(object):
+    """
+    File object returning the decompressed contents of a parallel sstate
+    archive, decompressing the members ahead of the reader on a thread pool
+    """
+    def __init__(self, fileobj, executor, threads):
+        self.fileobj = fileobj
+        self.executor = executor
+        self.pending = collections.deque()
+        self.limit = threads * 2
+        self.buf = b""
+        self.offset = 0
+        self.eof = False
+
+    def _fill(self):
+        while not self.eof and len(self.pending) < self.limit:
+            header = self.fileobj.read(MEMBER_HEADER.size)
+            if not header:
+                self.eof = True
+                break
+            size = member_size(header)
+            if size is None:
+                raise tarfile.ReadError("corrupt sstate archive block")
+            member = header + self.fileobj.read(size - len(header))
+            if len(member) != size:
+                raise tarfile.ReadError("truncated sstate archive")
+            self.pending.append(self.executor.submit(decompress_block, member))
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.offset >= len(self.buf):
+                self._fill()
+                if not self.pending:
+                    break
+                self.buf = self.pending.popleft().result()
+                self.offset = 0
+                continue
+            end = len(self.buf) if size < 0 else self.offset + size
+            chunk = self.buf[self.offset:end]
+            self.offset += len(chunk)
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+def create(path, srcdir, threads):
+    """
+    Create the sstate archive path from the contents of srcdir, using up to
+    threads threads for compression. The tar stream is produced as it is
+    compressed, there is no intermediate tar file.
+    """
+    with open(path, "wb") as f, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        writer = BlockWriter(f, executor, threads)
+        with tarfile.open(fileobj=writer, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+            for name in sorted(os.listdir(srcdir)):
+                tar.add(os.path.join(srcdir, name), arcname=name)
+        writer.close()
+
+def extract(path, destdir, threads):
+    """
+    Extract the sstate archive path into destdir, decompressing it on up to
+    threads threads and extracting as the data arrives. Archives in the old
+    single stream format are decompressed serially. Returns the names of
+    the extracted members.
+    """
+    with open(path, "rb") as f, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        if member_size(f.read(MEMBER_HEADER.size)) is not None:
+            f.seek(0)
+            tar = tarfile.open(fileobj=BlockReader(f, executor, threads), mode="r|")
+        else:
+            f.seek(0)
+            tar = tarfile.open(fileobj=f, mode="r|gz")
+
+        names = []
+        def members():
+            for member in tar:
+                names.append(member.name)
+                yield member
+
+        with tar:
+            tar.extractall(destdir, members=members())
+
+    return names
@@ -0,0 +1,153 @@
+import unittest
+import oe, oe.package, oe.qa
+import tempfile
+import struct
+import shutil
+import os
+from unittest import mock
+
+class TestIsElf(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_elf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_elf(self, name, e_type, sections):
+        """
+        Write a minimal 64-bit little endian ELF file with section
+        headers of the given sh_types
+        """
+        shoff = 64
+        header = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+        header += struct.pack("<HHIQQQIHHHHHH", e_type, 62, 1, 0, 0, shoff, 0, 64, 56, 0, 64, len(sections), 0)
+        table = b""
+        for sh_type in sections:
+            table += struct.pack("<II", 0, sh_type) + bytes(56)
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(header + table)
+        return path
+
+    def test_classify(self):
+        exe = self.write_elf("exe", oe.qa.ELFFile.ET_EXEC, [0, 1, oe.qa.ELFFile.SHT_SYMTAB])
+        lib = self.write_elf("lib.so", oe.qa.ELFFile.ET_DYN, [0, 1])
+        obj = self.write_elf("obj.o", oe.qa.ELFFile.ET_REL, [0, oe.qa.ELFFile.SHT_SYMTAB])
+        text = os.path.join(self.tmpdir, "script")
+        with open(text, "w") as f:
+            f.write("#!/bin/sh\n")
+
+        self.assertEqual(oe.package.is_elf(exe), (exe, 1 | 4))
+        self.assertEqual(oe.package.is_elf(lib), (lib, 1 | 2 | 8))
+        self.assertEqual(oe.package.is_elf(obj), (obj, 1))
+        self.assertEqual(oe.package.is_elf(text), (text, 0))
+        self.assertEqual(oe.package.is_elf(self.tmpdir), (self.tmpdir, 0))
+        self.assertEqual(oe.package.is_elf_files([exe, lib, text]), ({exe: 5, lib: 11, text: 0}, []))
+
+    def test_unreadable(self):
+        path = self.write_elf("exe", oe.qa.ELFFile.ET_EXEC, [0])
+        with mock.patch("builtins.open", side_effect=PermissionError(13, "Permission denied")):
+            with self.assertRaises(OSError):
+                oe.package.is_elf(path)
+            types, errors = oe.package.is_elf_files([path])
+        self.assertEqual(types, {path: 0})
+        self.assertEqual(errors, ["split_and_strip_files: unable to read %s: Permission denied" % path])
+
+class TestDynamic(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_elf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_elf(self, name, strings, dynamic):
+        """
+        Write a minimal 64-bit little endian ELF file with a PT_LOAD segment
+        covering the file and a PT_DYNAMIC segment with the given entries
+        """
+        strtab = 64 + 2 * 56
+        dynoff = strtab + len(strings)
+        dynamic = dynamic + [(oe.qa.ELFFile.DT_STRTAB, strtab), (oe.qa.ELFFile.DT_STRSZ, len(strings)), (0, 0)]
+        size = dynoff + len(dynamic) * 16
+
+        header = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+        header += struct.pack("<HHIQQQIHHHHHH", oe.qa.ELFFile.ET_DYN, 62, 1, 0, 64, 0, 0, 64, 56, 2, 64, 0, 0)
+        phdrs = struct.pack("<IIQQQQQQ", oe.qa.ELFFile.PT_LOAD, 5, 0, 0, 0, size, size, 0x1000)
+        phdrs += struct.pack("<IIQQQQQQ", oe.qa.ELFFile.PT_DYNAMIC, 6, dynoff, dynoff, dynoff, len(dynamic) * 16, len(dynamic) * 16, 8)
+        entries = b"".join(struct.pack("<qQ", tag, val) for tag, val in dynamic)
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(header + phdrs + strings + entries)
+        return path
+
+    def test_dynamic(self):
+        lib = self.write_elf("libfoo.so.1", b"\0libc.so.6\0libfoo.so.1\0$ORIGIN:/opt/lib\0",
+                             [(oe.qa.ELFFile.DT_NEEDED, 1), (oe.qa.ELFFile.DT_SONAME, 11),
+                              (oe.qa.ELFFile.DT_RPATH, 23), (oe.qa.ELFFile.DT_TEXTREL, 0)])
+        path, dynamic = oe.qa.elf_dynamic(lib)
+        self.assertEqual(dynamic, {"NEEDED": ["libc.so.6"], "SONAME": ["libfoo.so.1"],
+                                   "RPATH": ["$ORIGIN:/opt/lib"], "TEXTREL": [0]})
+
+        static = os.path.join(self.tmpdir, "static")
+        with open(lib, "rb") as f, open(static, "wb") as g:
+            data = bytearray(f.read())
+            # Turn the PT_DYNAMIC into a PT_NULL
+            data[64 + 56:64 + 56 + 4] = bytes(4)
+            g.write(data)
+        self.assertEqual(oe.qa.elf_dynamic(static), (static, {}))
+        self.assertEqual(oe.qa.elf_dynamic(self.tmpdir), (self.tmpdir, None))
+
+    def test_read_dynamic_sections(self):
+        import bb.data
+        import pickle
+
+        d = bb.data.init()
+        d.setVar("WORKDIR", self.tmpdir)
+        lib = self.write_elf("libfoo.so.1", b"\0libfoo.so.1\0", [(oe.qa.ELFFile.DT_SONAME, 1)])
+        text = os.path.join(self.tmpdir, "README")
+        with open(text, "w") as f:
+            f.write("not ELF")
+
+        sections = oe.qa.read_dynamic_sections([lib, text, self.tmpdir], d)
+        self.assertEqual(sections, {lib: {"SONAME": ["libfoo.so.1"]}, text: None})
+
+        def cached():
+            with open(os.path.join(self.tmpdir, "elf-dynamic.cache"), "rb") as f:
+                return len(pickle.load(f))
+
+        # Files not asked for are only dropped from the cache when pruning
+        self.assertEqual(oe.qa.read_dynamic_sections([lib], d), {lib: {"SONAME": ["libfoo.so.1"]}})
+        self.assertEqual(cached(), 2)
+        self.assertEqual(oe.qa.read_dynamic_sections([lib], d, prune=True), {lib: {"SONAME": ["libfoo.so.1"]}})
+        self.assertEqual(cached(), 1)
+
+class TestQAFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_elf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_qafile(self):
+        script = os.path.join(self.tmpdir, "script")
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\nexec /usr/bin/foo\n")
+        empty = os.path.join(self.tmpdir, "empty")
+        open(empty, "w").close()
+        link = os.path.join(self.tmpdir, "link")
+        os.symlink("script", link)
+
+        qafile = oe.qa.QAFile(script)
+        self.assertTrue(qafile.isreg())
+        self.assertFalse(qafile.islink())
+        self.assertIsNone(qafile.elf())
+        self.assertTrue(qafile.contains("/usr/bin/"))
+        self.assertFalse(qafile.contains("/usr/lib/"))
+        qafile.close()
+        # Results already looked up survive close()
+        self.assertTrue(qafile.contains("/usr/bin/"))
+
+        self.assertFalse(oe.qa.QAFile(empty).contains("/usr"))
+        self.assertTrue(oe.qa.QAFile(link).islink())
+        self.assertFalse(oe.qa.QAFile(link).contains("/usr"))
+        self.assertIsNone(oe.qa.QAFile(os.path.join(self.tmpdir, "missing")).lstat())
@@ -0,0 +1,362 @@
+import unittest
+import bb
+import oe, oe.package_manager
+import tempfile
+import tarfile
+import shutil
+import io
+import os
+import subprocess
+from unittest import mock
+
+def make_tar(entries, compression="gz"):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:" + compression) as tar:
+        for name, content, linkname in entries:
+            info = tarfile.TarInfo(name)
+            if content is None and linkname is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            elif linkname is not None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = linkname
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                info.mode = 0o755
+                tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+def make_ipk(path, control, data, compression="gz"):
+    members = [("debian-binary", b"2.0\n"),
+               ("control.tar." + compression, make_tar(control, compression)),
+               ("data.tar." + compression, make_tar(data, compression))]
+    with open(path, "wb") as f:
+        f.write(b"!<arch>\n")
+        for name, content in members:
+            f.write(("%-16s%-12s%-6s%-6s%-8s%-10d`\n" % (name + "/", 0, 0, 0, 100644, len(content))).encode("utf-8"))
+            f.write(content)
+            if len(content) & 1:
+                f.write(b"\n")
+
+class TestPackageExtractCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_package_manager")
+        self.d = bb.data.init()
+        self.d.setVar("TMPDIR", os.path.join(self.tmpdir, "tmp"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_install(self):
+        ipk = os.path.join(self.tmpdir, "foo.ipk")
+        make_ipk(ipk,
+                      [("./control", b"Package: foo\nVersion: 1.0\n", None),
+                       ("./conffiles", b"/etc/foo.conf\n", None)],
+                      [("./usr", None, None),
+                       ("./usr/bin", None, None),
+                       ("./usr/bin/foo", b"#!/bin/sh\n", None),
+                       ("./usr/bin/bar", None, "foo"),
+                       ("./etc", None, None),
+                       ("./etc/foo.conf", b"option=1\n", None)])
+
+        self.assertTrue(oe.package_manager.read_package_control(ipk).startswith("Package: foo"))
+
+        cache = oe.package_manager.PackageExtractCache(self.d)
+        self.assertEqual(cache.populate([(ipk, "0123"), (ipk, "0123")]), [])
+        self.assertEqual(sorted(cache.control("0123")), ["conffiles", "control"])
+
+        rootfs = os.path.join(self.tmpdir, "rootfs")
+        os.mkdir(rootfs)
+        installed = cache.install("0123", rootfs)
+        self.assertEqual(sorted(installed), ["/etc", "/etc/foo.conf", "/usr", "/usr/bin",
+                                             "/usr/bin/bar", "/usr/bin/foo"])
+
+        # The rootfs never shares inodes with the cache, changing it after
+        # assembly mustn't change the cache
+        cached = os.path.join(cache.entry("0123"), "data")
+        self.assertFalse(os.path.samefile(rootfs + "/usr/bin/foo", cached + "/usr/bin/foo"))
+        self.assertFalse(os.path.samefile(rootfs + "/etc/foo.conf", cached + "/etc/foo.conf"))
+        self.assertEqual(os.readlink(rootfs + "/usr/bin/bar"), "foo")
+        os.chmod(rootfs + "/usr/bin/foo", 0o700)
+        self.assertEqual(os.stat(cached + "/usr/bin/foo").st_mode & 0o7777, 0o755)
+
+        # Installing over an existing rootfs replaces the files
+        cache.install("0123", rootfs)
+        with open(rootfs + "/etc/foo.conf") as f:
+            self.assertEqual(f.read(), "option=1\n")
+
+    def test_bad_package(self):
+        bad = os.path.join(self.tmpdir, "bad.ipk")
+        with open(bad, "wb") as f:
+            f.write(b"not a package")
+
+        cache = oe.package_manager.PackageExtractCache(self.d)
+        errors = cache.populate([(bad, "4567")])
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(os.path.exists(cache.entry("4567")))
+
+class TestOpkgInstallFromCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_package_manager")
+        self.d = bb.data.init()
+        self.d.setVar("TMPDIR", os.path.join(self.tmpdir, "tmp"))
+
+        # An OpkgPM with just what _install_from_cache() needs, opkg itself
+        # is replaced by canned --noaction output
+        self.rootfs = os.path.join(self.tmpdir, "rootfs")
+        self.pm = oe.package_manager.OpkgPM.__new__(oe.package_manager.OpkgPM)
+        self.pm.d = self.d
+        self.pm.target_rootfs = self.rootfs
+        self.pm.opkg_dir = os.path.join(self.rootfs, "var/lib/opkg")
+        self.pm.opkg_cmd = "opkg"
+        self.pm.opkg_args = ""
+        self.pm.deploy_dir = os.path.join(self.tmpdir, "ipk")
+        self.pm.pkg_archs = "all"
+        os.makedirs(self.pm.opkg_dir)
+        os.makedirs(os.path.join(self.pm.deploy_dir, "all"))
+        self.stanzas = []
+
+        self.add_package("foo", "Depends: libbar\n", [("./usr/bin/foo", b"foo\n", None)],
+                         postinst=b"#!/bin/sh\nexit 0\n")
+        self.add_package("libbar", "Provides: bar\n", [("./usr/lib/libbar.so", b"bar\n", None)],
+                         postinst=b"#!/bin/sh\nexit 1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def add_package(self, name, fields, files, postinst=None):
+        import hashlib
+
+        control = [("./control", ("Package: %s\nVersion: 1.0\nArchitecture: all\n%s" % (name, fields)).encode("utf-8"), None)]
+        if postinst:
+            control.append(("./postinst", postinst, None))
+        dirs = set()
+        for path, _, _ in files:
+            parent = os.path.dirname(path)
+            while parent != ".":
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+        filename = "%s_1.0_all.ipk" % name
+        ipk = os.path.join(self.pm.deploy_dir, "all", filename)
+        make_ipk(ipk, control, [(d, None, None) for d in sorted(dirs)] + files)
+        with open(ipk, "rb") as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+
+        self.stanzas.append("Package: %s\nVersion: 1.0\n%sFilename: %s\nMD5Sum: %s\n"
+                            % (name, fields, filename, md5))
+        with open(os.path.join(self.pm.deploy_dir, "all", "Packages"), "w") as f:
+            f.write("\n".join(self.stanzas))
+
+    def install(self, pkgs, output):
+        check_output = subprocess.check_output
+        def fake_check_output(cmd, **kwargs):
+            if "--noaction" in cmd:
+                return output.encode("utf-8")
+            return check_output(cmd, **kwargs)
+
+        with mock.patch.object(oe.package_manager.subprocess, "check_output", side_effect=fake_check_output):
+            return self.pm._install_from_cache(pkgs)
+
+    def status(self):
+        return self.pm._read_status()
+
+    def test_install(self):
+        output = ("Installing libbar (1.0) on root.\n"
+                  "Installing foo (1.0) on root.\n")
+        self.assertTrue(self.install(["foo"], output))
+
+        self.assertTrue(os.path.isfile(os.path.join(self.rootfs, "usr/bin/foo")))
+        with open(os.path.join(self.pm.opkg_dir, "info", "foo.list")) as f:
+            self.assertEqual(f.read().split(), ["/usr", "/usr/bin", "/usr/bin/foo"])
+
+        status = self.status()
+        self.assertEqual(list(status), ["libbar", "foo"])
+        self.assertIn("Status: install user installed", status["foo"])
+        self.assertNotIn("Auto-Installed", status["foo"])
+        self.assertIn("Depends: libbar", status["foo"])
+        # A failing postinst leaves the package unpacked for first boot
+        self.assertIn("Status: install ok unpacked", status["libbar"])
+        self.assertIn("Auto-Installed: yes", status["libbar"])
+
+    def test_already_installed(self):
+        output = ("Installing libbar (1.0) on root.\n"
+                  "Installing foo (1.0) on root.\n")
+        self.assertTrue(self.install(["foo"], output))
+        # foo is installed, bar is provided by installed libbar
+        self.assertTrue(self.install(["foo", "bar"], "Package foo (1.0) installed in root is up to date.\n"))
+
+    def test_fallback(self):
+        # Upgrades, packages missing from the feed and output which doesn't
+        # account for every requested package are left to opkg
+        self.assertFalse(self.install(["foo"], "Upgrading foo on root from 0.9 to 1.0...\n"))
+        self.assertFalse(self.install(["foo"], "Installing foo (2.0) on root.\n"))
+        self.assertFalse(self.install(["foo"], "Installing libbar (1.0) on root.\n"))
+        self.assertFalse(self.install(["foo"], ""))
+        self.assertEqual(self.status(), {})
+        self.assertFalse(os.path.exists(os.path.join(self.rootfs, "usr")))
+
+    def test_clash(self):
+        self.add_package("other", "", [("./usr/bin/foo", b"other\n", None)])
+        self.assertTrue(self.install(["other"], "Installing other (1.0) on root.\n"))
+        with self.assertRaises(bb.BBHandledException):
+            self.install(["foo"], "Installing libbar (1.0) on root.\nInstalling foo (1.0) on root.\n")
+        with open(os.path.join(self.rootfs, "usr/bin/foo")) as f:
+            self.assertEqual(f.read(), "other\n")
+
+    def test_clash_replaces(self):
+        self.add_package("other", "", [("./usr/bin/foo", b"other\n", None)])
+        self.add_package("newfoo", "Replaces: other\n", [("./usr/bin/foo", b"new\n", None)])
+        self.assertTrue(self.install(["other"], "Installing other (1.0) on root.\n"))
+        self.assertTrue(self.install(["newfoo"], "Installing newfoo (1.0) on root.\n"))
+        with open(os.path.join(self.rootfs, "usr/bin/foo")) as f:
+            self.assertEqual(f.read(), "new\n")
+
+def serial_exec(commands, function):
+    return [result for result in map(function, commands) if result is not None]
+
+class TestFeedIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_package_manager")
+        self.d = bb.data.init()
+        self.d.setVar("TMPDIR", os.path.join(self.tmpdir, "tmp"))
+        self.deploy_dir = os.path.join(self.tmpdir, "deploy")
+        self.feed = os.path.join(self.deploy_dir, "all")
+        os.makedirs(self.feed)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def control(self, name, version):
+        return "Package: %s\nVersion: %s\nArchitecture: all\n" % (name, version)
+
+    def add_ipk(self, name, version):
+        path = os.path.join(self.feed, "%s_%s_all.ipk" % (name, version))
+        make_ipk(path, [("./control", self.control(name, version).encode("utf-8"), None)],
+                 [("./usr", None, None)])
+        return path
+
+    def add_old_ipk(self, name, version):
+        # Old style ipks are a tar.gz of the members rather than an ar archive
+        path = os.path.join(self.feed, "%s_%s_all.ipk" % (name, version))
+        with open(path, "wb") as f:
+            f.write(make_tar([("./debian-binary", b"2.0\n", None),
+                              ("./control.tar.gz", make_tar([("./control", self.control(name, version).encode("utf-8"), None)]), None),
+                              ("./data.tar.gz", make_tar([("./usr", None, None)]), None)]))
+        return path
+
+    def add_deb(self, name, version):
+        path = os.path.join(self.feed, "%s_%s_all.deb" % (name, version))
+        make_ipk(path, [("./control", self.control(name, version).encode("utf-8"), None)],
+                 [("./usr", None, None)], compression="xz")
+        return path
+
+    def checksums(self, path):
+        import hashlib
+
+        with open(path, "rb") as f:
+            data = f.read()
+        return (len(data), hashlib.md5(data).hexdigest(), hashlib.sha1(data).hexdigest(),
+                hashlib.sha256(data).hexdigest())
+
+    def read_index(self):
+        import gzip
+
+        with open(os.path.join(self.feed, "Packages")) as f:
+            index = f.read()
+        with gzip.open(os.path.join(self.feed, "Packages.gz"), "rt") as f:
+            self.assertEqual(f.read(), index)
+        return index
+
+    def test_read_package_control(self):
+        for path in (self.add_ipk("foo", "1.0"), self.add_old_ipk("bar", "1.0"), self.add_deb("baz", "1.0")):
+            name = os.path.basename(path).split("_")[0]
+            self.assertEqual(oe.package_manager.read_package_control(path), self.control(name, "1.0"))
+
+        bad = os.path.join(self.feed, "bad.ipk")
+        with open(bad, "wb") as f:
+            f.write(b"!<arch>\n")
+        with self.assertRaises(ValueError):
+            oe.package_manager.read_package_control(bad)
+
+    def test_cache(self):
+        foo = self.add_ipk("foo", "1.0")
+        indexfile = os.path.join(self.feed, "Packages")
+
+        cache = oe.package_manager.FeedIndexCache(self.d, self.feed, ".ipk")
+        self.assertFalse(cache.unchanged(indexfile))
+        packages, errors = cache.read()
+        self.assertEqual(errors, [])
+        self.assertEqual(packages["foo_1.0_all.ipk"]["fields"]["Version"], "1.0")
+        self.assertEqual(packages["foo_1.0_all.ipk"]["size"], self.checksums(foo)[0])
+        oe.package_manager.write_feed_index(indexfile, [])
+        cache.save()
+
+        # Nothing changed, so the feed needn't be reindexed and if it is
+        # the package isn't read again
+        cache = oe.package_manager.FeedIndexCache(self.d, self.feed, ".ipk")
+        self.assertTrue(cache.unchanged(indexfile))
+        with mock.patch.object(oe.package_manager, "read_feed_package") as read:
+            packages, errors = cache.read()
+            self.assertFalse(read.called)
+        self.assertEqual(list(packages), ["foo_1.0_all.ipk"])
+
+        # A changed mtime or size invalidates the entry
+        os.utime(foo, (0, 0))
+        cache = oe.package_manager.FeedIndexCache(self.d, self.feed, ".ipk")
+        self.assertFalse(cache.unchanged(indexfile))
+        with mock.patch.object(oe.package_manager, "read_feed_package",
+                               wraps=oe.package_manager.read_feed_package) as read:
+            cache.read()
+            read.assert_called_once_with(foo)
+        cache.save()
+
+        st = os.stat(foo)
+        with open(foo, "ab") as f:
+            f.write(b"\0\0")
+        os.utime(foo, ns=(st.st_atime_ns, st.st_mtime_ns))
+        cache = oe.package_manager.FeedIndexCache(self.d, self.feed, ".ipk")
+        self.assertFalse(cache.unchanged(indexfile))
+        with mock.patch.object(oe.package_manager, "read_feed_package",
+                               wraps=oe.package_manager.read_feed_package) as read:
+            cache.read()
+            read.assert_called_once_with(foo)
+
+    def test_opkg_index(self):
+        self.d.setVar("ALL_MULTILIB_PACKAGE_ARCHS", "all")
+        self.add_ipk("foo", "1.0")
+        foo = self.add_ipk("foo", "1.10")
+        self.add_ipk("foo", "1.9")
+        bar = self.add_old_ipk("bar", "1.0")
+
+        indexer = oe.package_manager.OpkgIndexer(self.d, self.deploy_dir)
+        with mock.patch.object(oe.package_manager.oe.utils, "multiprocess_exec", side_effect=serial_exec):
+            indexer.write_index()
+
+        expected = ""
+        for path in (bar, foo):
+            size, md5, _, _ = self.checksums(path)
+            name = os.path.basename(path)
+            expected += "%sMD5Sum: %s\nSize: %d\nFilename: %s\n\n" % (
+                        self.control(name.split("_")[0], name.split("_")[1]), md5, size, name)
+        self.assertEqual(self.read_index(), expected)
+
+    def test_dpkg_index(self):
+        self.d.setVar("PACKAGE_ARCHS", "all")
+        foo = self.add_deb("foo", "1.0")
+
+        def fake_exec(commands, function):
+            if function is oe.package_manager.create_index:
+                return []
+            return serial_exec(commands, function)
+
+        indexer = oe.package_manager.DpkgIndexer(self.d, self.deploy_dir)
+        with mock.patch.object(oe.package_manager.DpkgIndexer, "_create_configs"), \
+             mock.patch.object(oe.package_manager.oe.utils, "multiprocess_exec", side_effect=fake_exec):
+            indexer.write_index()
+
+        size, md5, sha1, sha256 = self.checksums(foo)
+        self.assertEqual(self.read_index(),
+                         "%sFilename: ./foo_1.0_all.deb\nSize: %d\nMD5sum: %s\nSHA1: %s\nSHA256: %s\n\n"
+                         % (self.control("foo", "1.0"), size, md5, sha1, sha256))
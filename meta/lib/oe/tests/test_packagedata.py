@@ -0,0 +1,50 @@
+import unittest
+import oe, oe.packagedata
+import tempfile
+import shutil
+import json
+import os
+
+class TestPkgdataIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_packagedata")
+        os.mkdir(os.path.join(self.tmpdir, "runtime"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_recipe(self, pn, packages):
+        with open(os.path.join(self.tmpdir, pn), "w") as f:
+            f.write("PACKAGES: %s\n" % " ".join(packages))
+
+    def write_pkg(self, pkg, pn, rpkg, files, packaged=True):
+        with open(os.path.join(self.tmpdir, "runtime", pkg), "w") as f:
+            f.write("PN: %s\n" % pn)
+            f.write("PKG_%s: %s\n" % (pkg, rpkg))
+            f.write("FILES_INFO: %s\n" % json.dumps(dict((path, 1) for path in files)))
+        if packaged:
+            open(os.path.join(self.tmpdir, "runtime", pkg + ".packaged"), "w").close()
+
+    def test_index(self):
+        self.write_recipe("glibc", ["glibc", "glibc-dev"])
+        self.write_pkg("glibc", "glibc", "libc6", ["/lib/libc.so.6", "/sbin/ldconfig"])
+        self.write_pkg("glibc-dev", "glibc", "libc6-dev", [], packaged=False)
+
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.pkgmap(), {"glibc": "glibc", "glibc-dev": "glibc"})
+        self.assertEqual(index.lookup_recipe("libc6"), "glibc")
+        self.assertIsNone(index.lookup_recipe("libc6-dev"))
+        self.assertEqual(index.find_path("/lib/*"), [("glibc", "/lib/libc.so.6")])
+        self.assertEqual(index.find_path("/[!l]*"), [("glibc", "/sbin/ldconfig")])
+
+        # Replace the recipe the way sstate would, removing the old files first
+        os.unlink(os.path.join(self.tmpdir, "glibc"))
+        for fn in ("glibc", "glibc.packaged", "glibc-dev"):
+            os.unlink(os.path.join(self.tmpdir, "runtime", fn))
+        self.write_recipe("musl", ["musl"])
+        self.write_pkg("musl", "musl", "libc6", ["/lib/libc.so"])
+
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.pkgmap(), {"musl": "musl"})
+        self.assertEqual(index.lookup_recipe("libc6"), "musl")
+        self.assertEqual(index.find_path("/lib/*"), [("musl", "/lib/libc.so")])
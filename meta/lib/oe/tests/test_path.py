@@ -87,3 +87,62 @@ class TestRealPath(unittest.TestCase):
         for e in self.EXCEPTIONS:
             self.assertRaisesRegex(OSError, r'\[Errno %u\]' % e[1],
                                     self.__realpath, e[0], False, False)
+
+class TestCopyHardlinkTree(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix = "oe-test_path")
+        self.src = os.path.join(self.tmpdir, "src")
+        self.dst = os.path.join(self.tmpdir, "dst")
+
+        os.makedirs(os.path.join(self.src, "usr/lib"))
+        os.makedirs(os.path.join(self.src, "ro"))
+        with open(os.path.join(self.src, "usr/lib/libfoo.so.1"), "w") as f:
+            f.write("foo")
+        os.link(os.path.join(self.src, "usr/lib/libfoo.so.1"),
+                 os.path.join(self.src, "usr/lib/libfoo-copy.so.1"))
+        os.symlink("libfoo.so.1", os.path.join(self.src, "usr/lib/libfoo.so"))
+        os.symlink("usr/lib", os.path.join(self.src, "lib"))
+        with open(os.path.join(self.src, "ro/file"), "w") as f:
+            f.write("bar")
+        os.chmod(os.path.join(self.src, "ro"), 0o555)
+
+    def tearDown(self):
+        os.chmod(os.path.join(self.src, "ro"), 0o755)
+        if os.path.isdir(os.path.join(self.dst, "ro")):
+            os.chmod(os.path.join(self.dst, "ro"), 0o755)
+        shutil.rmtree(self.tmpdir)
+
+    def test_copyhardlinktree(self):
+        self.assertEqual(oe.path.copyhardlinktree(self.src, self.dst), (5, 6))
+
+        for f in ("usr/lib/libfoo.so.1", "usr/lib/libfoo-copy.so.1", "ro/file"):
+            self.assertTrue(os.path.samefile(os.path.join(self.src, f), os.path.join(self.dst, f)))
+        self.assertEqual(os.readlink(os.path.join(self.dst, "usr/lib/libfoo.so")), "libfoo.so.1")
+        self.assertEqual(os.readlink(os.path.join(self.dst, "lib")), "usr/lib")
+        self.assertEqual(os.stat(os.path.join(self.dst, "ro")).st_mode & 0o777, 0o555)
+
+        # Existing files are replaced
+        os.chmod(os.path.join(self.dst, "ro"), 0o755)
+        os.unlink(os.path.join(self.dst, "usr/lib/libfoo.so.1"))
+        with open(os.path.join(self.dst, "usr/lib/libfoo.so.1"), "w") as f:
+            f.write("stale")
+        oe.path.copyhardlinktree(self.src, self.dst)
+        self.assertTrue(os.path.samefile(os.path.join(self.src, "usr/lib/libfoo.so.1"),
+                                         os.path.join(self.dst, "usr/lib/libfoo.so.1")))
+
+    @unittest.skipUnless(os.geteuid() == 0, "changing ownership needs root (or pseudo)")
+    def test_copyhardlinktree_owner(self):
+        os.lchown(os.path.join(self.src, "usr/lib/libfoo.so"), 1234, 1234)
+        oe.path.copyhardlinktree(self.src, self.dst)
+        st = os.lstat(os.path.join(self.dst, "usr/lib/libfoo.so"))
+        self.assertEqual((st.st_uid, st.st_gid), (1234, 1234))
+
+    def test_clonefile(self):
+        src = os.path.join(self.src, "usr/lib/libfoo.so.1")
+        os.chmod(src, 0o751)
+        oe.path.clonefile(src, self.dst)
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), "foo")
+        self.assertFalse(os.path.samefile(src, self.dst))
+        self.assertEqual(os.stat(self.dst).st_mode & 0o777, 0o751)
+        self.assertRaises(FileExistsError, oe.path.clonefile, src, self.dst)
@@ -0,0 +1,52 @@
+import unittest
+import oe, oe.sstatearchive
+import subprocess
+import tempfile
+import shutil
+import os
+
+class TestSstateArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatearchive")
+        self.src = os.path.join(self.tmpdir, "src")
+        os.makedirs(os.path.join(self.src, "sysroot-destdir/usr/lib"))
+        os.makedirs(os.path.join(self.src, "empty"))
+        lib = os.path.join(self.src, "sysroot-destdir/usr/lib/libfoo.so.1")
+        with open(lib, "wb") as f:
+            f.write(os.urandom(oe.sstatearchive.BLOCK_SIZE) + b"foo" * oe.sstatearchive.BLOCK_SIZE)
+        os.link(lib, lib + ".hardlink")
+        os.symlink("libfoo.so.1", os.path.join(self.src, "sysroot-destdir/usr/lib/libfoo.so"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameTree(self, dest):
+        subprocess.check_call(["diff", "-r", self.src, dest])
+        lib = os.path.join(dest, "sysroot-destdir/usr/lib/libfoo.so.1")
+        self.assertTrue(os.path.samefile(lib, lib + ".hardlink"))
+        self.assertEqual(os.readlink(os.path.join(dest, "sysroot-destdir/usr/lib/libfoo.so")), "libfoo.so.1")
+
+    def test_roundtrip(self):
+        archive = os.path.join(self.tmpdir, "sstate.tgz")
+        oe.sstatearchive.create(archive, self.src, 4)
+
+        dest = os.path.join(self.tmpdir, "dest")
+        os.mkdir(dest)
+        names = oe.sstatearchive.extract(archive, dest, 4)
+        self.assertIn("sysroot-destdir/usr/lib/libfoo.so", names)
+        self.assertSameTree(dest)
+
+        # The archive is still a valid .tgz for other tools
+        dest = os.path.join(self.tmpdir, "tar")
+        os.mkdir(dest)
+        subprocess.check_call(["tar", "-xzf", archive, "-C", dest])
+        self.assertSameTree(dest)
+
+    def test_old_format(self):
+        archive = os.path.join(self.tmpdir, "sstate.tgz")
+        subprocess.check_call(["tar", "-czf", archive, "-C", self.src, "empty", "sysroot-destdir"])
+
+        dest = os.path.join(self.tmpdir, "dest")
+        os.mkdir(dest)
+        oe.sstatearchive.extract(archive, dest, 4)
+        self.assertSameTree(dest)
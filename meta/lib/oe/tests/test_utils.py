@@ -1,4 +1,5 @@
 import unittest
+import oe.utils
 from oe.utils import packages_filter_out_system
 
 class TestPackagesFilterOutSystem(unittest.TestCase):
@@ -49,3 +50,53 @@ class TestTrimVersion(unittest.TestCase):
         self.assertEqual(trim_version("1.2.3", 2), "1.2")
         self.assertEqual(trim_version("1.2.3", 3), "1.2.3")
         self.assertEqual(trim_version("1.2.3", 4), "1.2.3")
+
+
+def square_or_none(x):
+    return x * x if x % 3 else None
+
+def fail_on_seven(x):
+    if x == 7:
+        raise RuntimeError("seven")
+    return x
+
+class TestMultiprocessExec(unittest.TestCase):
+    def test_results(self):
+        items = list(range(1, 1000))
+        self.assertEqual(oe.utils.multiprocess_exec(items, square_or_none),
+                         [square_or_none(x) for x in items if x % 3])
+        self.assertEqual(oe.utils.multiprocess_exec([], square_or_none), [])
+
+        # The pool is reused by later calls
+        pool = oe.utils.multiprocess_pool()[0]
+        oe.utils.multiprocess_exec([1, 2], square_or_none)
+        self.assertIs(oe.utils.multiprocess_pool()[0], pool)
+
+    def test_imap(self):
+        results = oe.utils.multiprocess_imap(square_or_none, iter(range(1, 100000)), chunksize=10)
+        self.assertEqual(next(results), 1)
+        self.assertEqual(next(results), 4)
+        results.close()
+
+    def test_exception(self):
+        with self.assertRaises(oe.utils.MultiprocessExecError) as cm:
+            oe.utils.multiprocess_exec(list(range(20)), fail_on_seven)
+        self.assertEqual(cm.exception.item, 7)
+        self.assertIn("RuntimeError: seven", cm.exception.tb)
+        self.assertEqual(oe.utils.multiprocess_exec([2], square_or_none), [4])
+
+class TestThreadedPool(unittest.TestCase):
+    def test_exception(self):
+        done = []
+        def task(worker, n):
+            if n == 3:
+                raise ValueError("three")
+            done.append(n)
+
+        pool = oe.utils.ThreadedPool(4, 10)
+        for n in range(10):
+            pool.add_task(task, n)
+        pool.start()
+        with self.assertRaises(ValueError):
+            pool.wait_completion()
+        self.assertEqual(sorted(done), [0, 1, 2, 4, 5, 6, 7, 8, 9])
@@ -5,6 +5,8 @@ except ImportError:
     # Python 3
     import subprocess as cmdstatus
 
+import atexit
+
 def read_file(filename):
     try:
         f = open( filename, "r" )
@@ -175,34 +177,146 @@ def execute_pre_post_process(d, cmds):
             bb.note("Executing %s ..." % cmd)
             bb.build.exec_func(cmd, d)
 
-def multiprocess_exec(commands, function):
+class MultiprocessExecError(Exception):
+    """
+    Raised in the parent when a function run by multiprocess_exec() or
+    multiprocess_imap() raises, carrying the worker's traceback
+    """
+    def __init__(self, item, tb):
+        Exception.__init__(self, item, tb)
+        self.item = item
+        self.tb = tb
+
+    def __str__(self):
+        return "Processing %r failed:\n%s" % (self.item, self.tb)
+
+def _multiprocess_init():
     import signal
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Don't outlive the task process, which may exit with os._exit()
+    try:
+        bb.utils.signal_on_parent_exit("SIGTERM")
+    except Exception:
+        pass
+
+def _multiprocess_chunk(arg):
+    function, chunk = arg
+    results = []
+    for item in chunk:
+        try:
+            results.append(function(item))
+        except Exception:
+            import traceback
+            raise MultiprocessExecError(item, traceback.format_exc())
+    return results
+
+_multiprocess_pool = None
+
+def multiprocess_pool():
+    """
+    Return (pool, size) for the worker pool shared by multiprocess_imap()
+    calls in this process. The pool is kept for the life of the process
+    (normally a task) so that each call doesn't pay for forking workers,
+    and is recreated if the environment or working directory it was forked
+    with has changed since, as the workers wouldn't see the change.
+    """
     import multiprocessing
 
-    if not commands:
-        return []
+    global _multiprocess_pool
+
+    state = (os.getpid(), os.getcwd(), dict(os.environ))
+    if _multiprocess_pool is not None:
+        pool, nproc, poolstate = _multiprocess_pool
+        if poolstate == state:
+            return pool, nproc
+        if poolstate[0] == state[0]:
+            pool.terminate()
+            pool.join()
+        _multiprocess_pool = None
+
+    nproc = multiprocessing.cpu_count()
+    pool = bb.utils.multiprocessingpool(nproc, _multiprocess_init)
+    _multiprocess_pool = (pool, nproc, state)
+    return pool, nproc
 
-    def init_worker():
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
+def _multiprocess_pool_exit():
+    global _multiprocess_pool
 
-    nproc = min(multiprocessing.cpu_count(), len(commands))
-    pool = bb.utils.multiprocessingpool(nproc, init_worker)
-    imap = pool.imap(function, commands)
+    if _multiprocess_pool is not None and _multiprocess_pool[2][0] == os.getpid():
+        _multiprocess_pool[0].terminate()
+    _multiprocess_pool = None
+
+atexit.register(_multiprocess_pool_exit)
+
+def multiprocess_imap(function, items, chunksize=None):
+    """
+    Run function over items in the shared worker pool, yielding the results
+    in order as they become available. items are sent to the workers in
+    chunks of chunksize and at most two chunks per worker are outstanding,
+    so items can be a lazy iterable and a slow consumer holds the workers
+    back rather than buffering every result. function must be picklable,
+    i.e. defined at module level. Exceptions in function are raised here
+    as MultiprocessExecError.
+    """
+    import collections
+    import itertools
+    import threading
 
+    global _multiprocess_pool
+
+    if threading.current_thread() is threading.main_thread():
+        pool, nproc = multiprocess_pool()
+        private = False
+    else:
+        # Pool workers die with the thread which forked them, so threads
+        # get a pool of their own
+        nproc = cpu_count()
+        pool = bb.utils.multiprocessingpool(nproc, _multiprocess_init)
+        private = True
+
+    if chunksize is None:
+        if hasattr(items, "__len__"):
+            chunksize = max(1, min(256, len(items) // (nproc * 4)))
+        else:
+            chunksize = 16
+
+    items = iter(items)
+    pending = collections.deque()
     try:
-        res = list(imap)
-        pool.close()
-        pool.join()
-        results = []
-        for result in res:
-            if result is not None:
-                results.append(result)
-        return results
-
-    except KeyboardInterrupt:
-        pool.terminate()
-        pool.join()
+        while True:
+            while len(pending) < nproc * 2:
+                chunk = list(itertools.islice(items, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.apply_async(_multiprocess_chunk, ((function, chunk),)))
+            if not pending:
+                break
+            # Wait with a timeout so that signals are handled promptly
+            for result in pending.popleft().get(threading.TIMEOUT_MAX):
+                yield result
+    except BaseException:
+        # Don't leave the workers busy with the rest of an abandoned run
+        if pending:
+            pool.terminate()
+            pool.join()
+            if not private:
+                _multiprocess_pool = None
         raise
+    finally:
+        if private:
+            pool.close()
+            pool.join()
+
+def multiprocess_exec(commands, function):
+    """
+    Run function over commands in the shared worker pool, returning the
+    results which aren't None, in order
+    """
+    if not commands:
+        return []
+
+    return [result for result in multiprocess_imap(function, commands) if result is not None]
 
 def squashspaces(string):
     import re
@@ -240,44 +354,48 @@ from threading import Thread
 
 class ThreadedWorker(Thread):
     """Thread executing tasks from a given tasks queue"""
-    def __init__(self, tasks, worker_init, worker_end):
+    def __init__(self, tasks, errors, worker_init, worker_end):
         Thread.__init__(self)
         self.tasks = tasks
+        self.errors = errors
         self.daemon = True
 
         self.worker_init = worker_init
         self.worker_end = worker_end
 
     def run(self):
-        from queue import Empty
-
         if self.worker_init is not None:
             self.worker_init(self)
 
         while True:
-            try:
-                func, args, kargs = self.tasks.get(block=False)
-            except Empty:
-                if self.worker_end is not None:
-                    self.worker_end(self)
+            task = self.tasks.get()
+            if task is None:
+                # Sentinel from wait_completion()
                 break
 
+            func, args, kargs = task
             try:
                 func(self, *args, **kargs)
             except Exception as e:
-                print(e)
-            finally:
-                self.tasks.task_done()
+                self.errors.append(e)
+
+        if self.worker_end is not None:
+            self.worker_end(self)
 
 class ThreadedPool:
-    """Pool of threads consuming tasks from a queue"""
+    """
+    Pool of threads consuming tasks from a queue. Tasks may be added before
+    or after start(). The first exception raised by a task is re-raised by
+    wait_completion(), with its original traceback.
+    """
     def __init__(self, num_workers, num_tasks, worker_init=None,
             worker_end=None):
         self.tasks = Queue(num_tasks)
+        self.errors = []
         self.workers = []
 
         for _ in range(num_workers):
-            worker = ThreadedWorker(self.tasks, worker_init, worker_end)
+            worker = ThreadedWorker(self.tasks, self.errors, worker_init, worker_end)
             self.workers.append(worker)
 
     def start(self):
@@ -290,9 +408,12 @@ class ThreadedPool:
 
     def wait_completion(self):
         """Wait for completion of all the tasks in the queue"""
-        self.tasks.join()
+        for worker in self.workers:
+            self.tasks.put(None)
         for worker in self.workers:
             worker.join()
+        if self.errors:
+            raise self.errors[0]
 
 def write_ld_so_conf(d):
     # Some utils like prelink may not have the correct target library paths